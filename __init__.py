@@ -2,7 +2,9 @@ from .nodes.api_key import KLingAIAPIKey
 from .nodes.text2video import KLingAIText2Video
 from .nodes.query_status import KLingAIQueryStatus
 from .nodes.video_downloader import KLingAIVideoDownloader
+from .nodes.video_frames import KLingAIVideoFrames
 from .nodes.image2video import KLingAIImage2Video
+from .nodes.image2video_batch import KLingAIImage2VideoBatch
 from .nodes.multi_image2video import KLingAIMultiImage2Video
 from .nodes.multi_image2image import KLingAIMultiImage2Image
 from .nodes.lip_sync import KLingAILipSync
@@ -10,8 +12,13 @@ from .nodes.lip_sync_async import KLingAILipSyncAsync
 from .nodes.image_generation import KLingAIImageGeneration
 from .nodes.image_downloader import KLingAIImageDownloader
 from .nodes.hybrid_video import KLingAIHybridVideo
-import os
-import folder_paths
+from .nodes.await_task import KLingAIAwaitTask
+from .nodes.text2video_batch import KLingAIText2VideoBatch
+from .nodes.server_routes import register_routes
+from .nodes.scratch import get_scratch
+
+# 节点模块只在顶层导入标准库，torch/numpy/PIL/pydub/jwt/requests 在节点首次执行时才加载
+# 启动耗时可用 benchmarks/import_time.py 检查
 
 # 注册节点映射
 NODE_CLASS_MAPPINGS = {
@@ -22,11 +29,15 @@ NODE_CLASS_MAPPINGS = {
     "JM-KLingAI-API/multi-image2image": KLingAIMultiImage2Image,
     "JM-KLingAI-API/query-status": KLingAIQueryStatus,
     "JM-KLingAI-API/video-downloader": KLingAIVideoDownloader,
+    "JM-KLingAI-API/video-frames": KLingAIVideoFrames,
     "JM-KLingAI-API/lip-sync": KLingAILipSync,
     "JM-KLingAI-API/lip-sync-async": KLingAILipSyncAsync,
     "JM-KLingAI-API/image-generation": KLingAIImageGeneration,
     "JM-KLingAI-API/image-downloader": KLingAIImageDownloader,
-    "JM-KLingAI-API/hybrid-video": KLingAIHybridVideo
+    "JM-KLingAI-API/hybrid-video": KLingAIHybridVideo,
+    "JM-KLingAI-API/await-task": KLingAIAwaitTask,
+    "JM-KLingAI-API/text2video-batch": KLingAIText2VideoBatch,
+    "JM-KLingAI-API/image2video-batch": KLingAIImage2VideoBatch
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
@@ -37,13 +48,23 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "JM-KLingAI-API/multi-image2image": "KLingAI Multi-Image to Image",
     "JM-KLingAI-API/query-status": "KLingAI Query Status",
     "JM-KLingAI-API/video-downloader": "KLingAI Video Downloader",
+    "JM-KLingAI-API/video-frames": "KLingAI Video Frames",
     "JM-KLingAI-API/lip-sync": "KLingAI Lip Sync",
     "JM-KLingAI-API/lip-sync-async": "KLingAI Lip Sync Async",
     "JM-KLingAI-API/image-generation": "KLingAI Image Generation",
     "JM-KLingAI-API/image-downloader": "KLingAI Image Downloader",
-    "JM-KLingAI-API/hybrid-video": "KLingAI 混合视频生成"
+    "JM-KLingAI-API/hybrid-video": "KLingAI 混合视频生成",
+    "JM-KLingAI-API/await-task": "KLingAI Await Task",
+    "JM-KLingAI-API/text2video-batch": "KLingAI Text to Video Batch",
+    "JM-KLingAI-API/image2video-batch": "KLingAI Image to Video Batch"
 }
 
+# 在ComfyUI服务器上注册指标接口（/jm-kling/metrics），独立运行时跳过
+register_routes()
+
+# 在后台线程清理过期和超出总大小上限的临时工作目录
+get_scratch()
+
 # 导出节点映射
 __all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS"]
 
@@ -0,0 +1,116 @@
+"""
+插件启动耗时基准
+
+用 `python -X importtime` 在子进程中按ComfyUI的方式加载插件，统计插件导入的累计耗时，
+并检查导入和调用所有节点的 INPUT_TYPES 之后没有加载重量级依赖。
+
+用法:
+    python benchmarks/import_time.py [--max-ms 150] [--json]
+
+超过耗时预算或加载了重量级依赖时返回非0退出码，可用于CI防止启动耗时回退。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_MODULE = "jm_kling_api_import_bench"
+
+# 这些模块不应该在ComfyUI启动时被插件加载
+HEAVY_MODULES = ["torch", "numpy", "PIL", "pydub", "jwt", "requests", "folder_paths"]
+
+# 在子进程中执行：仿照ComfyUI的custom node加载方式导入插件，并调用所有INPUT_TYPES
+CHILD_SCRIPT = r"""
+import importlib.util, json, os, sys, time
+plugin_dir, module_name, heavy = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+spec = importlib.util.spec_from_file_location(
+    module_name, os.path.join(plugin_dir, "__init__.py"),
+    submodule_search_locations=[plugin_dir])
+module = importlib.util.module_from_spec(spec)
+sys.modules[module_name] = module
+start = time.perf_counter()
+spec.loader.exec_module(module)
+import_us = int((time.perf_counter() - start) * 1e6)
+for node_class in module.NODE_CLASS_MAPPINGS.values():
+    node_class.INPUT_TYPES()
+loaded = sorted(name for name in heavy if name in sys.modules)
+print(json.dumps({"nodes": len(module.NODE_CLASS_MAPPINGS), "heavy_loaded": loaded, "import_us": import_us}))
+"""
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 (模块名, 自身耗时, 累计耗时) 列表，单位微秒"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        try:
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue  # 表头
+        name = name.strip()
+        entries.append((name, self_us, cumulative_us))
+    return entries
+
+
+def run_benchmark():
+    cmd = [sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT,
+           PLUGIN_DIR, PLUGIN_MODULE, json.dumps(HEAVY_MODULES)]
+    result = subprocess.run(cmd, capture_output=True, text=True, cwd=PLUGIN_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(f"插件导入失败:\n{result.stderr[-4000:]}")
+
+    child_output = json.loads(result.stdout.strip().splitlines()[-1])
+    entries = parse_importtime(result.stderr)
+
+    # 插件自身的子模块，按累计耗时排序
+    plugin_entries = [e for e in entries if e[0].startswith(PLUGIN_MODULE)]
+    plugin_entries.sort(key=lambda e: e[2], reverse=True)
+
+    return {
+        # 插件 __init__ 通过 spec 加载，不出现在 importtime 输出中，耗时由子进程直接计时
+        "plugin_import_ms": round(child_output["import_us"] / 1000.0, 2),
+        "nodes": child_output["nodes"],
+        "heavy_loaded": child_output["heavy_loaded"],
+        "slowest_modules": [
+            {"module": name, "self_ms": round(s / 1000.0, 2), "cumulative_ms": round(c / 1000.0, 2)}
+            for name, s, c in plugin_entries[:10]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JM-KLingAI-API 启动耗时基准")
+    parser.add_argument("--max-ms", type=float, default=150.0, help="插件导入耗时预算(毫秒)")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    args = parser.parse_args()
+
+    report = run_benchmark()
+    failures = []
+    if report["heavy_loaded"]:
+        failures.append(f"启动时加载了重量级依赖: {', '.join(report['heavy_loaded'])}")
+    if report["plugin_import_ms"] > args.max_ms:
+        failures.append(f"插件导入耗时 {report['plugin_import_ms']}ms 超过预算 {args.max_ms}ms")
+    report["failures"] = failures
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print(f"插件导入耗时: {report['plugin_import_ms']}ms（预算 {args.max_ms}ms），节点数: {report['nodes']}")
+        for entry in report["slowest_modules"]:
+            print(f"  {entry['cumulative_ms']:>8.2f}ms  {entry['module']}")
+        for failure in failures:
+            print(f"失败: {failure}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
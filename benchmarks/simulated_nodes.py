@@ -0,0 +1,126 @@
+"""
+节点吞吐与轮询基准（离线）
+
+启动本地KLing API模拟服务（nodes/simulator.py），将 KLING_API_BASE 指向它，
+然后并发执行 文生视频提交 -> 查询状态 -> 下载视频 的完整流程，统计吞吐、端到端耗时和请求次数。
+不需要网络和真实账号，需要安装插件的运行依赖（requests、PyJWT）。
+
+用法:
+    python benchmarks/simulated_nodes.py [--tasks 20] [--concurrency 5] [--completion-seconds 3]
+                                         [--poll-interval 1] [--rate-limit-rps 0] [--failure-rate 0] [--json]
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+from nodes import metrics  # noqa: E402
+from nodes.simulator import KLingSimulator, SimulatorConfig  # noqa: E402
+
+ACCESS_KEY = "bench-access-key"
+SECRET_KEY = "bench-secret-key"
+
+
+def run_one(api_token, output_dir, poll_interval, index):
+    from nodes.text2video import KLingAIText2Video
+    from nodes.query_status import KLingAIQueryStatus
+    from nodes.video_downloader import KLingAIVideoDownloader
+
+    start = time.perf_counter()
+    task_id = KLingAIText2Video().create_video_task(api_token, f"benchmark prompt {index}", seed=index)[0]
+    submitted = time.perf_counter()
+    url = KLingAIQueryStatus().query_task_status(
+        api_token, task_id, task_type="text2video", initial_delay_seconds=0, poll_interval_seconds=poll_interval)[0]
+    completed = time.perf_counter()
+    ok = url.startswith("http")
+    if ok:
+        downloader = KLingAIVideoDownloader.__new__(KLingAIVideoDownloader)
+        downloader.default_output_dir = output_dir
+        downloader.type = "video"
+        ok = os.path.isfile(downloader.download_video(url, f"bench_{index}", output_dir)[0])
+    return {
+        "ok": ok,
+        "submit_s": submitted - start,
+        "poll_s": completed - submitted,
+        "total_s": time.perf_counter() - start,
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_benchmark(args):
+    config = SimulatorConfig(
+        access_key=ACCESS_KEY, secret_key=SECRET_KEY,
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_ms / 4,
+        completion_seconds=args.completion_seconds, completion_sigma=0.2,
+        failure_rate=args.failure_rate, rate_limit_rps=args.rate_limit_rps, seed=0,
+    )
+    with KLingSimulator(config) as simulator, tempfile.TemporaryDirectory() as output_dir:
+        os.environ["KLING_API_BASE"] = simulator.base_url
+        from nodes.api_key import KLingAIAPIKey
+        api_token = KLingAIAPIKey().generate_token(ACCESS_KEY, SECRET_KEY)[0]
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda i: run_one(api_token, output_dir, args.poll_interval, i),
+                                        range(args.tasks)))
+        elapsed = time.perf_counter() - start
+
+        stats = dict(simulator.stats)
+
+    totals = [r["total_s"] for r in results]
+    polls = [r["poll_s"] for r in results]
+    succeeded = sum(1 for r in results if r["ok"])
+    return {
+        "tasks": args.tasks,
+        "succeeded": succeeded,
+        "elapsed_s": round(elapsed, 3),
+        "tasks_per_minute": round(succeeded / elapsed * 60, 2) if elapsed else 0.0,
+        "total_p50_s": round(percentile(totals, 0.5), 3),
+        "total_p95_s": round(percentile(totals, 0.95), 3),
+        # 轮询耗时超出任务实际耗时的部分即轮询间隔带来的额外等待
+        "poll_p50_s": round(percentile(polls, 0.5), 3),
+        "status_queries_per_task": round(stats["queries"] / max(1, args.tasks), 2),
+        "simulator": stats,
+        "metrics": metrics.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JM-KLingAI-API 节点离线吞吐基准")
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--completion-seconds", type=float, default=3.0, help="模拟任务耗时中位数(秒)")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="模拟API响应延迟(毫秒)")
+    parser.add_argument("--poll-interval", type=int, default=1, help="查询状态节点的轮询间隔(秒)")
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果（包含完整指标快照）")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print(f"完成 {report['succeeded']}/{report['tasks']} 个任务，耗时 {report['elapsed_s']}s，"
+              f"吞吐 {report['tasks_per_minute']} 任务/分钟")
+        print(f"端到端耗时 p50={report['total_p50_s']}s p95={report['total_p95_s']}s，"
+              f"轮询耗时 p50={report['poll_p50_s']}s，每个任务查询 {report['status_queries_per_task']} 次")
+        print(f"模拟服务统计: {json.dumps(report['simulator'], ensure_ascii=False)}")
+    return 0 if report["succeeded"] == report["tasks"] or args.failure_rate else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+
+from . import api_client, cancellation, metrics
+from .log import get_logger
+
+logger = get_logger("admission")
+
+
+# 提交限流和并发控制，所有批量提交共享
+# KLING_SUBMIT_RPS: 每秒最多提交的任务数
+# KLING_MAX_CONCURRENT_TASKS: 同时在可灵端运行的任务上限（与账号的并发额度一致）
+#   收到1303（并发任务超限）时按当时实际运行的任务数下调额度，之后每KLING_ADMISSION_RECOVER_SECONDS秒
+#   没有再超限就恢复1个，最多恢复到配置值
+# KLING_ADMISSION_WAIT_SECONDS: 单任务节点等待额度的最长时间，超时后节点报错而不是一直占着ComfyUI的执行队列
+#   （额度可能被之前执行中提交、没有节点等待结果的任务占满）
+# KLING_SUBMIT_LIMIT_WAIT_SECONDS: 批量提交（submit_task）收到1303后最多等待的时间，超时后该任务提交失败，
+#   避免其他客户端长期占满账号额度时批量节点和运行器一直等待
+DEFAULT_SUBMIT_RPS = 2.0
+DEFAULT_MAX_CONCURRENT_TASKS = 5
+DEFAULT_SUBMIT_RETRIES = 5
+DEFAULT_RECOVER_SECONDS = 300
+DEFAULT_INTERACTIVE_WAIT_SECONDS = 30
+DEFAULT_SUBMIT_LIMIT_WAIT_SECONDS = 1800
+# 超限后等待其他任务结束的最长时间，超时后仍会重试一次（额度可能被其他客户端释放）
+LIMIT_WAIT_SLICE_SECONDS = 60
+
+# 等待额度时数值小的先放行，同优先级先到先得
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# 1303: 账号并发任务数超限
+CODE_CONCURRENCY_LIMITED = 1303
+
+ADMISSION_IN_FLIGHT = metrics.REGISTRY.register(metrics.Gauge(
+    "kling_admission_in_flight", "已占用的并发任务额度", ()))
+ADMISSION_WAITING = metrics.REGISTRY.register(metrics.Gauge(
+    "kling_admission_waiting", "等待并发额度的提交数", ()))
+ADMISSION_CAPACITY = metrics.REGISTRY.register(metrics.Gauge(
+    "kling_admission_capacity", "当前并发任务额度（含从1303学到的下调）", ()))
+
+
+class AdmissionTimeout(Exception):
+    """单任务节点在限定时间内没有等到并发额度"""
+
+
+class RateLimiter:
+    """令牌桶限流，桶容量为1秒的额度"""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            cancellation.sleep(delay)
+
+
+class AdmissionController:
+    """
+    并发额度控制
+    提交前acquire，任务结束（成功、失败或提交失败）时release，保证同时运行的任务数不超过额度
+    额度用满时提交在本地按(优先级, 到达顺序)排队，后台轮询器看到任务结束后依次放行
+    """
+
+    def __init__(self, capacity, recover_seconds=DEFAULT_RECOVER_SECONDS):
+        self.ceiling = max(1, int(capacity))
+        self.capacity = self.ceiling
+        self.recover_seconds = recover_seconds
+        self.in_flight = 0
+        # 提交被1303拒绝、正在等待其他任务结束的额度
+        self.blocked = 0
+        self.releases = 0
+        self.limited_at = None
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        ADMISSION_CAPACITY.set(self.capacity)
+
+    def acquire(self, timeout=None, priority=PRIORITY_INTERACTIVE, url=None):
+        """
+        等待一个并发额度；传入url时，接口组熔断打开会抛出CircuitOpenError，
+        排队前和排队期间都会检查，避免在故障期间一直占着队列
+        """
+        if url:
+            api_client.check_circuit(url)
+        deadline = None if timeout is None else time.time() + timeout
+        ticket = (priority, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.queue, ticket)
+            ADMISSION_WAITING.set(len(self.queue))
+            try:
+                while self.queue[0] != ticket or self.in_flight >= self.capacity:
+                    cancellation.check()
+                    if url:
+                        api_client.check_circuit(url)
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self.condition.wait(cancellation.CHECK_INTERVAL if remaining is None
+                                        else min(remaining, cancellation.CHECK_INTERVAL))
+                self.in_flight += 1
+                ADMISSION_IN_FLIGHT.set(self.in_flight)
+                return True
+            finally:
+                self.queue.remove(ticket)
+                heapq.heapify(self.queue)
+                ADMISSION_WAITING.set(len(self.queue))
+                # 队首变化，唤醒下一个等待者
+                self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.releases += 1
+            ADMISSION_IN_FLIGHT.set(self.in_flight)
+            self._recover()
+            self.condition.notify_all()
+
+    def _recover(self):
+        if self.capacity >= self.ceiling or self.limited_at is None:
+            return
+        if time.monotonic() - self.limited_at >= self.recover_seconds:
+            self.capacity += 1
+            self.limited_at = time.monotonic()
+            ADMISSION_CAPACITY.set(self.capacity)
+            logger.info(f"一段时间内未再超限，并发额度恢复为 {self.capacity}")
+
+    def wait_after_limit(self, timeout=LIMIT_WAIT_SLICE_SECONDS):
+        """
+        持有额度的提交收到1303时调用：按实际运行的任务数下调额度，
+        然后等待任意任务结束（release）后再重试，不做固定时长的退避
+        """
+        with self.condition:
+            self.blocked += 1
+            try:
+                learned = max(1, self.in_flight - self.blocked)
+                if learned < self.capacity:
+                    logger.warning(f"账号并发任务数超限，并发额度由 {self.capacity} 调整为 {learned}")
+                    self.capacity = learned
+                    ADMISSION_CAPACITY.set(self.capacity)
+                self.limited_at = time.monotonic()
+                releases = self.releases
+                deadline = time.monotonic() + timeout
+                while self.releases == releases and time.monotonic() < deadline:
+                    cancellation.check()
+                    self.condition.wait(min(cancellation.CHECK_INTERVAL, deadline - time.monotonic()))
+            finally:
+                self.blocked -= 1
+
+    def full_message(self, waited):
+        return (f"并发额度已满：{self.in_flight}/{self.capacity} 个任务仍在可灵端运行（可能是之前执行中提交、"
+                f"没有节点等待结果的任务），等待 {waited:g} 秒后仍没有空闲额度。请等这些任务结束后重试，"
+                f"或调整 KLING_MAX_CONCURRENT_TASKS / KLING_ADMISSION_WAIT_SECONDS")
+
+    def attach(self, handle):
+        """任务结束时自动释放额度"""
+        handle.add_done_callback(lambda _: self.release())
+
+
+_lock = threading.Lock()
+_submit_limiter = None
+_admission = None
+
+
+def get_submit_limiter():
+    global _submit_limiter
+    with _lock:
+        if _submit_limiter is None:
+            _submit_limiter = RateLimiter(float(os.environ.get("KLING_SUBMIT_RPS", DEFAULT_SUBMIT_RPS)))
+        return _submit_limiter
+
+
+def get_admission():
+    global _admission
+    with _lock:
+        if _admission is None:
+            _admission = AdmissionController(
+                int(os.environ.get("KLING_MAX_CONCURRENT_TASKS", DEFAULT_MAX_CONCURRENT_TASKS)),
+                float(os.environ.get("KLING_ADMISSION_RECOVER_SECONDS", DEFAULT_RECOVER_SECONDS)))
+        return _admission
+
+
+def _response_json(response):
+    try:
+        body = response.json()
+    except Exception:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def post_task(url, priority=PRIORITY_INTERACTIVE, **kwargs):
+    """
+    单任务节点的提交：占用一个并发额度后POST，1303时等待进行中的任务结束再重新提交
+    最多等待KLING_ADMISSION_WAIT_SECONDS秒：等不到额度时抛出AdmissionTimeout，1303仍未解除时返回1303的响应
+    返回最后一次的响应，由节点按原有方式解析；没有创建出任务时释放额度，
+    创建成功时额度由调用方attach到任务句柄，任务结束后自动释放
+    """
+    admission = get_admission()
+    wait_seconds = max(0.0, float(os.environ.get("KLING_ADMISSION_WAIT_SECONDS", DEFAULT_INTERACTIVE_WAIT_SECONDS)))
+    deadline = time.monotonic() + wait_seconds
+    if not admission.acquire(timeout=wait_seconds, priority=priority, url=url):
+        raise AdmissionTimeout(admission.full_message(wait_seconds))
+    try:
+        while True:
+            get_submit_limiter().wait()
+            response = api_client.post(url, **kwargs)
+            if response.status_code != 200 and _response_json(response).get("code") == CODE_CONCURRENCY_LIMITED:
+                api_client.record_retry(url, "concurrency_limited")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("账号并发任务数已满，等待超时，不再重试")
+                    break
+                logger.info("账号并发任务数已满，等待进行中的任务结束后提交")
+                admission.wait_after_limit(min(LIMIT_WAIT_SLICE_SECONDS, remaining))
+                continue
+            break
+    except BaseException:
+        # 包括取消，提交没有完成时归还额度
+        admission.release()
+        raise
+    if response.status_code != 200 or not (_response_json(response).get("data") or {}).get("task_id"):
+        admission.release()
+    return response
+
+
+def submit_task(endpoint, api_token, payload, max_retries=DEFAULT_SUBMIT_RETRIES, timeout=60):
+    """
+    在共享限流下提交任务，429等可重试错误按指数退避重试
+    1303时等待进行中的任务结束再提交，最多等待KLING_SUBMIT_LIMIT_WAIT_SECONDS秒
+    成功返回响应中的data，失败抛出KLingAPIError
+    调用方负责acquire/release并发额度
+    """
+    url = f"{api_client.api_base()}{endpoint}"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_token.strip()}"
+    }
+    limiter = get_submit_limiter()
+    limit_wait = max(0.0, float(os.environ.get("KLING_SUBMIT_LIMIT_WAIT_SECONDS", DEFAULT_SUBMIT_LIMIT_WAIT_SECONDS)))
+    limit_deadline = time.monotonic() + limit_wait
+    attempt = 0
+    while True:
+        limiter.wait()
+        try:
+            response = api_client.post(url, headers=headers, json=payload, timeout=timeout)
+        except api_client.CircuitOpenError:
+            raise
+        except Exception as e:
+            error = api_client.KLingAPIError(f"请求失败: {e}")
+            reason = "network_error"
+        else:
+            if response.status_code == 200:
+                data = response.json().get("data", {})
+                if data.get("task_id"):
+                    return data
+                error = api_client.KLingAPIError("API未返回任务ID", response.status_code)
+            else:
+                error = api_client.KLingAPIError.from_response(response)
+            if error.code == CODE_CONCURRENCY_LIMITED:
+                # 并发超限不计入重试次数，等有任务结束再提交
+                api_client.record_retry(url, "concurrency_limited")
+                remaining = limit_deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("账号并发任务数已满，等待超时，不再重试")
+                    raise api_client.KLingAPIError(
+                        f"账号并发任务数已满，等待 {limit_wait:g} 秒后仍未解除（KLING_SUBMIT_LIMIT_WAIT_SECONDS）",
+                        error.http_status, CODE_CONCURRENCY_LIMITED, error.request_id)
+                logger.info("账号并发任务数已满，等待进行中的任务结束后提交")
+                get_admission().wait_after_limit(min(LIMIT_WAIT_SLICE_SECONDS, remaining))
+                continue
+            reason = "rate_limited" if error.http_status == 429 else "server_error"
+            if not error.retryable:
+                raise error
+
+        attempt += 1
+        if attempt > max_retries:
+            raise error
+        # 这次失败使熔断打开时不再退避重试
+        api_client.check_circuit(url)
+        wait_time = min(60, 2 ** attempt)
+        api_client.record_retry(url, reason)
+        logger.info(f"提交任务失败: {error}，{wait_time} 秒后重试 ({attempt}/{max_retries})")
+        cancellation.sleep(wait_time)
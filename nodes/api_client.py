@@ -0,0 +1,211 @@
+import os
+import time
+from urllib.parse import urlparse
+
+from . import cancellation, circuit_breaker, hedging, metrics, profiler, progress, single_flight
+from .lazy_import import lazy_module
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+requests = lazy_module("requests")
+
+DEFAULT_API_BASE = "https://api.klingai.com"
+
+# 调用方没有指定timeout时使用的(连接, 读取)超时（秒），避免请求无限期挂起
+DEFAULT_TIMEOUT = (10, 120)
+
+
+def api_base():
+    """API地址，可通过环境变量 KLING_API_BASE 指向本地模拟服务（python -m nodes.simulator）"""
+    return os.environ.get("KLING_API_BASE", DEFAULT_API_BASE).rstrip("/")
+
+
+class KLingAPIError(Exception):
+    """KLing API返回的错误，保留HTTP状态码、业务错误码和请求ID"""
+
+    # 429对应的业务错误码: 1302请求过快，1303并发任务超限
+    RETRYABLE_CODES = (1302, 1303)
+
+    def __init__(self, message, http_status=None, code=None, request_id=None):
+        super().__init__(message)
+        self.message = message
+        self.http_status = http_status
+        self.code = code
+        self.request_id = request_id
+
+    @classmethod
+    def from_response(cls, response):
+        try:
+            body = response.json()
+        except Exception:
+            body = {"message": response.text[:500]}
+        return cls(body.get("message") or f"HTTP {response.status_code}", response.status_code,
+                   body.get("code"), body.get("request_id"))
+
+    @property
+    def retryable(self):
+        return self.http_status == 429 or self.code in self.RETRYABLE_CODES or (self.http_status or 0) >= 500
+
+    def to_dict(self):
+        return {"message": self.message, "http_status": self.http_status,
+                "code": self.code, "request_id": self.request_id}
+
+    def __str__(self):
+        return f"{self.message} (HTTP {self.http_status}, 错误码: {self.code}, 请求ID: {self.request_id})"
+
+
+class CircuitOpenError(KLingAPIError):
+    """接口组熔断打开，请求没有发送"""
+
+    def __init__(self, group, retry_after=0.0, last_error=""):
+        super().__init__(f"可灵接口 {group} 暂时不可用（熔断中，约 {retry_after:.0f} 秒后重试）: {last_error}", 503)
+        self.group = group
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        # 熔断期间立即失败，不做退避重试
+        return False
+
+
+def endpoint_label(url):
+    """
+    将请求URL归一化为指标标签，任务ID替换为占位符避免标签爆炸
+    例如 /v1/videos/text2video/8402xxx -> /v1/videos/text2video/{task_id}
+    """
+    parts = urlparse(url).path.strip("/").split("/")
+    if len(parts) >= 4 and parts[0] == "v1":
+        parts = parts[:3] + ["{task_id}"]
+    return "/" + "/".join(parts)
+
+
+def endpoint_group(url):
+    """熔断按接口分组，提交和查询共用，例如 /v1/videos/lip-sync"""
+    return "/" + "/".join(urlparse(url).path.strip("/").split("/")[:3])
+
+
+def check_circuit(url):
+    """接口组熔断打开时抛出CircuitOpenError，用于在排队等待并发额度之前快速失败"""
+    if not circuit_breaker.enabled():
+        return
+    breaker = circuit_breaker.get_breaker(endpoint_group(url))
+    if breaker.state == circuit_breaker.OPEN and breaker.retry_after() > 0:
+        raise CircuitOpenError(breaker.group, breaker.retry_after(), breaker.last_error)
+
+
+def request(method, url, hedge=None, **kwargs):
+    """
+    发送KLing API请求，记录耗时、状态码和429次数；接口组熔断打开时直接抛出CircuitOpenError
+    GET请求（hedge为None时）是幂等的，超过对冲阈值未返回时会再发送一份
+    """
+    method = method.upper()
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    if hedge is None:
+        hedge = method == "GET"
+    endpoint = endpoint_label(url)
+    breaker = circuit_breaker.get_breaker(endpoint_group(url)) if circuit_breaker.enabled() else None
+    if breaker is not None and not breaker.allow():
+        raise CircuitOpenError(breaker.group, breaker.retry_after(), breaker.last_error)
+    status = "error"
+    outcome, error = None, ""
+    start = time.perf_counter()
+    try:
+        with profiler.phase("request"):
+            try:
+                if hedge:
+                    response = hedging.call(endpoint, lambda: requests.request(method, url, **kwargs))
+                else:
+                    response = requests.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                outcome, error = False, str(e)
+                raise
+        status = str(response.status_code)
+        outcome = response.status_code < 500
+        if not outcome:
+            error = f"HTTP {response.status_code}"
+        return response
+    finally:
+        if breaker is not None:
+            breaker.record(outcome, error)
+        metrics.API_REQUEST_DURATION.observe(
+            time.perf_counter() - start, endpoint=endpoint, method=method, status=status)
+        if status == "429":
+            metrics.API_RATE_LIMITED.inc(endpoint=endpoint)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+# 状态查询结果可复用的时长占调用方轮询间隔的比例
+# 结果的时间从响应返回时算起，比发出请求晚，若按整个间隔复用，下一次到期的查询会拿到自己上一次的结果，实际查询频率减半
+STATUS_REUSE_RATIO = 0.5
+
+
+def get_status(url, headers=None, poll_interval=0.0, **kwargs):
+    """
+    查询任务状态，同一任务的并发查询合并为一个请求，半个轮询间隔内成功的查询结果直接复用
+    按URL（接口和任务ID）和Authorization合并，不同账号之间不共用
+    """
+    headers = headers or {}
+    return single_flight.do((url, headers.get("Authorization", "")),
+                            lambda: get(url, headers=headers, **kwargs), poll_interval * STATUS_REUSE_RATIO,
+                            cacheable=lambda response: response.status_code == 200)
+
+
+def record_retry(url, reason):
+    """记录一次重试，reason如 rate_limited / network_error"""
+    metrics.API_RETRIES.inc(endpoint=endpoint_label(url), reason=reason)
+
+
+# 文件较小、可以对冲下载的类型（对冲的是建立连接到收到响应头这一段）
+HEDGED_DOWNLOAD_KINDS = ("image",)
+
+
+def download_to_file(url, path, kind, chunk_size=8192, **kwargs):
+    """流式下载文件到path，记录下载字节数和吞吐，返回写入的字节数"""
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    start = time.perf_counter()
+    with profiler.phase("download"):
+        if kind in HEDGED_DOWNLOAD_KINDS:
+            response = hedging.call(f"download:{kind}", lambda: requests.get(url, stream=True, **kwargs))
+        else:
+            response = requests.get(url, stream=True, **kwargs)
+        response.raise_for_status()
+
+        total = 0
+        expected = int(response.headers.get("Content-Length") or 0)
+        try:
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    cancellation.check()
+                    if chunk:
+                        f.write(chunk)
+                        total += len(chunk)
+                        progress.report_download(total, expected)
+        except cancellation.Cancelled:
+            # 不留下不完整的文件
+            response.close()
+            os.remove(path)
+            raise
+
+    metrics.record_download(kind, total, time.perf_counter() - start)
+    return total
+
+
+def download_bytes(url, kind, **kwargs):
+    """下载到内存并返回内容，记录下载字节数和吞吐；图片等小文件会对冲下载"""
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    start = time.perf_counter()
+    with profiler.phase("download"):
+        if kind in HEDGED_DOWNLOAD_KINDS:
+            response = hedging.call(f"download:{kind}", lambda: requests.get(url, **kwargs))
+        else:
+            response = requests.get(url, **kwargs)
+        response.raise_for_status()
+        content = response.content
+    metrics.record_download(kind, len(content), time.perf_counter() - start)
+    return content
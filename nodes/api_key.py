@@ -1,7 +1,15 @@
 import time
-import jwt
 from datetime import datetime
 
+from . import api_client
+from .lazy_import import lazy_module
+from .log import get_logger
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+jwt = lazy_module("jwt")
+
+logger = get_logger("api_key")
+
 
 class KLingAIAPIKey:
     """
@@ -10,7 +18,7 @@ class KLingAIAPIKey:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         
     @classmethod
     def INPUT_TYPES(s):
@@ -57,12 +65,12 @@ class KLingAIAPIKey:
             }
             
             token = jwt.encode(payload, secret_key, headers=headers)
-            print(f"Generated fresh JWT token, valid until: {datetime.fromtimestamp(current_time + 1800)}")
+            logger.info(f"Generated fresh JWT token, valid until: {datetime.fromtimestamp(current_time + 1800)}")
             
             return (token,)
             
         except Exception as e:
-            print(f"Error generating API token: {str(e)}")
+            logger.error(f"Error generating API token: {str(e)}")
             return (None,)
 
     @classmethod
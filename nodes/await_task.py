@@ -0,0 +1,101 @@
+import sys
+import time
+
+from . import cancellation, profiler, progress
+from .log import get_logger, task_context
+from .task_tracker import TASK_HANDLE_TYPE
+
+logger = get_logger("await_task")
+
+# 等待时每次检查的间隔（秒）
+WAIT_SLICE_SECONDS = 1.0
+
+
+def comfy_supports_async_nodes():
+    """
+    新版ComfyUI支持async节点：执行器在等待async节点时可以继续执行其他分支
+    旧版本会直接调用FUNCTION，需要使用同步实现
+    """
+    execution = sys.modules.get("execution")
+    return execution is not None and hasattr(execution, "_async_map_node_over_list")
+
+
+class KLingAIAwaitTask:
+    """
+    KLingAI Await Task Node
+    等待提交节点返回的任务句柄完成并输出结果
+    任务在提交后由后台线程统一轮询，此节点只等待结果，不再单独发起轮询
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "task": (TASK_HANDLE_TYPE,),
+            },
+            "optional": {
+                "timeout_seconds": ("INT", {
+                    "default": 1800,
+                    "min": 10,
+                    "max": 7200,
+                    "step": 10
+                }),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "STRING")
+    RETURN_NAMES = ("url", "id", "task_id", "status", "timings")
+    FUNCTION = "await_task"
+    CATEGORY = "JM-KLingAI-API"
+
+    def collect(self, task):
+        """任务结束后整理输出，失败或超时时url为错误信息"""
+        if not task.done.is_set():
+            return (f"等待任务超时，当前状态: {task.status}", "", task.task_id, task.status)
+        if task.status != "succeed":
+            return (task.error or "任务失败", "", task.task_id, task.status)
+
+        results = task.result_urls()
+        if not results:
+            return ("任务成功但未返回结果URL", "", task.task_id, task.status)
+        url, result_id = results[0]
+        logger.info("任务完成，结果: %s (共%s个)", url, len(results))
+        return (url, result_id, task.task_id, task.status)
+
+    @profiler.profiled("await_task")
+    @cancellation.interruptible("await_task")
+    @progress.reporting("await_task")
+    def await_task_sync(self, task, timeout_seconds=1800):
+        profiler.annotate(task_id=task.task_id)
+        # 等待中被取消时，把等待的任务写入任务日志
+        cancellation.own(task)
+        with task_context(f"task={task.task_id}"):
+            logger.info("等待任务完成...")
+            deadline = time.time() + timeout_seconds
+            with profiler.phase("server_wait"):
+                while not task.done.is_set() and time.time() < deadline:
+                    progress.report_task(task)
+                    task.wait(min(WAIT_SLICE_SECONDS, max(0.0, deadline - time.time())))
+            return self.collect(task)
+
+    @profiler.profiled("await_task")
+    @cancellation.interruptible("await_task")
+    @progress.reporting("await_task")
+    async def await_task_async(self, task, timeout_seconds=1800):
+        import asyncio
+
+        profiler.annotate(task_id=task.task_id)
+        # 等待中被取消时，把等待的任务写入任务日志
+        cancellation.own(task)
+        with task_context(f"task={task.task_id}"):
+            logger.info("等待任务完成（异步）...")
+            deadline = time.time() + timeout_seconds
+            with profiler.phase("server_wait"):
+                while not task.done.is_set() and time.time() < deadline:
+                    cancellation.check()
+                    progress.report_task(task)
+                    await asyncio.sleep(min(WAIT_SLICE_SECONDS, max(0.0, deadline - time.time())))
+            return self.collect(task)
+
+    # ComfyUI加载插件时已经导入execution模块，据此选择同步或异步实现
+    await_task = await_task_async if comfy_supports_async_nodes() else await_task_sync
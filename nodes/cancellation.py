@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import time
+import inspect
+import datetime
+import functools
+import threading
+import contextvars
+import subprocess
+
+from .log import get_logger
+
+logger = get_logger("cancellation")
+
+
+# 协作式取消
+# ComfyUI点击取消后会设置model_management的中断标志；节点中所有长时间的等待、轮询、下载和ffmpeg子进程
+# 每隔CHECK_INTERVAL秒检查一次，检测到中断时抛出Cancelled
+# Cancelled继承BaseException，不会被节点里的except Exception当作普通错误吞掉，到节点边界再转换为ComfyUI的中断异常
+# 取消时仍在可灵端运行的任务写入任务日志（KLING_TASK_JOURNAL，默认user目录下的kling_task_journal.jsonl），
+# 任务结束后追加结果URL，之后可以直接取回结果或用Query Status节点查询
+# 只记录被取消的节点自己提交或正在等待的任务（通过own()登记），其他节点和之前执行中的任务不受影响
+CHECK_INTERVAL = 0.25
+
+# 无界面运行时由调用方通过cancel()设置
+_cancel_event = threading.Event()
+
+# 当前节点执行登记的任务句柄列表，由interruptible设置；工作线程通过profiler.bind继承
+_owned = contextvars.ContextVar("kling_owned_handles", default=None)
+
+
+class Cancelled(BaseException):
+    """执行已被取消"""
+
+
+def interrupted():
+    if _cancel_event.is_set():
+        return True
+    # 只在ComfyUI中（已加载model_management）检查中断标志，不主动导入
+    model_management = sys.modules.get("comfy.model_management")
+    processing_interrupted = getattr(model_management, "processing_interrupted", None)
+    return bool(processing_interrupted and processing_interrupted())
+
+
+def cancel():
+    _cancel_event.set()
+
+
+def reset():
+    _cancel_event.clear()
+
+
+def check():
+    if interrupted():
+        raise Cancelled("执行已取消")
+
+
+def wait(event, timeout=None):
+    """等待threading.Event，期间定期检查取消；返回event是否已设置"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        check()
+        remaining = CHECK_INTERVAL if deadline is None else min(CHECK_INTERVAL, deadline - time.monotonic())
+        if remaining <= 0:
+            return event.is_set()
+        if event.wait(remaining):
+            return True
+
+
+def sleep(seconds):
+    wait(threading.Event(), seconds)
+
+
+def join(thread, timeout=None):
+    """等待线程结束，期间定期检查取消"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while thread.is_alive():
+        check()
+        remaining = CHECK_INTERVAL if deadline is None else min(CHECK_INTERVAL, deadline - time.monotonic())
+        if remaining <= 0:
+            return
+        thread.join(remaining)
+
+
+def run(cmd, **kwargs):
+    """subprocess.run(cmd, capture_output=True, text=True)的可取消版本，取消时结束子进程"""
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **kwargs)
+    try:
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=CHECK_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                check()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def journal_path():
+    configured = os.environ.get("KLING_TASK_JOURNAL")
+    if configured:
+        return configured
+    folder_paths = sys.modules.get("folder_paths")
+    get_user_directory = getattr(folder_paths, "get_user_directory", None)
+    root = get_user_directory() if get_user_directory is not None else os.getcwd()
+    return os.path.join(root, "kling_task_journal.jsonl")
+
+
+_journal_lock = threading.Lock()
+
+
+def _append_journal(entry):
+    try:
+        path = journal_path()
+        with _journal_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(dict(entry, time=datetime.datetime.now().isoformat(timespec="seconds")),
+                                   ensure_ascii=False) + "\n")
+    except Exception as e:
+        logger.warning(f"写入任务日志失败: {e}")
+
+
+def _journal_result(handle):
+    _append_journal({"event": "finished", "task_id": handle.task_id, "status": handle.status,
+                     "urls": [url for url, _ in handle.result_urls()] if handle.status == "succeed" else [],
+                     "error": handle.error})
+
+
+def own(handle):
+    """把任务句柄登记为当前节点的任务，节点被取消时写入任务日志"""
+    owned = _owned.get()
+    if owned is not None:
+        owned.append(handle)
+    return handle
+
+
+def journal_pending(node, handles):
+    """记录本节点仍在运行的任务；任务继续由后台轮询器跟踪，结束后追加结果"""
+    pending = [handle for handle in handles
+               if not handle.done.is_set() and not getattr(handle, "journaled", False)]
+    for handle in pending:
+        handle.journaled = True
+        _append_journal({"event": "cancelled", "node": node, "task_id": handle.task_id,
+                         "task_type": handle.task_type, "endpoint": handle.endpoint})
+        handle.add_done_callback(_journal_result)
+    if pending:
+        logger.warning(f"执行已取消，{len(pending)} 个任务仍在可灵端运行，"
+                       f"结果会写入 {journal_path()}: {', '.join(h.task_id for h in pending)}")
+    return pending
+
+
+def _interrupt_error():
+    # 在ComfyUI中抛出其中断异常，执行器按“已取消”处理而不是报错
+    model_management = sys.modules.get("comfy.model_management")
+    error = getattr(model_management, "InterruptProcessingException", None)
+    return error() if error is not None else None
+
+
+def interruptible(node):
+    """
+    节点FUNCTION的装饰器：把Cancelled转换为ComfyUI的中断异常，并记录未完成的任务
+    只在最外层转换：一个节点调用另一个带装饰器的节点方法时，内层的任务登记到外层，Cancelled原样抛出，
+    否则转换后的中断异常（继承Exception）会被外层节点的except Exception吞掉
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _owned.get() is not None:
+                    return await func(*args, **kwargs)
+                owned = []
+                token = _owned.set(owned)
+                try:
+                    return await func(*args, **kwargs)
+                except Cancelled:
+                    journal_pending(node, owned)
+                    error = _interrupt_error()
+                    if error is None:
+                        raise
+                    raise error
+                finally:
+                    _owned.reset(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _owned.get() is not None:
+                return func(*args, **kwargs)
+            owned = []
+            token = _owned.set(owned)
+            try:
+                return func(*args, **kwargs)
+            except Cancelled:
+                journal_pending(node, owned)
+                error = _interrupt_error()
+                if error is None:
+                    raise
+                raise error
+            finally:
+                _owned.reset(token)
+        return wrapper
+    return decorator
@@ -0,0 +1,153 @@
+import os
+import time
+import threading
+import collections
+
+from . import metrics
+from .log import get_logger
+
+logger = get_logger("circuit_breaker")
+
+
+# 熔断
+# 每个接口组（如 /v1/videos/lip-sync，提交和查询共用）一个熔断器，统计最近WINDOW秒内请求的失败率
+# 失败指网络错误和5xx响应，4xx（包括429限流）说明服务可用，不计为失败
+# 请求数达到MIN_REQUESTS且失败率达到ERROR_RATE时打开熔断：该组的请求直接失败，不再发送和重试
+# 打开OPEN_SECONDS秒后进入半开状态，只放行一个试探请求，成功则关闭熔断，失败则重新打开
+# KLING_CIRCUIT_BREAKER: 设为0关闭熔断
+# KLING_CIRCUIT_ERROR_RATE / KLING_CIRCUIT_MIN_REQUESTS / KLING_CIRCUIT_WINDOW_SECONDS / KLING_CIRCUIT_OPEN_SECONDS
+DEFAULT_ERROR_RATE = 0.5
+DEFAULT_MIN_REQUESTS = 10
+DEFAULT_WINDOW_SECONDS = 60.0
+DEFAULT_OPEN_SECONDS = 30.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = metrics.REGISTRY.register(metrics.Gauge(
+    "kling_circuit_state", "熔断器状态（0关闭，1半开，2打开）", ("group",)))
+CIRCUIT_OPENED = metrics.REGISTRY.register(metrics.Counter(
+    "kling_circuit_opened_total", "熔断器打开次数", ("group",)))
+CIRCUIT_REJECTED = metrics.REGISTRY.register(metrics.Counter(
+    "kling_circuit_rejected_total", "熔断打开时直接拒绝的请求数", ("group",)))
+
+
+class CircuitBreaker:
+    """单个接口组的熔断器"""
+
+    def __init__(self, group, error_rate=DEFAULT_ERROR_RATE, min_requests=DEFAULT_MIN_REQUESTS,
+                 window_seconds=DEFAULT_WINDOW_SECONDS, open_seconds=DEFAULT_OPEN_SECONDS):
+        self.group = group
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.last_error = ""
+        # (时间, 是否成功)
+        self.outcomes = collections.deque()
+        self.lock = threading.Lock()
+        CIRCUIT_STATE.set(STATE_VALUES[CLOSED], group=group)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f"接口组 {self.group} 熔断状态: {self.state} -> {state}")
+            self.state = state
+            CIRCUIT_STATE.set(STATE_VALUES[state], group=self.group)
+
+    def _trim(self, now):
+        while self.outcomes and now - self.outcomes[0][0] > self.window_seconds:
+            self.outcomes.popleft()
+
+    def allow(self):
+        """是否放行一个请求；熔断打开时返回False，半开时只放行一个试探请求"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+        CIRCUIT_REJECTED.inc(group=self.group)
+        return False
+
+    def record(self, ok, error=""):
+        """
+        记录请求结果：ok为True成功，False失败
+        为None时表示请求没有完成（例如被取消），只释放试探名额，不计入统计
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN and self.probing:
+                self.probing = False
+                if ok:
+                    self.outcomes.clear()
+                    self.last_error = ""
+                    self._set_state(CLOSED)
+                elif ok is False:
+                    self._open(now, error)
+                return
+            if ok is None or self.state != CLOSED:
+                return
+            self.outcomes.append((now, ok))
+            if not ok:
+                self.last_error = error
+            self._trim(now)
+            failures = sum(1 for _, success in self.outcomes if not success)
+            if len(self.outcomes) >= self.min_requests and failures >= self.error_rate * len(self.outcomes):
+                self._open(now, error)
+
+    def _open(self, now, error):
+        self.opened_at = now
+        self.last_error = error or self.last_error
+        self._set_state(OPEN)
+        CIRCUIT_OPENED.inc(group=self.group)
+
+    def retry_after(self):
+        """距离下一次试探的秒数，熔断未打开时为0"""
+        with self.lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+
+    def snapshot(self):
+        with self.lock:
+            self._trim(time.monotonic())
+            failures = sum(1 for _, success in self.outcomes if not success)
+            state = self.state
+        return {"group": self.group, "state": state, "requests": len(self.outcomes), "failures": failures,
+                "retry_after": round(self.retry_after(), 1), "last_error": self.last_error}
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return os.environ.get("KLING_CIRCUIT_BREAKER", "1") != "0"
+
+
+def get_breaker(group):
+    with _lock:
+        breaker = _breakers.get(group)
+        if breaker is None:
+            breaker = _breakers[group] = CircuitBreaker(
+                group,
+                float(os.environ.get("KLING_CIRCUIT_ERROR_RATE", DEFAULT_ERROR_RATE)),
+                int(os.environ.get("KLING_CIRCUIT_MIN_REQUESTS", DEFAULT_MIN_REQUESTS)),
+                float(os.environ.get("KLING_CIRCUIT_WINDOW_SECONDS", DEFAULT_WINDOW_SECONDS)),
+                float(os.environ.get("KLING_CIRCUIT_OPEN_SECONDS", DEFAULT_OPEN_SECONDS)))
+        return breaker
+
+
+def status():
+    """所有接口组的熔断状态，供 /jm-kling/circuit 接口和编排系统使用"""
+    with _lock:
+        breakers = list(_breakers.values())
+    groups = [breaker.snapshot() for breaker in breakers]
+    return {"enabled": enabled(), "open": any(group["state"] != CLOSED for group in groups), "groups": groups}
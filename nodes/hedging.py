@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+import collections
+import concurrent.futures
+
+from . import cancellation, metrics
+from .log import get_logger
+
+logger = get_logger("hedging")
+
+
+# 对冲请求
+# 幂等请求（状态查询GET、图片下载）在阈值时间内没有响应时再发送一份相同的请求，先成功返回的为准，另一份的结果丢弃
+# 阈值取同类请求最近耗时的p95，样本不足MIN_SAMPLES时使用DEFAULT_DELAY，并限制在[MIN_DELAY, MAX_DELAY]之间
+# 最近WINDOW个请求中对冲的比例不超过KLING_HEDGE_MAX_RATIO，避免故障时把请求量翻倍
+# KLING_HEDGE: 设为0关闭对冲
+DEFAULT_DELAY = 1.0
+MIN_DELAY = 0.05
+MAX_DELAY = 10.0
+MIN_SAMPLES = 20
+WINDOW = 200
+DEFAULT_MAX_RATIO = 0.1
+MAX_WORKERS = 32
+
+# outcome: hedge_won 对冲请求先返回（对冲起了作用）；primary_won 发出对冲后原请求仍先返回；
+# capped 超过阈值但因比例上限没有对冲；failed 两份请求都失败
+HEDGED_REQUESTS = metrics.REGISTRY.register(metrics.Counter(
+    "kling_hedged_requests_total", "超过对冲阈值的请求数及结果", ("endpoint", "outcome")))
+
+
+def _close(result):
+    close = getattr(result, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class Hedger:
+    """按请求类别记录耗时并执行对冲，所有请求共享对冲比例上限"""
+
+    def __init__(self, max_ratio=None, max_workers=MAX_WORKERS):
+        self.max_ratio = float(max_ratio if max_ratio is not None
+                               else os.environ.get("KLING_HEDGE_MAX_RATIO", DEFAULT_MAX_RATIO))
+        self.max_workers = max_workers
+        self.latencies = {}
+        # 最近的请求是否发出了对冲
+        self.recent = collections.deque(maxlen=WINDOW)
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def delay(self, key):
+        """对冲阈值：最近耗时的p95"""
+        with self.lock:
+            samples = sorted(self.latencies.get(key, ()))
+        if len(samples) < MIN_SAMPLES:
+            return DEFAULT_DELAY
+        return min(MAX_DELAY, max(MIN_DELAY, samples[int(len(samples) * 0.95) - 1]))
+
+    def _observe(self, key, seconds):
+        with self.lock:
+            self.latencies.setdefault(key, collections.deque(maxlen=WINDOW)).append(seconds)
+
+    def _reserve(self, hedge):
+        """记录本次请求是否对冲；hedge为True时检查比例上限，超出时返回False"""
+        with self.lock:
+            if hedge and sum(self.recent) + 1 > self.max_ratio * (len(self.recent) + 1):
+                hedge = False
+            self.recent.append(hedge)
+            return hedge
+
+    def _submit(self, func):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="kling-hedge")
+
+        def timed():
+            start = time.perf_counter()
+            result = func()
+            return result, time.perf_counter() - start
+        # future的结果为(func的返回值, 耗时)
+        return self.executor.submit(timed)
+
+    @staticmethod
+    def _wait(futures, timeout=None):
+        """等待任意一个完成，期间检查取消"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            cancellation.check()
+            remaining = cancellation.CHECK_INTERVAL if deadline is None else min(
+                cancellation.CHECK_INTERVAL, deadline - time.monotonic())
+            if remaining <= 0:
+                return set()
+            done, _ = concurrent.futures.wait(futures, timeout=remaining,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if done:
+                return done
+
+    @staticmethod
+    def _discard(futures):
+        # 没有用上的请求结束后关闭响应，释放连接
+        for future in futures:
+            future.add_done_callback(lambda f: None if f.exception() else _close(f.result()[0]))
+
+    def call(self, key, func):
+        """执行func，超过阈值仍未返回时再执行一份，返回先成功的结果"""
+        primary = self._submit(func)
+        try:
+            if self._wait({primary}, self.delay(key)):
+                self._reserve(False)
+                result, elapsed = primary.result()
+                self._observe(key, elapsed)
+                return result
+            if not self._reserve(True):
+                HEDGED_REQUESTS.inc(endpoint=key, outcome="capped")
+                self._wait({primary})
+                result, elapsed = primary.result()
+                self._observe(key, elapsed)
+                return result
+        except cancellation.Cancelled:
+            self._discard([primary])
+            raise
+
+        hedge = self._submit(func)
+        pending = {primary, hedge}
+        try:
+            while pending:
+                for future in self._wait(pending):
+                    pending.discard(future)
+                    if future.exception() is None:
+                        self._discard(pending)
+                        result, elapsed = future.result()
+                        self._observe(key, elapsed)
+                        HEDGED_REQUESTS.inc(endpoint=key, outcome="hedge_won" if future is hedge else "primary_won")
+                        logger.debug("对冲请求 %s: %s先返回", key, "对冲请求" if future is hedge else "原请求")
+                        return result
+        except cancellation.Cancelled:
+            self._discard(pending)
+            raise
+        HEDGED_REQUESTS.inc(endpoint=key, outcome="failed")
+        return primary.result()[0]
+
+
+_hedger = None
+_lock = threading.Lock()
+
+
+def enabled():
+    return os.environ.get("KLING_HEDGE", "1") != "0"
+
+
+def get_hedger():
+    global _hedger
+    with _lock:
+        if _hedger is None:
+            _hedger = Hedger()
+        return _hedger
+
+
+def call(key, func):
+    """对冲执行幂等请求；关闭对冲时直接执行"""
+    if not enabled():
+        return func()
+    return get_hedger().call(key, func)
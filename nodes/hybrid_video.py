@@ -1,11 +1,21 @@
-import json
 import random
-import requests
 import base64
 import io
-import numpy as np
-import torch
-from PIL import Image
+
+from . import api_client, cancellation, metrics, preflight, profiler
+from .lazy_import import lazy_module
+from .admission import get_admission, post_task
+from .log import get_logger, LazyJSON
+from .image_utils import warn_if_batch
+from .media_staging import get_stager
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+np = lazy_module("numpy")
+torch = lazy_module("torch")
+Image = lazy_module("PIL.Image")
+
+logger = get_logger("hybrid_video")
 
 
 class KLingAIHybridVideo:
@@ -15,7 +25,7 @@ class KLingAIHybridVideo:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         self.text2video_endpoint = "/v1/videos/text2video"
         self.image2video_endpoint = "/v1/videos/image2video"
         
@@ -56,6 +66,7 @@ class KLingAIHybridVideo:
                 }),
                 "image_type": (["Base64", "URL"], {"default": "Base64"}),
                 "image_tail": ("IMAGE",),
+                "use_media_staging": ("BOOLEAN", {"default": False}),
                 "use_camera_control": ("BOOLEAN", {"default": False}),
                 "camera_type": (["simple", "down_back", "forward_up", "right_turn_forward", "left_turn_forward"], {"default": "simple"}),
                 "camera_horizontal": ("FLOAT", {
@@ -114,8 +125,8 @@ class KLingAIHybridVideo:
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT")
-    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed")
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT", TASK_HANDLE_TYPE, "STRING")
+    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed", "task", "timings")
     FUNCTION = "create_video_task"
     CATEGORY = "JM-KLingAI-API/hybrid-video"
 
@@ -149,6 +160,7 @@ class KLingAIHybridVideo:
         img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
         return img
 
+    @profiler.timed("encode")
     def image_to_base64(self, image):
         """将ComfyUI图像转换为base64字符串"""
         if image is None:
@@ -171,7 +183,7 @@ class KLingAIHybridVideo:
             return base64.b64encode(buffered.getvalue()).decode("utf-8")
             
         except Exception as e:
-            print(f"图像转换base64错误: {str(e)}")
+            logger.error(f"图像转换base64错误: {str(e)}")
             return None
 
     def get_camera_control(self, camera_type, h, v, pan, tilt, roll, zoom):
@@ -191,44 +203,49 @@ class KLingAIHybridVideo:
         
         return camera_control
 
-    def validate_camera_params(self, camera_type, h, v, pan, tilt, roll, zoom):
-        """验证摄像机参数合法性"""
-        if camera_type == "simple":
-            non_zero_count = sum(1 for p in [h, v, pan, tilt, roll, zoom] if abs(p) > 0.001)
-            if non_zero_count > 1:
-                return False, "simple类型摄像机控制只能设置一个方向参数不为0"
-            if non_zero_count == 0:
-                return False, "simple类型摄像机控制至少需要一个方向参数不为0"
-        return True, ""
-
+    @profiler.profiled("hybrid_video")
+    @cancellation.interruptible("hybrid_video")
     def create_video_task(self, api_token, positive_prompt="", negative_prompt="", 
                         model_name="kling-v1", cfg_scale=0.5, mode="std", duration="5",
                         image=None, image_url="", image_type="Base64", image_tail=None,
                         use_camera_control=False, camera_type="simple", 
                         camera_horizontal=0.0, camera_vertical=0.0, camera_pan=0.0, 
                         camera_tilt=0.0, camera_roll=0.0, camera_zoom=0.0, 
-                        external_task_id="", callback_url="", seed=-1):
+                        external_task_id="", callback_url="", seed=-1, use_media_staging=False):
         """
         创建视频生成任务，自动判断使用文生视频或图生视频API
         """
         try:
+            warn_if_batch(image, "输入图像")
+            warn_if_batch(image_tail, "尾帧图像")
             # 验证基本参数
             if not api_token:
                 raise ValueError("API令牌不能为空")
                 
-            # 检查提示词长度
-            if positive_prompt and len(positive_prompt) > 2500:
-                raise ValueError("提示词不能超过2500字符")
-            if negative_prompt and len(negative_prompt) > 2500:
-                raise ValueError("负向提示词不能超过2500字符")
+            # 在图像编码和上传之前完成本地校验
+            uses_image = (image is not None and image_type == "Base64") or bool(image_url and image_type == "URL")
+            camera_control = self.get_camera_control(
+                camera_type, camera_horizontal, camera_vertical,
+                camera_pan, camera_tilt, camera_roll, camera_zoom
+            ) if use_camera_control and uses_image else None
+            preflight.check(self.image2video_endpoint if uses_image else self.text2video_endpoint, model_name,
+                            prompt=positive_prompt, negative_prompt=negative_prompt, cfg_scale=cfg_scale,
+                            duration=duration, camera_control=camera_control,
+                            image=image if image_type == "Base64" else None,
+                            image_tail=image_tail if uses_image else None)
             
             # 判断使用哪种API
             has_image = False
             image_base64 = None
+            staged_image_url = None
             
             # 检查是否提供了图像信息
             if image is not None:
-                if image_type == "Base64":
+                if image_type == "Base64" and use_media_staging:
+                    # 通过媒体中转发布图像，以URL方式提交
+                    staged_image_url = get_stager().publish_image(self.tensor_to_pil(image))
+                    has_image = True
+                elif image_type == "Base64":
                     image_base64 = self.image_to_base64(image)
                     if image_base64:
                         has_image = True
@@ -241,7 +258,7 @@ class KLingAIHybridVideo:
             
             # 验证模型和模式的兼容性 - 只在文生视频时检查
             if not has_image and model_name == "kling-v1-6" and mode == "pro":
-                print(f"警告: 文生视频模式下，模型 {model_name} 不支持 pro 模式，自动切换为 std 模式")
+                logger.warning(f"警告: 文生视频模式下，模型 {model_name} 不支持 pro 模式，自动切换为 std 模式")
                 mode = "std"
             
             # 生成随机种子（本地使用，不发送给API）
@@ -281,42 +298,35 @@ class KLingAIHybridVideo:
             # 处理图生视频特有的参数
             if has_image:
                 # 添加图像信息
-                if image_type == "Base64" and image_base64:
+                if staged_image_url:
+                    payload["image"] = staged_image_url
+                elif image_type == "Base64" and image_base64:
                     payload["image"] = image_base64
                 elif image_type == "URL" and image_url:
                     payload["image"] = image_url.strip()
                 
                 # 处理尾帧图像
-                if image_tail is not None:
+                if image_tail is not None and use_media_staging:
+                    payload["image_tail"] = get_stager().publish_image(self.tensor_to_pil(image_tail))
+                elif image_tail is not None:
                     image_tail_base64 = self.image_to_base64(image_tail)
                     if image_tail_base64:
                         payload["image_tail"] = image_tail_base64
                 
                 # 添加摄像机控制参数
-                if use_camera_control:
-                    # 验证摄像机参数
-                    valid, msg = self.validate_camera_params(
-                        camera_type, camera_horizontal, camera_vertical,
-                        camera_pan, camera_tilt, camera_roll, camera_zoom
-                    )
-                    if not valid:
-                        raise ValueError(f"摄像机参数错误: {msg}")
-                        
-                    payload["camera_control"] = self.get_camera_control(
-                        camera_type, camera_horizontal, camera_vertical,
-                        camera_pan, camera_tilt, camera_roll, camera_zoom
-                    )
+                if camera_control:
+                    payload["camera_control"] = camera_control
             
             # 发送API请求
             url = f"{self.api_base}{endpoint}"
-            print(f"正在发送{task_type}请求到: {url}")
-            print(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
+            logger.info(f"正在发送{task_type}请求到: {url}")
+            logger.info(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = post_task(url, headers=headers, json=payload)
             response_data = response.json()
             
-            print(f"响应状态码: {response.status_code}")
-            print(f"响应数据: {json.dumps(response_data, indent=2)}")
+            logger.info(f"响应状态码: {response.status_code}")
+            logger.debug("响应数据: %s", LazyJSON(response_data))
 
             # 检查错误并提供详细错误信息
             if response.status_code != 200:
@@ -335,15 +345,19 @@ class KLingAIHybridVideo:
             if not task_id:
                 raise Exception("API未返回任务ID")
 
-            print(f"成功创建{task_type}任务，任务ID: {task_id} (本地种子: {seed})")
-            return (task_id, task_status, created_at, updated_at, seed)
+            metrics.task_submitted(task_id, endpoint.rsplit("/", 1)[-1], model_name, mode)
+            profiler.annotate(task_id=task_id)
+            task = track_task(task_id, endpoint, api_token, endpoint.rsplit("/", 1)[-1], model_name, mode)
+            get_admission().attach(task)
+            logger.info(f"成功创建{task_type}任务，任务ID: {task_id} (本地种子: {seed})")
+            return (task_id, task_status, created_at, updated_at, seed, task)
 
         except ValueError as ve:
-            print(f"参数验证错误: {str(ve)}")
-            return (f"错误: {str(ve)}", "failed", "", "", seed)
+            logger.error(f"参数验证错误: {str(ve)}")
+            return (f"错误: {str(ve)}", "failed", "", "", seed, TaskHandle.failed(str(ve)))
         except Exception as e:
-            print(f"创建视频任务错误: {str(e)}")
-            return (f"错误: {str(e)}", "failed", "", "", seed)
+            logger.error(f"创建视频任务错误: {str(e)}")
+            return (f"错误: {str(e)}", "failed", "", "", seed, TaskHandle.failed(str(e)))
 
     @classmethod
     def IS_CHANGED(cls, api_token, positive_prompt="", negative_prompt="", 
@@ -352,7 +366,7 @@ class KLingAIHybridVideo:
                 use_camera_control=False, camera_type="simple", 
                 camera_horizontal=0.0, camera_vertical=0.0, camera_pan=0.0, 
                 camera_tilt=0.0, camera_roll=0.0, camera_zoom=0.0, 
-                external_task_id="", callback_url="", seed=-1):
+                external_task_id="", callback_url="", seed=-1, use_media_staging=False):
         """
         此方法用于判断节点是否需要重新执行
         我们使用种子控制重新执行逻辑
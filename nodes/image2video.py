@@ -1,12 +1,22 @@
-import json
 import random
-import requests
 import base64
 import os
-from PIL import Image
 import io
-import numpy as np
-import torch
+
+from . import api_client, cancellation, metrics, preflight, profiler
+from .lazy_import import lazy_module
+from .admission import get_admission, post_task
+from .log import get_logger, LazyJSON
+from .image_utils import warn_if_batch
+from .media_staging import get_stager
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+Image = lazy_module("PIL.Image")
+np = lazy_module("numpy")
+torch = lazy_module("torch")
+
+logger = get_logger("image2video")
 
 
 class KLingAIImage2Video:
@@ -16,7 +26,7 @@ class KLingAIImage2Video:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         self.endpoint = "/v1/videos/image2video"
         
     @classmethod
@@ -53,6 +63,7 @@ class KLingAIImage2Video:
                 "mode": (["std", "pro"], {"default": "std"}),
                 "duration": (["5", "10"], {"default": "5"}),
                 "image_tail": ("IMAGE",),
+                "use_media_staging": ("BOOLEAN", {"default": False}),
                 "use_camera_control": ("BOOLEAN", {"default": False}),
                 "camera_type": (["simple", "down_back", "forward_up", "right_turn_forward", "left_turn_forward"], {"default": "simple"}),
                 "camera_horizontal": ("FLOAT", {
@@ -109,8 +120,8 @@ class KLingAIImage2Video:
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT")
-    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed")
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT", TASK_HANDLE_TYPE, "STRING")
+    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed", "task", "timings")
     FUNCTION = "create_image2video_task"
     CATEGORY = "JM-KLingAI-API/image-2-video"
 
@@ -128,6 +139,7 @@ class KLingAIImage2Video:
         img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
         return img
 
+    @profiler.timed("encode")
     def image_to_base64(self, image):
         """将ComfyUI图像转换为base64字符串"""
         if image is None:
@@ -150,7 +162,7 @@ class KLingAIImage2Video:
             return base64.b64encode(buffered.getvalue()).decode("utf-8")
             
         except Exception as e:
-            print(f"图像转换base64错误: {str(e)}")
+            logger.error(f"图像转换base64错误: {str(e)}")
             return None
 
     def get_camera_control(self, camera_type, h, v, pan, tilt, roll, zoom):
@@ -159,12 +171,6 @@ class KLingAIImage2Video:
         
         # 如果是simple类型，添加config配置
         if camera_type == "simple":
-            # 确保只有一个方向参数不为0
-            non_zero_params = sum(1 for p in [h, v, pan, tilt, roll, zoom] if abs(p) > 0.001)
-            
-            if non_zero_params > 1:
-                print("警告：simple类型摄像机控制只能设置一个方向参数，将使用第一个非零参数")
-            
             camera_control["config"] = {
                 "horizontal": h,
                 "vertical": v,
@@ -176,16 +182,8 @@ class KLingAIImage2Video:
         
         return camera_control
 
-    def validate_camera_params(self, camera_type, h, v, pan, tilt, roll, zoom):
-        """验证摄像机参数合法性"""
-        if camera_type == "simple":
-            non_zero_count = sum(1 for p in [h, v, pan, tilt, roll, zoom] if abs(p) > 0.001)
-            if non_zero_count > 1:
-                return False, "simple类型摄像机控制只能设置一个方向参数不为0"
-            if non_zero_count == 0:
-                return False, "simple类型摄像机控制至少需要一个方向参数不为0"
-        return True, ""
-
+    @profiler.profiled("image2video")
+    @cancellation.interruptible("image2video")
     def create_image2video_task(self, api_token, image_type="Base64", image=None, 
                               image_url="", model_name="kling-v1", 
                               positive_prompt="", negative_prompt="", 
@@ -195,7 +193,7 @@ class KLingAIImage2Video:
                               camera_vertical=0.0, camera_pan=0.0, 
                               camera_tilt=0.0, camera_roll=0.0, 
                               camera_zoom=0.0, external_task_id="", 
-                              callback_url="", seed=-1):
+                              callback_url="", seed=-1, use_media_staging=False):
         """
         创建图生视频任务
         """
@@ -209,25 +207,22 @@ class KLingAIImage2Video:
                 raise ValueError("使用Base64模式时，输入图像不能为空")
             if image_type == "URL" and not image_url:
                 raise ValueError("使用URL模式时，图片URL不能为空")
+            if image_type == "Base64":
+                warn_if_batch(image, "输入图像")
+                warn_if_batch(image_tail, "尾帧图像")
             
             # 生成随机种子（本地使用，不发送给API）
             if seed == -1:
                 seed = random.randint(0, 0xffffffffffffffff)
 
-            # 验证文本提示词长度
-            if positive_prompt and len(positive_prompt) > 2500:
-                raise ValueError("正向提示词不能超过2500字符")
-            if negative_prompt and len(negative_prompt) > 2500:
-                raise ValueError("负向提示词不能超过2500字符")
-                
-            # 验证摄像机参数
-            if use_camera_control:
-                valid, msg = self.validate_camera_params(
-                    camera_type, camera_horizontal, camera_vertical,
-                    camera_pan, camera_tilt, camera_roll, camera_zoom
-                )
-                if not valid:
-                    raise ValueError(f"摄像机参数错误: {msg}")
+            # 本地校验提示词、图像尺寸和摄像机参数
+            camera_control = self.get_camera_control(
+                camera_type, camera_horizontal, camera_vertical,
+                camera_pan, camera_tilt, camera_roll, camera_zoom
+            ) if use_camera_control else None
+            preflight.check(self.endpoint, model_name, prompt=positive_prompt, negative_prompt=negative_prompt,
+                            cfg_scale=cfg_scale, duration=duration, camera_control=camera_control,
+                            image=image if image_type == "Base64" else None, image_tail=image_tail)
 
             # 准备请求头
             headers = {
@@ -244,22 +239,28 @@ class KLingAIImage2Video:
             }
             
             # 根据选择的图像类型处理输入
-            if image_type == "Base64":
+            if image_type == "Base64" and use_media_staging:
+                # 通过媒体中转发布图像，以URL方式提交
+                payload["image"] = get_stager().publish_image(self.tensor_to_pil(image))
+                logger.info("使用媒体中转URL方式处理图像")
+            elif image_type == "Base64":
                 # 转换图像为base64
                 image_base64 = self.image_to_base64(image)
                 if not image_base64:
                     raise ValueError("图像转换为base64失败")
                 payload["image"] = image_base64
-                print("使用Base64方式处理图像")
+                logger.info("使用Base64方式处理图像")
             else:  # URL模式
                 # API要求参数名仍然是"image"，只是值是URL而不是Base64
                 if not image_url:
                     raise ValueError("图片URL不能为空")
                 payload["image"] = image_url.strip()
-                print(f"使用URL方式处理图像: {image_url}")
+                logger.info(f"使用URL方式处理图像: {image_url}")
             
             # 处理尾帧图像
-            if image_tail is not None:
+            if image_tail is not None and use_media_staging:
+                payload["image_tail"] = get_stager().publish_image(self.tensor_to_pil(image_tail))
+            elif image_tail is not None:
                 image_tail_base64 = self.image_to_base64(image_tail)
                 if image_tail_base64:
                     payload["image_tail"] = image_tail_base64
@@ -275,23 +276,20 @@ class KLingAIImage2Video:
                 payload["callback_url"] = callback_url
                 
             # 添加摄像机控制参数
-            if use_camera_control:
-                payload["camera_control"] = self.get_camera_control(
-                    camera_type, camera_horizontal, camera_vertical,
-                    camera_pan, camera_tilt, camera_roll, camera_zoom
-                )
+            if camera_control:
+                payload["camera_control"] = camera_control
 
             # 发送API请求
             url = f"{self.api_base}{self.endpoint}"
-            print(f"正在发送请求到: {url}")
-            print(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
-            print(f"使用图像模式: {image_type}")
+            logger.info(f"正在发送请求到: {url}")
+            logger.info(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
+            logger.info(f"使用图像模式: {image_type}")
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = post_task(url, headers=headers, json=payload)
             response_data = response.json()
             
-            print(f"响应状态码: {response.status_code}")
-            print(f"响应数据: {json.dumps(response_data, indent=2)}")
+            logger.info(f"响应状态码: {response.status_code}")
+            logger.debug("响应数据: %s", LazyJSON(response_data))
 
             # 检查错误并提供详细错误信息
             if response.status_code != 200:
@@ -310,15 +308,19 @@ class KLingAIImage2Video:
             if not task_id:
                 raise Exception("API未返回任务ID")
 
-            print(f"成功创建图生视频任务，任务ID: {task_id} (本地种子: {seed})")
-            return (task_id, task_status, created_at, updated_at, seed)
+            metrics.task_submitted(task_id, "image2video", model_name, mode)
+            profiler.annotate(task_id=task_id)
+            task = track_task(task_id, self.endpoint, api_token, "image2video", model_name, mode)
+            get_admission().attach(task)
+            logger.info(f"成功创建图生视频任务，任务ID: {task_id} (本地种子: {seed})")
+            return (task_id, task_status, created_at, updated_at, seed, task)
 
         except ValueError as ve:
-            print(f"参数验证错误: {str(ve)}")
-            return (f"错误: {str(ve)}", "failed", "", "", seed)
+            logger.error(f"参数验证错误: {str(ve)}")
+            return (f"错误: {str(ve)}", "failed", "", "", seed, TaskHandle.failed(str(ve)))
         except Exception as e:
-            print(f"创建图生视频任务错误: {str(e)}")
-            return (f"错误: {str(e)}", "failed", "", "", seed)
+            logger.error(f"创建图生视频任务错误: {str(e)}")
+            return (f"错误: {str(e)}", "failed", "", "", seed, TaskHandle.failed(str(e)))
 
     @classmethod
     def IS_CHANGED(cls, api_token, image_type="Base64", image=None, 
@@ -330,7 +332,7 @@ class KLingAIImage2Video:
                  camera_vertical=0.0, camera_pan=0.0, 
                  camera_tilt=0.0, camera_roll=0.0, 
                  camera_zoom=0.0, external_task_id="", 
-                 callback_url="", seed=-1):
+                 callback_url="", seed=-1, use_media_staging=False):
         """
         此方法用于判断节点是否需要重新执行
         我们使用种子控制重新执行逻辑
@@ -0,0 +1,184 @@
+import json
+import time
+import concurrent.futures
+
+from . import api_client, cancellation, metrics, preflight, profiler
+from .admission import PRIORITY_BATCH, get_admission, submit_task
+from .image2video import KLingAIImage2Video
+from .image_utils import batch_size, encode_frame
+from .log import get_logger, task_context
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+logger = get_logger("image2video_batch")
+
+# 批量模式下不适用的单任务参数
+SINGLE_ONLY_INPUTS = ("image_type", "image", "image_url", "image_tail", "seed")
+
+
+class KLingAIImage2VideoBatch(KLingAIImage2Video):
+    """
+    KLingAI Image to Video Batch Node
+    IMAGE批次中每一帧（或每对首尾帧）提交一个图生视频任务
+    帧编码/上传与提交流水线并行，提交受共享限流和并发额度控制，立即返回任务句柄列表
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        inputs = super().INPUT_TYPES()
+        optional = {key: value for key, value in inputs["optional"].items() if key not in SINGLE_ONLY_INPUTS}
+        optional["image_tail"] = ("IMAGE",)
+        optional["pairing"] = (["per_frame", "consecutive_pairs"], {"default": "per_frame"})
+        optional["max_concurrency"] = ("INT", {"default": 4, "min": 1, "max": 32})
+        return {
+            "required": {
+                "api_token": inputs["required"]["api_token"],
+                "image": ("IMAGE",),
+            },
+            "optional": optional,
+        }
+
+    RETURN_TYPES = ("STRING", "STRING", TASK_HANDLE_TYPE, "STRING", "STRING")
+    RETURN_NAMES = ("task_ids", "task_statuses", "tasks", "errors_json", "timings")
+    OUTPUT_IS_LIST = (True, True, True, False, False)
+    FUNCTION = "create_image2video_tasks"
+    CATEGORY = "JM-KLingAI-API/image-2-video"
+
+    def plan_jobs(self, image, image_tail, pairing):
+        """
+        生成 [(首帧序号, 尾帧来源, 尾帧序号), ...]
+        per_frame: 每帧一个任务，image_tail为同样帧数的批次时逐帧配对，单帧时所有任务共用
+        consecutive_pairs: 相邻两帧作为首尾帧，N帧生成N-1个过渡视频，不能同时连接image_tail
+        """
+        frames = batch_size(image)
+        if pairing == "consecutive_pairs":
+            if image_tail is not None:
+                raise ValueError("consecutive_pairs模式使用相邻帧作为尾帧，不能同时连接image_tail，请断开image_tail或改用per_frame")
+            if frames < 2:
+                raise ValueError("consecutive_pairs模式至少需要2帧图像")
+            return [(i, "image", i + 1) for i in range(frames - 1)]
+
+        tail_frames = batch_size(image_tail)
+        if tail_frames == 0:
+            return [(i, None, None) for i in range(frames)]
+        if tail_frames == 1:
+            return [(i, "image_tail", 0) for i in range(frames)]
+        if tail_frames != frames:
+            raise ValueError(f"尾帧数量({tail_frames})与图像数量({frames})不一致")
+        return [(i, "image_tail", i) for i in range(frames)]
+
+    def submit_job(self, index, job, encoded, api_token, base_payload, external_task_id):
+        """等待本任务所需帧编码完成后提交，返回任务句柄和结构化错误"""
+        start, tail_source, tail_index = job
+        with task_context(f"frame#{start}"):
+            try:
+                payload = dict(base_payload, image=encoded[("image", start)].result())
+                if tail_source is not None:
+                    payload["image_tail"] = encoded[(tail_source, tail_index)].result()
+            except Exception as e:
+                logger.error(f"图像编码失败: {e}")
+                return TaskHandle.failed(f"图像编码失败: {e}", "image2video", self.endpoint), {"message": str(e)}
+            if external_task_id:
+                payload["external_task_id"] = f"{external_task_id}-{index}"
+
+            admission = get_admission()
+            try:
+                admission.acquire(priority=PRIORITY_BATCH, url=f"{api_client.api_base()}{self.endpoint}")
+            except api_client.CircuitOpenError as e:
+                logger.error(f"提交失败: {e}")
+                return TaskHandle.failed(str(e), "image2video", self.endpoint), e.to_dict()
+            try:
+                data = submit_task(self.endpoint, api_token, payload)
+            except api_client.KLingAPIError as e:
+                admission.release()
+                logger.error(f"提交失败: {e}")
+                return TaskHandle.failed(str(e), "image2video", self.endpoint), e.to_dict()
+            except Exception as e:
+                admission.release()
+                logger.error(f"提交失败: {e}")
+                return TaskHandle.failed(str(e), "image2video", self.endpoint), {"message": str(e)}
+            except cancellation.Cancelled:
+                admission.release()
+                raise
+
+            task_id = data["task_id"]
+            model_name, mode = payload["model_name"], payload["mode"]
+            metrics.task_submitted(task_id, "image2video", model_name, mode)
+            handle = track_task(task_id, self.endpoint, api_token, "image2video", model_name, mode)
+            admission.attach(handle)
+            logger.info(f"已提交任务: {task_id}")
+            return handle, None
+
+    @profiler.profiled("image2video_batch")
+    @cancellation.interruptible("image2video_batch")
+    def create_image2video_tasks(self, api_token, image, model_name="kling-v1-6",
+                                 positive_prompt="", negative_prompt="",
+                                 cfg_scale=0.5, mode="std", duration="5",
+                                 image_tail=None, use_media_staging=False, use_camera_control=False,
+                                 camera_type="simple", camera_horizontal=0.0,
+                                 camera_vertical=0.0, camera_pan=0.0,
+                                 camera_tilt=0.0, camera_roll=0.0,
+                                 camera_zoom=0.0, external_task_id="",
+                                 callback_url="", pairing="per_frame", max_concurrency=4):
+        """
+        批量创建图生视频任务
+        """
+        try:
+            if not api_token:
+                raise ValueError("API令牌不能为空")
+            camera_control = self.get_camera_control(
+                camera_type, camera_horizontal, camera_vertical,
+                camera_pan, camera_tilt, camera_roll, camera_zoom
+            ) if use_camera_control else None
+            # 批次内各帧尺寸相同，按第一帧校验一次即可
+            preflight.check(self.endpoint, model_name, prompt=positive_prompt, negative_prompt=negative_prompt,
+                            cfg_scale=cfg_scale, duration=duration, camera_control=camera_control,
+                            image=image, image_tail=image_tail)
+            jobs = self.plan_jobs(image, image_tail, pairing)
+        except ValueError as ve:
+            logger.error(f"参数验证错误: {str(ve)}")
+            return ([], [], [], json.dumps([{"index": None, "message": str(ve)}], ensure_ascii=False))
+
+        base_payload = {
+            "model_name": model_name,
+            "cfg_scale": float(cfg_scale),
+            "mode": mode,
+            "duration": duration
+        }
+        if positive_prompt:
+            base_payload["prompt"] = positive_prompt
+        if negative_prompt:
+            base_payload["negative_prompt"] = negative_prompt
+        if callback_url:
+            base_payload["callback_url"] = callback_url
+        if camera_control:
+            base_payload["camera_control"] = camera_control
+
+        # 每个用到的帧只编码一次；提交线程等待各自需要的帧，先编码好的任务先提交
+        needed = [("image", start) for start, _, _ in jobs]
+        needed += [(source, index) for _, source, index in jobs if source is not None]
+        sources = {"image": image, "image_tail": image_tail}
+        logger.info(f"批量提交 {len(jobs)} 个图生视频任务 ({pairing})，并发数: {max_concurrency}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as encoders, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as submitters:
+            encoded = {}
+            for key in dict.fromkeys(needed):
+                encoded[key] = encoders.submit(profiler.bind(encode_frame), sources[key[0]], key[1], use_media_staging)
+            submitted = list(submitters.map(profiler.bind(
+                lambda item: self.submit_job(item[0], item[1], encoded, api_token, base_payload, external_task_id)),
+                enumerate(jobs)))
+
+        task_ids, statuses, handles, errors = [], [], [], []
+        for index, (handle, error) in enumerate(submitted):
+            task_ids.append(handle.task_id)
+            statuses.append(handle.status)
+            handles.append(handle)
+            if error is not None:
+                errors.append(dict(error, index=index, frame=jobs[index][0]))
+
+        logger.info(f"批量提交完成: 成功 {len(jobs) - len(errors)} 个，失败 {len(errors)} 个")
+        return (task_ids, statuses, handles, json.dumps(errors, ensure_ascii=False))
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # 每次执行都会产生新的付费任务，不缓存
+        return time.time()
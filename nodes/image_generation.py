@@ -1,13 +1,23 @@
-import json
 import random
-import requests
 import base64
 import io
-from PIL import Image
-import numpy as np
-import torch
 import time
-import folder_paths
+
+from . import api_client, cancellation, metrics, preflight, profiler
+from .lazy_import import lazy_module
+from .admission import get_admission, post_task
+from .log import get_logger, LazyJSON
+from .image_utils import warn_if_batch
+from .media_staging import get_stager
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+Image = lazy_module("PIL.Image")
+np = lazy_module("numpy")
+torch = lazy_module("torch")
+folder_paths = lazy_module("folder_paths")
+
+logger = get_logger("image_generation")
 
 
 class KLingAIImageGeneration:
@@ -17,7 +27,7 @@ class KLingAIImageGeneration:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         self.endpoint = "/v1/images/generations"
         
     @classmethod
@@ -40,6 +50,7 @@ class KLingAIImageGeneration:
                     "placeholder": "参考图片URL地址"
                 }),
                 "image_reference": (["subject", "face"], {"default": "subject"}),
+                "use_media_staging": ("BOOLEAN", {"default": False}),
                 "model_name": (["kling-v1", "kling-v1-5", "kling-v2"], {"default": "kling-v1"}),
                 "negative_prompt": ("STRING", {
                     "default": "",
@@ -78,8 +89,8 @@ class KLingAIImageGeneration:
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT")
-    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed")
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT", TASK_HANDLE_TYPE, "STRING")
+    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed", "task", "timings")
     FUNCTION = "create_image_generation_task"
     CATEGORY = "JM-KLingAI-API/image-generation"
 
@@ -97,6 +108,7 @@ class KLingAIImageGeneration:
         img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
         return img
 
+    @profiler.timed("encode")
     def image_to_base64(self, image):
         """将ComfyUI图像转换为base64字符串"""
         if image is None:
@@ -119,36 +131,32 @@ class KLingAIImageGeneration:
             return base64.b64encode(buffered.getvalue()).decode("utf-8")
             
         except Exception as e:
-            print(f"图像转换base64错误: {str(e)}")
+            logger.error(f"图像转换base64错误: {str(e)}")
             return None
 
+    @profiler.profiled("image_generation")
+    @cancellation.interruptible("image_generation")
     def create_image_generation_task(self, api_token, prompt, image_type="Base64", 
                                image=None, image_url="", image_reference="subject",
                                model_name="kling-v1", negative_prompt="", 
                                image_fidelity=0.5, human_fidelity=0.45, n=1,
-                               aspect_ratio="16:9", callback_url="", seed=-1):
+                               aspect_ratio="16:9", callback_url="", seed=-1, use_media_staging=False):
         """
         创建文生图任务
         """
         try:
+            warn_if_batch(image, "参考图像")
             # 验证必要参数
             if not api_token:
                 raise ValueError("API令牌不能为空")
             
-            if not prompt:
-                raise ValueError("正向提示词不能为空")
-            
-            if len(prompt) > 500:
-                raise ValueError("正向提示词不能超过500字符")
-            
+            preflight.check(self.endpoint, model_name, prompt=prompt, negative_prompt=negative_prompt,
+                            image=image if image_type == "Base64" else None)
+
             # 生成随机种子（本地使用，不发送给API）
             if seed == -1:
                 seed = random.randint(0, 0xffffffffffffffff)
 
-            # 验证其他参数
-            if negative_prompt and len(negative_prompt) > 200:
-                raise ValueError("负向提示词不能超过200字符")
-                
             # 准备请求头
             headers = {
                 "Content-Type": "application/json",
@@ -167,12 +175,15 @@ class KLingAIImageGeneration:
             has_reference_image = False
             
             if image_type == "Base64" and image is not None:
-                # 转换图像为base64
-                image_base64 = self.image_to_base64(image)
+                # 转换图像为base64，媒体中转模式下改为发布后使用URL
+                if use_media_staging:
+                    image_base64 = get_stager().publish_image(self.tensor_to_pil(image))
+                else:
+                    image_base64 = self.image_to_base64(image)
                 if image_base64:
                     payload["image"] = image_base64
                     has_reference_image = True
-                    print("使用Base64方式处理参考图像")
+                    logger.info("使用Base64方式处理参考图像")
                     
                     # 如果是v1-5模型且有参考图片，需要添加image_reference
                     if model_name == "kling-v1-5":
@@ -184,7 +195,7 @@ class KLingAIImageGeneration:
                 # 直接使用URL
                 payload["image"] = image_url.strip()
                 has_reference_image = True
-                print(f"使用URL方式处理参考图像: {image_url}")
+                logger.info(f"使用URL方式处理参考图像: {image_url}")
                 
                 # 如果是v1-5模型且有参考图片，需要添加image_reference
                 if model_name == "kling-v1-5":
@@ -196,7 +207,7 @@ class KLingAIImageGeneration:
             if negative_prompt and not has_reference_image:
                 payload["negative_prompt"] = negative_prompt
             elif negative_prompt and has_reference_image:
-                print("警告：图生图模式下不支持负向提示词，将忽略负向提示词")
+                logger.warning("警告：图生图模式下不支持负向提示词，将忽略负向提示词")
                 
             # 添加回调URL（如果提供）
             if callback_url:
@@ -204,16 +215,16 @@ class KLingAIImageGeneration:
 
             # 发送API请求
             url = f"{self.api_base}{self.endpoint}"
-            print(f"正在发送请求到: {url}")
-            print(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
+            logger.info(f"正在发送请求到: {url}")
+            logger.info(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
             if has_reference_image:
-                print(f"参考图像模式: {image_reference}")
+                logger.info(f"参考图像模式: {image_reference}")
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = post_task(url, headers=headers, json=payload)
             response_data = response.json()
             
-            print(f"响应状态码: {response.status_code}")
-            print(f"响应数据: {json.dumps(response_data, indent=2)}")
+            logger.info(f"响应状态码: {response.status_code}")
+            logger.debug("响应数据: %s", LazyJSON(response_data))
 
             # 检查错误并提供详细错误信息
             if response.status_code != 200:
@@ -232,22 +243,26 @@ class KLingAIImageGeneration:
             if not task_id:
                 raise Exception("API未返回任务ID")
 
-            print(f"成功创建文生图任务，任务ID: {task_id} (本地种子: {seed})")
-            return (task_id, task_status, created_at, updated_at, seed)
+            metrics.task_submitted(task_id, "image_generation", model_name)
+            profiler.annotate(task_id=task_id)
+            task = track_task(task_id, self.endpoint, api_token, "image_generation", model_name)
+            get_admission().attach(task)
+            logger.info(f"成功创建文生图任务，任务ID: {task_id} (本地种子: {seed})")
+            return (task_id, task_status, created_at, updated_at, seed, task)
 
         except ValueError as ve:
-            print(f"参数验证错误: {str(ve)}")
-            return (f"错误: {str(ve)}", "failed", "", "", seed)
+            logger.error(f"参数验证错误: {str(ve)}")
+            return (f"错误: {str(ve)}", "failed", "", "", seed, TaskHandle.failed(str(ve)))
         except Exception as e:
-            print(f"创建文生图任务错误: {str(e)}")
-            return (f"错误: {str(e)}", "failed", "", "", seed)
+            logger.error(f"创建文生图任务错误: {str(e)}")
+            return (f"错误: {str(e)}", "failed", "", "", seed, TaskHandle.failed(str(e)))
 
     @classmethod
     def IS_CHANGED(cls, api_token, prompt, image_type="Base64", 
                  image=None, image_url="", image_reference="subject",
                  model_name="kling-v1", negative_prompt="", 
                  image_fidelity=0.5, human_fidelity=0.45, n=1,
-                 aspect_ratio="16:9", callback_url="", seed=-1):
+                 aspect_ratio="16:9", callback_url="", seed=-1, use_media_staging=False):
         """
         此方法用于判断节点是否需要重新执行
         我们使用种子控制重新执行逻辑
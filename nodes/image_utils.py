@@ -0,0 +1,94 @@
+import io
+import base64
+import concurrent.futures
+
+from . import api_client, profiler
+from .lazy_import import lazy_module
+from .log import get_logger
+from .media_staging import get_stager
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+Image = lazy_module("PIL.Image")
+np = lazy_module("numpy")
+torch = lazy_module("torch")
+
+logger = get_logger("image_utils")
+
+
+def batch_size(tensor):
+    """ComfyUI IMAGE张量的帧数，[B,H,W,C]返回B，单帧[H,W,C]返回1"""
+    if tensor is None:
+        return 0
+    return tensor.shape[0] if len(tensor.shape) == 4 else 1
+
+
+def tensor_to_pil(tensor, index=0):
+    """将ComfyUI IMAGE张量中的第index帧转换为PIL图像"""
+    if tensor is None:
+        return None
+    if len(tensor.shape) == 4:
+        tensor = tensor[index]
+    i = 255. * tensor.cpu().numpy()
+    return Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
+
+
+def pil_to_base64(pil_image, format="JPEG"):
+    buffered = io.BytesIO()
+    pil_image.save(buffered, format=format)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def encode_frame(tensor, index=0, use_media_staging=False):
+    """编码单帧：媒体中转模式返回签名URL，否则返回JPEG base64"""
+    with profiler.phase("encode"):
+        pil_image = tensor_to_pil(tensor, index)
+        if use_media_staging:
+            return get_stager().publish_image(pil_image)
+        return pil_to_base64(pil_image)
+
+
+def encode_frames(tensor, indices, use_media_staging=False, max_workers=4):
+    """并行编码多帧，按indices顺序返回；JPEG编码和上传在线程中进行"""
+    indices = list(indices)
+    if not indices:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(indices)))) as executor:
+        return list(executor.map(profiler.bind(lambda i: encode_frame(tensor, i, use_media_staging)), indices))
+
+
+def warn_if_batch(tensor, label):
+    """单帧节点收到批量图像时提示只会使用第一帧"""
+    frames = batch_size(tensor)
+    if frames > 1:
+        logger.warning(f"警告: {label}包含 {frames} 帧，此节点只使用第一帧，批量处理请使用批量节点")
+
+
+def pil_to_tensor(pil_images):
+    """PIL图像列表转换为[B,H,W,3]张量，尺寸不同的图像缩放到第一张的尺寸"""
+    size = pil_images[0].size
+    arrays = []
+    for pil_image in pil_images:
+        pil_image = pil_image.convert("RGB")
+        if pil_image.size != size:
+            logger.warning(f"图像尺寸 {pil_image.size} 与第一张 {size} 不同，已缩放")
+            pil_image = pil_image.resize(size, Image.LANCZOS)
+        arrays.append(np.array(pil_image).astype(np.float32) / 255.0)
+    return torch.from_numpy(np.stack(arrays))
+
+
+def empty_image():
+    """没有图像可返回时的64x64空白占位图，避免下游IMAGE节点收到None"""
+    return torch.zeros((1, 64, 64, 3), dtype=torch.float32)
+
+
+def load_images(urls, max_workers=4, timeout=60):
+    """并发下载并解码多张图片，按urls顺序合并为一个IMAGE批次"""
+    def fetch(url):
+        content = api_client.download_bytes(url, "image", timeout=timeout)
+        with profiler.phase("decode"):
+            return Image.open(io.BytesIO(content)).convert("RGB")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+        pil_images = list(executor.map(profiler.bind(fetch), urls))
+    with profiler.phase("decode"):
+        return pil_to_tensor(pil_images)
@@ -0,0 +1,33 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    延迟导入的模块代理
+    第一次访问属性时才真正导入模块，避免ComfyUI启动时加载torch/numpy/PIL/pydub等重量级依赖
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_module(name):
+    """返回模块的延迟代理，用法: torch = lazy_module("torch")"""
+    return LazyModule(name)
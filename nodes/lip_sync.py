@@ -1,11 +1,23 @@
-import json
 import time
+import logging
 import random
-import requests
 import base64
 import io
 import os
-from PIL import Image
+import re
+
+from . import api_client, cancellation, metrics, preflight, profiler
+from .lazy_import import lazy_module
+from .media_staging import get_stager
+from .admission import get_admission, post_task
+from .log import get_logger, LazyJSON
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+Image = lazy_module("PIL.Image")
+
+logger = get_logger("lip_sync")
+_INVALID_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
 
 
 class KLingAILipSync:
@@ -15,7 +27,7 @@ class KLingAILipSync:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         self.endpoint = "/v1/videos/lip-sync"
         
     @classmethod
@@ -64,6 +76,7 @@ class KLingAILipSync:
                     "multiline": False,
                     "placeholder": "本地音频文件路径(mp3/wav/m4a/acc格式)"
                 }),
+                "use_media_staging": ("BOOLEAN", {"default": False}),
                 "callback_url": ("STRING", {
                     "default": "",
                     "multiline": False,
@@ -77,16 +90,18 @@ class KLingAILipSync:
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING", "STRING", "INT")
-    RETURN_NAMES = ("task_id", "task_status", "update_time", "seed")
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "INT", TASK_HANDLE_TYPE, "STRING")
+    RETURN_NAMES = ("task_id", "task_status", "update_time", "seed", "task", "timings")
     FUNCTION = "create_lip_sync_task"
     CATEGORY = "JM-KLingAI-API/lip-sync"
 
+    @profiler.profiled("lip_sync")
+    @cancellation.interruptible("lip_sync")
     def create_lip_sync_task(self, api_token, mode="text2video", text="", 
                            voice_id="girlfriend_1_speech02", voice_language="zh", 
                            voice_speed=1.0, audio_type="url", audio_url="", 
                            audio_file="", callback_url="", seed=-1, 
-                           video_id="", video_url=""):
+                           video_id="", video_url="", use_media_staging=False):
         """
         创建口型同步任务
         """
@@ -109,22 +124,23 @@ class KLingAILipSync:
             if mode == "text2video":
                 if not text:
                     raise ValueError("使用text2video模式时，文本内容不能为空")
-                if len(text) > 120:
-                    raise ValueError("文本内容不能超过120字符")
             elif mode == "audio2video":
                 if audio_type == "url" and not audio_url:
                     raise ValueError("使用audio2video模式且audio_type为url时，音频URL不能为空")
                 elif audio_type == "file" and not audio_file:
                     raise ValueError("使用audio2video模式且audio_type为file时，音频文件路径不能为空")
+            # 文本长度以及本地音频文件的格式和大小
+            preflight.check(self.endpoint, text=text if mode == "text2video" else None,
+                            audio_file=audio_file if mode == "audio2video" and audio_type == "file" else None)
 
             # 调试输出
-            print(f"处理模式: {mode}")
+            logger.info(f"处理模式: {mode}")
             if mode == "text2video":
-                print(f"使用的文本: {text}")
+                logger.info(f"使用的文本: {text}")
             elif mode == "audio2video" and audio_type == "file":
-                print(f"使用的音频文件: {audio_file}")
+                logger.info(f"使用的音频文件: {audio_file}")
             elif mode == "audio2video" and audio_type == "url":
-                print(f"使用的音频URL: {audio_url}")
+                logger.info(f"使用的音频URL: {audio_url}")
             
             # 准备请求头
             headers = {
@@ -157,22 +173,18 @@ class KLingAILipSync:
                 payload["input"]["audio_type"] = audio_type
                 if audio_type == "url":
                     payload["input"]["audio_url"] = audio_url.strip()
+                elif audio_type == "file" and use_media_staging:
+                    # 通过媒体中转发布本地文件，以URL方式提交，避免base64内联
+                    staged_url = get_stager().publish_file(audio_file)
+                    payload["input"]["audio_type"] = "url"
+                    payload["input"]["audio_url"] = staged_url
+                    logger.info(f"音频文件已通过媒体中转发布: {audio_file}")
                 elif audio_type == "file":
                     # 尝试两种方法处理音频文件
                     try:
-                        if not os.path.exists(audio_file):
-                            raise ValueError(f"音频文件不存在: {audio_file}")
-                        
-                        # 检查文件扩展名
-                        file_ext = os.path.splitext(audio_file)[1].lower()
-                        if file_ext not in ['.mp3', '.wav', '.m4a', '.acc']:
-                            raise ValueError(f"不支持的音频格式: {file_ext}，仅支持mp3/wav/m4a/acc格式")
-                        
-                        # 检查文件大小
+                        # 格式和大小已在preflight中校验
                         file_size_mb = os.path.getsize(audio_file) / (1024 * 1024)
-                        if file_size_mb > 5:
-                            raise ValueError(f"音频文件过大: {file_size_mb:.2f}MB，最大支持5MB")
-                        
+
                         # 首先尝试标准的方法：读取文件并转为base64
                         try:
                             with open(audio_file, 'rb') as f:
@@ -181,32 +193,23 @@ class KLingAILipSync:
                                 if not audio_bytes:
                                     raise ValueError("音频文件内容为空")
                                 
-                                # 使用标准的base64编码，确保编码后的字符串不包含额外字符
+                                # 使用标准的base64编码，b64encode的输出总是带填充的合法base64
                                 audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
                                 
-                                # 确保base64编码的长度是4的倍数
-                                padding = len(audio_base64) % 4
-                                if padding > 0:
-                                    audio_base64 += '=' * (4 - padding)
-                                
-                                # 验证base64编码的有效性
-                                try:
+                                # 编码结果的自检只在DEBUG级别执行，避免对数MB的字符串做多余的解码
+                                if logger.isEnabledFor(logging.DEBUG):
                                     test_decode = base64.b64decode(audio_base64)
                                     if len(test_decode) != len(audio_bytes):
                                         raise ValueError(f"Base64解码后大小不匹配: 原始={len(audio_bytes)}, 解码后={len(test_decode)}")
-                                except Exception as decode_err:
-                                    raise ValueError(f"Base64验证失败: {str(decode_err)}")
-                                
-                                # 打印编码后的Base64字符串的前10个字符和后10个字符，用于调试
-                                print(f"音频Base64 - 前缀: {audio_base64[:10]}... 后缀: ...{audio_base64[-10:]}")
-                                print(f"音频Base64长度: {len(audio_base64)}, 是否为4的倍数: {len(audio_base64) % 4 == 0}")
+                                    logger.debug("音频Base64 - 前缀: %s... 后缀: ...%s, 长度: %s",
+                                                 audio_base64[:10], audio_base64[-10:], len(audio_base64))
                             
-                            print(f"成功读取并编码音频文件: {audio_file}, 大小: {file_size_mb:.2f}MB")
+                            logger.info("成功读取并编码音频文件: %s, 大小: %.2fMB", audio_file, file_size_mb)
                             payload["input"]["audio_file"] = audio_base64
                         except Exception as e:
                             # 如果base64方法失败，尝试使用其他方式：先上传到外部服务或临时URL
-                            print(f"Base64编码方法失败: {str(e)}，尝试替代方案...")
-                            print("建议: 由于Base64编码不稳定，请考虑将音频上传到服务器并使用URL模式")
+                            logger.error(f"Base64编码方法失败: {str(e)}，尝试替代方案...")
+                            logger.info("建议: 由于Base64编码不稳定，请考虑将音频上传到服务器并使用URL模式")
                             raise ValueError(f"Base64编码失败: {str(e)} - 建议将音频文件上传到服务器，然后使用audio_type=url模式")
                     except Exception as e:
                         raise ValueError(f"处理音频文件时出错: {str(e)}")
@@ -217,55 +220,36 @@ class KLingAILipSync:
 
             # 发送API请求
             url = f"{self.api_base}{self.endpoint}"
-            print(f"正在发送请求到: {url}")
-            print(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
-            
-            # 更详细的请求调试信息
-            debug_payload = payload.copy()
-            if "input" in debug_payload:
-                debug_input = debug_payload["input"].copy()
-                
-                # 检查并记录关键字段
-                for key in debug_input.keys():
-                    if key == "audio_file":
-                        audio_file_len = len(debug_input["audio_file"])
-                        debug_input["audio_file"] = f"[BASE64 AUDIO DATA - {audio_file_len} characters]"
-                        print(f"音频文件Base64长度: {audio_file_len}")
-                        # 检查base64编码是否包含无效字符
-                        audio_base64 = payload["input"]["audio_file"]
-                        invalid_chars = [c for c in audio_base64 if c not in "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="]
-                        if invalid_chars:
-                            print(f"警告: 音频Base64包含{len(invalid_chars)}个无效字符: {invalid_chars[:10]} ...")
-                        # 检查base64编码长度是否是4的倍数
-                        if len(audio_base64) % 4 != 0:
-                            print(f"警告: 音频Base64长度({len(audio_base64)})不是4的倍数，可能缺少填充")
-                    elif key == "video_url":
-                        print(f"视频URL: {debug_input['video_url']}")
-                    elif key == "video_id":
-                        print(f"视频ID: {debug_input['video_id']}")
-                    elif key == "audio_url":
-                        print(f"音频URL: {debug_input['audio_url']}")
-                
-                debug_payload["input"] = debug_input
+            logger.info(f"正在发送请求到: {url}")
+            logger.info(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
             
-            print(f"请求数据: {json.dumps(debug_payload, indent=2, ensure_ascii=False)}")
+            # 详细的请求调试信息只在DEBUG级别生成，base64数据用长度代替
+            if logger.isEnabledFor(logging.DEBUG):
+                debug_input = dict(payload["input"])
+                if "audio_file" in debug_input:
+                    audio_base64 = debug_input["audio_file"]
+                    debug_input["audio_file"] = f"[BASE64 AUDIO DATA - {len(audio_base64)} characters]"
+                    # 用正则检查无效字符，不逐字符遍历
+                    invalid_match = _INVALID_BASE64.search(audio_base64)
+                    if invalid_match:
+                        logger.warning("音频Base64包含无效字符: %r (位置 %s)", invalid_match.group(), invalid_match.start())
+                logger.debug("请求数据: %s", LazyJSON({**payload, "input": debug_input}))
             
-            # 发送请求前记录详细信息
-            print(f"请求类型: {'视频URL' if 'video_url' in payload['input'] else '视频ID'}")
-            print(f"音频类型: {'音频文件' if audio_type == 'file' else '音频URL'}")
-            print(f"工作模式: {mode}")
+            logger.info("请求类型: %s, 音频类型: %s, 工作模式: %s",
+                        '视频URL' if 'video_url' in payload['input'] else '视频ID',
+                        '音频文件' if audio_type == 'file' else '音频URL', mode)
             
             # 发送请求
-            response = requests.post(url, headers=headers, json=payload)
+            response = post_task(url, headers=headers, json=payload)
             
             # 尝试解析JSON响应
             try:
                 response_data = response.json()
-                print(f"响应状态码: {response.status_code}")
-                print(f"响应数据: {json.dumps(response_data, indent=2, ensure_ascii=False)}")
+                logger.info("响应状态码: %s", response.status_code)
+                logger.debug("响应数据: %s", LazyJSON(response_data))
             except:
-                print(f"响应状态码: {response.status_code}")
-                print(f"响应内容: {response.text}")
+                logger.info(f"响应状态码: {response.status_code}")
+                logger.info(f"响应内容: {response.text}")
                 raise Exception(f"API响应不是有效的JSON格式: {response.text}")
 
             # 检查错误并提供详细错误信息
@@ -291,7 +275,7 @@ class KLingAILipSync:
                         error_analysis += "3. 视频时长是否在2-10秒之间\n"
                         error_analysis += "4. 视频分辨率是否为720p或1080p"
                     
-                    print(f"错误分析：\n{error_analysis}")
+                    logger.error(f"错误分析：\n{error_analysis}")
                     raise Exception(f"API请求失败 (错误码: {error_code}): {error_message} (请求ID: {request_id})\n{error_analysis}")
                 else:
                     raise Exception(f"API请求失败 (错误码: {error_code}): {error_message} (请求ID: {request_id})")
@@ -305,22 +289,26 @@ class KLingAILipSync:
             if not task_id:
                 raise Exception("API未返回任务ID")
 
-            print(f"成功创建口型同步任务，任务ID: {task_id} (本地种子: {seed})")
-            return (task_id, task_status, updated_at, seed)
+            metrics.task_submitted(task_id, "lip_sync", mode=mode)
+            profiler.annotate(task_id=task_id)
+            task = track_task(task_id, self.endpoint, api_token, "lip_sync", mode=mode)
+            get_admission().attach(task)
+            logger.info(f"成功创建口型同步任务，任务ID: {task_id} (本地种子: {seed})")
+            return (task_id, task_status, updated_at, seed, task)
 
         except ValueError as ve:
-            print(f"参数验证错误: {str(ve)}")
-            return (f"错误: {str(ve)}", "failed", "", seed)
+            logger.error(f"参数验证错误: {str(ve)}")
+            return (f"错误: {str(ve)}", "failed", "", seed, TaskHandle.failed(str(ve)))
         except Exception as e:
-            print(f"创建口型同步任务错误: {str(e)}")
-            return (f"错误: {str(e)}", "failed", "", seed)
+            logger.error(f"创建口型同步任务错误: {str(e)}")
+            return (f"错误: {str(e)}", "failed", "", seed, TaskHandle.failed(str(e)))
 
     @classmethod
     def IS_CHANGED(cls, api_token, mode="text2video", text="", 
                 voice_id="girlfriend_1_speech02", voice_language="zh", 
                 voice_speed=1.0, audio_type="url", audio_url="", 
                 audio_file="", callback_url="", seed=-1,
-                video_id="", video_url=""):
+                video_id="", video_url="", use_media_staging=False):
         """
         此方法用于判断节点是否需要重新执行
         我们使用种子控制重新执行逻辑
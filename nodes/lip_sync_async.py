@@ -1,23 +1,38 @@
-import json
 import time
 import random
-import requests
 import base64
 import os
 import io
 import glob
 import tempfile
 import uuid
-from datetime import datetime
 import re
-import subprocess
 from pathlib import Path
-import threading
 import shutil
 import concurrent.futures
 
-import folder_paths
-from pydub import AudioSegment
+from . import api_client, cancellation, metrics, preflight, profiler, progress
+from .admission import PRIORITY_BATCH, get_admission, submit_task
+from .lazy_import import lazy_module
+from .log import get_logger, task_context
+from .media_staging import get_stager
+from .scratch import get_scratch
+from .segment_cache import get_segment_cache
+from .stream_merge import StreamingMerger
+from .task_tracker import track_task
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+folder_paths = lazy_module("folder_paths")
+pydub = lazy_module("pydub")
+
+logger = get_logger("lip_sync_async")
+
+# 上传前的片段编码：单声道、语音采样率，体积约为WAV的1/10到1/20
+UPLOAD_CODECS = {
+    "mp3": {"format": "mp3", "codec": "libmp3lame", "suffix": ".mp3"},
+    "m4a": {"format": "ipod", "codec": "aac", "suffix": ".m4a"},
+}
+UPLOAD_SAMPLE_RATE = 24000
 
 
 class KLingAILipSyncAsync:
@@ -28,9 +43,10 @@ class KLingAILipSyncAsync:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         self.lip_sync_endpoint = "/v1/videos/lip-sync"
-        self.query_endpoint = "/v1/videos/lip-sync/{}"
+        # 为空时使用ComfyUI的output目录，无界面运行（nodes.runner）时由调用方指定
+        self.output_dir = None
         
     @classmethod
     def INPUT_TYPES(s):
@@ -70,7 +86,9 @@ class KLingAILipSyncAsync:
                     "default": 5,
                     "min": 1,
                     "max": 10,
-                    "step": 1
+                    "step": 1,
+                    "tooltip": "本地并行编码、上传和提交片段的线程数；同时在可灵端运行的任务数由所有节点共用的"
+                               "KLING_MAX_CONCURRENT_TASKS（默认5）限制"
                 }),
                 "poll_interval_seconds": ("INT", {
                     "default": 30,
@@ -89,12 +107,23 @@ class KLingAILipSyncAsync:
                     "max": 1000,
                     "step": 10,
                     "display": "slider"
-                })
+                }),
+                "use_media_staging": ("BOOLEAN", {"default": False}),
+                "use_segment_cache": ("BOOLEAN", {"default": True}),
+                "upload_codec": (["mp3", "m4a", "source"], {"default": "mp3"}),
+                "upload_bitrate": ("INT", {
+                    "default": 64,
+                    "min": 32,
+                    "max": 192,
+                    "step": 16
+                }),
+                "keep_artifacts": ("BOOLEAN", {"default": False}),
+                "merge_mode": (["files", "stream"], {"default": "files"})
             }
         }
 
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("video_path",)
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("video_path", "timings")
     FUNCTION = "process_lip_sync_async"
     CATEGORY = "JM-KLingAI-API/lip-sync"
     OUTPUT_NODE = True
@@ -104,38 +133,36 @@ class KLingAILipSyncAsync:
         Download audio file from URL
         """
         try:
-            print(f"正在从 {audio_url} 下载音频...")
-            response = requests.get(audio_url, stream=True)
-            response.raise_for_status()
+            logger.info(f"正在从 {audio_url} 下载音频...")
+            api_client.download_to_file(audio_url, output_path, "audio")
             
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            print(f"音频下载成功: {output_path}")
+            logger.info(f"音频下载成功: {output_path}")
             return True
         except Exception as e:
-            print(f"音频下载失败: {str(e)}")
+            logger.error(f"音频下载失败: {str(e)}")
             return False
 
-    def split_audio(self, audio_file_path, segment_duration, output_dir):
+    def split_audio(self, audio_file_path, segment_duration, output_dir, upload_codec="source",
+                    upload_bitrate=64, max_workers=4):
         """
         Split audio file into segments of specified duration
+        upload_codec不为source时，片段转为单声道、语音采样率的mp3/m4a再上传（最终视频仍使用原始音频），
+        各片段在线程池中并行编码
         """
         try:
-            print(f"正在分割音频文件: {audio_file_path}")
+            logger.info(f"正在分割音频文件: {audio_file_path}")
             # Determine audio format from extension
             file_ext = os.path.splitext(audio_file_path)[1].lower()
             
             # Load audio file
-            audio = AudioSegment.from_file(audio_file_path, format=file_ext.replace('.', ''))
+            with profiler.phase("decode"):
+                audio = pydub.AudioSegment.from_file(audio_file_path, format=file_ext.replace('.', ''))
             
             # Get total duration in milliseconds
             total_duration = len(audio)
             segment_duration_ms = segment_duration * 1000
             
-            segment_files = []
+            jobs = []
             
             # Split audio into segments
             for i, start_ms in enumerate(range(0, total_duration, segment_duration_ms)):
@@ -144,144 +171,148 @@ class KLingAILipSyncAsync:
                 
                 # Skip segments shorter than 2 seconds (2000ms)
                 if len(segment) < 2000:
-                    print(f"跳过过短的音频片段 {i+1}: {len(segment)/1000:.1f}秒")
+                    logger.warning(f"跳过过短的音频片段 {i+1}: {len(segment)/1000:.1f}秒")
                     continue
-                
-                # Save segment
-                segment_path = os.path.join(output_dir, f"segment_{i:03d}{file_ext}")
-                segment.export(segment_path, format=file_ext.replace('.', ''))
-                segment_files.append(segment_path)
-                
-                print(f"创建音频片段 {i+1}: {len(segment)/1000:.1f}秒, 保存至 {segment_path}")
+                jobs.append((i, segment))
+
+            codec = UPLOAD_CODECS.get(upload_codec)
+            suffix = codec["suffix"] if codec else file_ext
+
+            def export(job):
+                i, segment = job
+                segment_path = os.path.join(output_dir, f"segment_{i:03d}{suffix}")
+                with profiler.phase("encode"):
+                    if codec:
+                        segment = segment.set_channels(1).set_frame_rate(UPLOAD_SAMPLE_RATE)
+                        segment.export(segment_path, format=codec["format"], codec=codec["codec"],
+                                       bitrate=f"{upload_bitrate}k")
+                    else:
+                        segment.export(segment_path, format=file_ext.replace('.', ''))
+                logger.info(f"创建音频片段 {i+1}: {len(segment)/1000:.1f}秒, 保存至 {segment_path}")
+                return segment_path
+
+            # pydub的导出调用ffmpeg子进程，多个片段可以并行编码
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs) or 1))) as executor:
+                segment_files = list(executor.map(profiler.bind(export), jobs))
+
+            if codec and segment_files:
+                # 与未压缩的PCM数据比较，WAV源文件的片段大小与此基本一致
+                pcm_bytes = sum(len(segment.raw_data) for _, segment in jobs)
+                encoded_bytes = sum(os.path.getsize(path) for path in segment_files)
+                logger.info(f"片段已编码为 {upload_codec} {upload_bitrate}kbps 单声道: "
+                            f"{pcm_bytes / 1048576:.2f}MB -> {encoded_bytes / 1048576:.2f}MB，"
+                            f"节省 {(pcm_bytes - encoded_bytes) / 1048576:.2f}MB")
+                profiler.annotate(upload_bytes=encoded_bytes, upload_bytes_saved=pcm_bytes - encoded_bytes)
             
             return segment_files
         except Exception as e:
-            print(f"音频分割失败: {str(e)}")
+            logger.error(f"音频分割失败: {str(e)}")
             return []
 
-    def create_lip_sync_task(self, api_token, video_id, video_url, audio_file_path, max_retries=3, retry_delay=5):
+    def create_lip_sync_task(self, api_token, video_id, video_url, audio_file_path, audio_url=None,
+                             poll_interval=None):
         """
         Create a lip sync task for a specific audio segment
+        audio_url不为空时以URL方式提交（媒体中转），否则base64内联音频文件
+        提交前在共享的并发额度上排队，成功后返回交给后台轮询的任务句柄，失败返回None
         """
-        retries = 0
-        while retries <= max_retries:
-            try:
-                # Prepare headers
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {api_token.strip()}"
-                }
-                
-                # Prepare payload
-                payload = {
-                    "input": {
-                        "mode": "audio2video",
-                        "audio_type": "file"
-                    }
-                }
-                
-                # Add video source (either ID or URL)
-                if video_id:
-                    payload["input"]["task_id"] = video_id.strip()
-                    payload["input"]["video_id"] = video_id.strip()
-                elif video_url:
-                    payload["input"]["video_url"] = video_url.strip()
-                
+        payload = {
+            "input": {
+                "mode": "audio2video",
+                "audio_type": "url" if audio_url else "file"
+            }
+        }
+
+        # Add video source (either ID or URL)
+        if video_id:
+            payload["input"]["task_id"] = video_id.strip()
+            payload["input"]["video_id"] = video_id.strip()
+        elif video_url:
+            payload["input"]["video_url"] = video_url.strip()
+
+        admission = get_admission()
+        try:
+            admission.acquire(priority=PRIORITY_BATCH, url=f"{self.api_base}{self.lip_sync_endpoint}")
+        except api_client.CircuitOpenError as e:
+            logger.error(f"创建口型同步任务失败: {str(e)}")
+            return None
+        try:
+            if audio_url:
+                payload["input"]["audio_url"] = audio_url
+            else:
                 # Read and encode audio file
                 with open(audio_file_path, 'rb') as f:
-                    audio_bytes = f.read()
-                    audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-                    payload["input"]["audio_file"] = audio_base64
-                
-                # Send request
-                url = f"{self.api_base}{self.lip_sync_endpoint}"
-                response = requests.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                
-                response_data = response.json()
-                task_id = response_data.get("data", {}).get("task_id", "")
-                
-                if not task_id:
-                    raise ValueError("未能获取任务ID")
-                
-                print(f"成功创建口型同步任务: {task_id} 用于音频 {os.path.basename(audio_file_path)}")
-                return task_id
-            except requests.exceptions.HTTPError as e:
-                # 429 错误表示请求过多
-                if hasattr(e.response, 'status_code') and e.response.status_code == 429:
-                    retries += 1
-                    wait_time = retry_delay * (2 ** retries)  # 指数退避
-                    print(f"请求频率过高，等待 {wait_time} 秒后重试... ({retries}/{max_retries})")
-                    time.sleep(wait_time)
-                    continue
-                print(f"创建口型同步任务失败: {str(e)}")
-                return None
-            except Exception as e:
-                print(f"创建口型同步任务失败: {str(e)}")
-                return None
-        
-        print(f"达到最大重试次数，创建口型同步任务失败")
-        return None
+                    payload["input"]["audio_file"] = base64.b64encode(f.read()).decode('utf-8')
+            # 429和并发超限由submit_task处理：限流时退避重试，超限时等待进行中的任务结束
+            task_id = submit_task(self.lip_sync_endpoint, api_token, payload)["task_id"]
+        except Exception as e:
+            admission.release()
+            logger.error(f"创建口型同步任务失败: {str(e)}")
+            return None
+        except cancellation.Cancelled:
+            admission.release()
+            raise
 
-    def create_task_worker(self, api_token, video_id, video_url, segment_file, task_semaphore, delay_seconds=2):
-        """
-        Worker function for concurrent task creation with rate limiting
-        """
-        # 使用信号量限制并发，并在释放前等待一段时间防止请求过快
-        with task_semaphore:
-            task_id = self.create_lip_sync_task(api_token, video_id, video_url, segment_file)
-            # 在释放信号量前等待，防止API请求过快
-            time.sleep(delay_seconds)
-            
-        return {
-            "task_id": task_id,
-            "audio_file": segment_file,
-            "status": "pending" if task_id else "failed",
-            "video_url": None,
-            "video_file": None
-        }
+        metrics.task_submitted(task_id, "lip_sync", mode="audio2video")
+        handle = track_task(task_id, self.lip_sync_endpoint, api_token, "lip_sync", mode="audio2video",
+                            poll_interval=poll_interval, initial_delay=poll_interval)
+        admission.attach(handle)
+        logger.info(f"成功创建口型同步任务: {task_id} 用于音频 {os.path.basename(audio_file_path)}")
+        return handle
 
-    def query_task_status(self, api_token, task_id):
+    def collect_segment(self, task_info, videos_dir, download=True):
         """
-        Query task status
+        任务结束后下载对应的视频片段，结果写回task_info
+        download为False时（流式合并）只记录视频URL，由合并进程直接读取
         """
-        try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_token.strip()}"
-            }
-            
-            url = f"{self.api_base}{self.query_endpoint.format(task_id)}"
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            
-            response_data = response.json()
-            data = response_data.get("data", {})
-            status = data.get("task_status")
-            
-            return status, data
-        except Exception as e:
-            print(f"查询任务状态失败: {str(e)}")
-            return "failed", {}
+        handle = task_info["handle"]
+        if handle.status != "succeed":
+            task_info["status"] = "failed"
+            logger.error(f"任务失败: {handle.task_id} {handle.error}")
+            return
+
+        videos = handle.result_urls()
+        if not videos:
+            task_info["status"] = "failed"
+            logger.warning(f"任务成功但未返回视频URL: {handle.task_id}")
+            return
+
+        video_url = videos[0][0]
+        task_info["video_url"] = video_url
+        if not download:
+            task_info["status"] = "succeed"
+            return
+
+        # Download video
+        segment_index = os.path.basename(task_info["audio_file"]).split("_")[1].split(".")[0]
+        video_filename = f"segment_{segment_index}.mp4"
+        video_path = os.path.join(videos_dir, video_filename)
+
+        if self.download_video(video_url, video_path):
+            task_info["video_file"] = video_path
+            task_info["status"] = "succeed"
+            logger.info(f"成功下载视频片段 {segment_index}: {video_path}")
+        else:
+            task_info["status"] = "failed"
+            logger.error(f"下载视频片段 {segment_index} 失败")
+
+    def cache_segment(self, cache, key, task_info, video_file, move=False):
+        """把成功的片段写入片段缓存，元数据记录来源任务"""
+        cache.put(key, video_file, move=move, task_id=task_info["task_id"], video_url=task_info["video_url"],
+                  audio_file=os.path.basename(task_info["audio_file"]))
 
     def download_video(self, video_url, output_path):
         """
         Download video from URL
         """
         try:
-            print(f"正在从 {video_url} 下载视频...")
-            response = requests.get(video_url, stream=True)
-            response.raise_for_status()
+            logger.info(f"正在从 {video_url} 下载视频...")
+            api_client.download_to_file(video_url, output_path, "video")
             
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            print(f"视频下载成功: {output_path}")
+            logger.info(f"视频下载成功: {output_path}")
             return True
         except Exception as e:
-            print(f"视频下载失败: {str(e)}")
+            logger.error(f"视频下载失败: {str(e)}")
             return False
 
     def merge_videos(self, video_files, output_path):
@@ -305,21 +336,22 @@ class KLingAILipSyncAsync:
                 output_path
             ]
             
-            print(f"执行合并命令: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            logger.info(f"执行合并命令: {' '.join(cmd)}")
+            with metrics.FFMPEG_DURATION.time(step="concat"):
+                result = cancellation.run(cmd)
             
             # Remove the temporary file list
             if os.path.exists(file_list_path):
                 os.remove(file_list_path)
             
             if result.returncode != 0:
-                print(f"FFmpeg错误: {result.stderr}")
+                logger.error(f"FFmpeg错误: {result.stderr}")
                 return False
             
-            print(f"视频成功合并为: {output_path}")
+            logger.info(f"视频成功合并为: {output_path}")
             return True
         except Exception as e:
-            print(f"视频合并失败: {str(e)}")
+            logger.error(f"视频合并失败: {str(e)}")
             return False
 
     def merge_videos_with_original_audio(self, video_files, original_audio_path, output_path, sync_adjust_ms=0):
@@ -332,7 +364,7 @@ class KLingAILipSyncAsync:
             if not self.merge_videos(video_files, temp_merged_video):
                 raise ValueError("合并视频片段失败")
             
-            print(f"临时视频文件已创建: {temp_merged_video}")
+            logger.info(f"临时视频文件已创建: {temp_merged_video}")
             
             # 2. 提取音频并创建静音视频以确保同步
             temp_audio_path = output_path.replace(".mp4", "_audio.aac")
@@ -348,14 +380,15 @@ class KLingAILipSyncAsync:
                 temp_audio_path
             ]
             
-            print(f"提取音频命令: {' '.join(cmd_extract_audio)}")
-            result = subprocess.run(cmd_extract_audio, capture_output=True, text=True)
+            logger.info(f"提取音频命令: {' '.join(cmd_extract_audio)}")
+            with metrics.FFMPEG_DURATION.time(step="extract_audio"):
+                result = cancellation.run(cmd_extract_audio)
             
             if result.returncode != 0:
-                print(f"提取音频错误: {result.stderr}")
+                logger.error(f"提取音频错误: {result.stderr}")
                 # 继续尝试直接合并
             else:
-                print(f"成功提取音频: {temp_audio_path}")
+                logger.info(f"成功提取音频: {temp_audio_path}")
             
             # 3. 创建不带音轨的视频副本
             cmd_silent_video = [
@@ -366,14 +399,15 @@ class KLingAILipSyncAsync:
                 temp_silent_video
             ]
             
-            print(f"创建静音视频命令: {' '.join(cmd_silent_video)}")
-            result = subprocess.run(cmd_silent_video, capture_output=True, text=True)
+            logger.info(f"创建静音视频命令: {' '.join(cmd_silent_video)}")
+            with metrics.FFMPEG_DURATION.time(step="strip_audio"):
+                result = cancellation.run(cmd_silent_video)
             
             if result.returncode != 0:
-                print(f"创建静音视频错误: {result.stderr}")
+                logger.error(f"创建静音视频错误: {result.stderr}")
                 # 继续尝试直接合并
             else:
-                print(f"成功创建静音视频: {temp_silent_video}")
+                logger.info(f"成功创建静音视频: {temp_silent_video}")
                 # 使用静音视频替代原视频
                 temp_merged_video = temp_silent_video
             
@@ -391,13 +425,13 @@ class KLingAILipSyncAsync:
                     delay_sec = sync_adjust_ms / 1000.0
                     cmd.extend(["-itsoffset", f"{delay_sec}", "-i", original_audio_path])
                     cmd.extend(["-map", "0:v", "-map", "2:a"])  # 使用延迟后的音频
-                    print(f"应用音频延迟: {delay_sec}秒")
+                    logger.info(f"应用音频延迟: {delay_sec}秒")
                 else:
                     # 负值表示视频需要延迟（口型比音频慢）
                     delay_sec = abs(sync_adjust_ms) / 1000.0
                     cmd.extend(["-itsoffset", f"{delay_sec}", "-i", temp_merged_video])
                     cmd.extend(["-map", "2:v", "-map", "1:a"])  # 使用延迟后的视频
-                    print(f"应用视频延迟: {delay_sec}秒")
+                    logger.info(f"应用视频延迟: {delay_sec}秒")
             else:
                 # 默认映射
                 cmd.extend(["-map", "0:v", "-map", "1:a"])
@@ -412,34 +446,41 @@ class KLingAILipSyncAsync:
                 output_path
             ])
             
-            print(f"执行音频替换命令: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            logger.info(f"执行音频替换命令: {' '.join(cmd)}")
+            with metrics.FFMPEG_DURATION.time(step="mux_audio"):
+                result = cancellation.run(cmd)
             
             # 删除临时文件
             temp_files = [temp_merged_video, temp_audio_path, temp_silent_video]
             for temp_file in temp_files:
                 if os.path.exists(temp_file):
                     os.remove(temp_file)
-                    print(f"已删除临时文件: {temp_file}")
+                    logger.info(f"已删除临时文件: {temp_file}")
             
             if result.returncode != 0:
-                print(f"FFmpeg音频替换错误: {result.stderr}")
+                logger.error(f"FFmpeg音频替换错误: {result.stderr}")
                 return False
             
-            print(f"视频成功合并并替换原始音频: {output_path}")
+            logger.info(f"视频成功合并并替换原始音频: {output_path}")
             return True
         except Exception as e:
-            print(f"视频合并并替换音频失败: {str(e)}")
+            logger.error(f"视频合并并替换音频失败: {str(e)}")
             return False
 
+    @profiler.profiled("lip_sync_async")
+    @cancellation.interruptible("lip_sync_async")
+    @progress.reporting("lip_sync_async")
     def process_lip_sync_async(self, api_token, video_id="", video_url="", 
                              audio_type="url", audio_url="", audio_file="",
                              segment_duration=10, max_concurrent_tasks=5,
                              poll_interval_seconds=30, sync_adjust_ms=0,
-                             output_filename="lip_sync_combined"):
+                             output_filename="lip_sync_combined", use_media_staging=False,
+                             use_segment_cache=True, upload_codec="mp3", upload_bitrate=64,
+                             keep_artifacts=False, merge_mode="files"):
         """
         Main function to process lip sync asynchronously
         """
+        merger = None
         try:
             # Validate required parameters
             if not api_token:
@@ -457,20 +498,12 @@ class KLingAILipSyncAsync:
             if audio_type == "file" and not audio_file:
                 raise ValueError("当audio_type为file时，audio_file不能为空")
             
-            # Create timestamp-based temporary directory
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            temp_dir_name = f"lip_sync_temp_{timestamp}"
-            output_dir = folder_paths.get_output_directory()
-            temp_dir = os.path.join(output_dir, temp_dir_name)
-            audio_segments_dir = os.path.join(temp_dir, "audio_segments")
-            videos_dir = os.path.join(temp_dir, "videos")
-            
-            # Create directories
-            os.makedirs(temp_dir, exist_ok=True)
-            os.makedirs(audio_segments_dir, exist_ok=True)
-            os.makedirs(videos_dir, exist_ok=True)
-            
-            print(f"创建临时工作目录: {temp_dir}")
+            # 中间文件放在独立的临时目录中（不在output目录下），成功后删除
+            output_dir = self.output_dir or folder_paths.get_output_directory()
+            scratch_job = get_scratch().job("lip_sync")
+            temp_dir = scratch_job.path
+            audio_segments_dir = scratch_job.subdir("audio_segments")
+            videos_dir = scratch_job.subdir("videos")
             
             # Handle audio source
             local_audio_path = ""
@@ -491,205 +524,186 @@ class KLingAILipSyncAsync:
                 local_audio_path = os.path.join(temp_dir, f"original_audio{file_ext}")
                 shutil.copyfile(audio_file, local_audio_path)
             
+            scratch_job.check()
+
             # Split audio into segments
-            segment_files = self.split_audio(local_audio_path, segment_duration, audio_segments_dir)
+            segment_files = self.split_audio(local_audio_path, segment_duration, audio_segments_dir,
+                                             upload_codec, upload_bitrate, max_concurrent_tasks)
             
             if not segment_files:
                 raise ValueError("音频分割失败或没有有效片段")
             
-            print(f"音频已分割为 {len(segment_files)} 个片段")
+            logger.info(f"音频已分割为 {len(segment_files)} 个片段")
+            scratch_job.check()
+
+            # 上传和提交之前校验全部片段，任何片段不合规则整体失败
+            problems = [problem for segment_file in segment_files
+                        for problem in preflight.validate(self.lip_sync_endpoint, audio_file=segment_file)]
+            if problems:
+                raise preflight.PreflightError(problems)
+
+            # 之前运行中已成功的片段直接复用缓存的视频，只提交其余片段
+            cache = get_segment_cache() if use_segment_cache else None
+            segment_keys, cached_segments = {}, {}
+            if cache is not None:
+                video_source = video_id.strip() or video_url.strip()
+                for segment_file in segment_files:
+                    key = cache.key(video_source, segment_file, endpoint=self.lip_sync_endpoint, mode="audio2video")
+                    segment_keys[segment_file] = key
+                    cached_path, meta = cache.get(key)
+                    if cached_path:
+                        cached_segments[segment_file] = (cached_path, meta)
+                if cached_segments:
+                    logger.info(f"{len(cached_segments)} 个片段使用缓存结果，"
+                                f"需要提交 {len(segment_files) - len(cached_segments)} 个片段")
+            submit_segments = [s for s in segment_files if s not in cached_segments]
+
+            # 媒体中转模式：并行发布所有片段，任务以URL方式提交
+            segment_urls = {}
+            if use_media_staging and submit_segments:
+                staged_urls = get_stager().publish_many(submit_segments, max_workers=max_concurrent_tasks)
+                segment_urls = dict(zip(submit_segments, staged_urls))
+                logger.info(f"已通过媒体中转发布 {len(segment_urls)} 个音频片段")
             
-            # 使用线程池并发创建口型同步任务，最多max_concurrent_tasks个并发任务
+            output_video_path = os.path.join(output_dir, f"{output_filename}.mp4")
+            streaming = merge_mode == "stream"
+            segment_index = {segment_file: index for index, segment_file in enumerate(segment_files)}
+
+            # 按片段文件索引：内容相同的片段（例如两段静音）缓存键和来源任务相同，不能按task_id区分
             task_mapping = {}
-            print(f"开始创建口型同步任务，最大并发数: {max_concurrent_tasks}, 总片段数: {len(segment_files)}")
-            
-            # 分批处理音频片段，确保所有片段都被处理
-            batch_size = max_concurrent_tasks
-            remaining_segments = segment_files.copy()
-            
-            while remaining_segments:
-                # 取出当前批次的片段
-                current_batch = remaining_segments[:batch_size]
-                remaining_segments = remaining_segments[batch_size:]
-                
-                print(f"处理批次: {len(current_batch)} 个片段，剩余: {len(remaining_segments)} 个片段")
-                
-                # 使用信号量控制实际并发请求数
-                task_semaphore = threading.Semaphore(max_concurrent_tasks)
-                
-                # 使用线程池处理当前批次
-                with concurrent.futures.ThreadPoolExecutor(max_workers=len(current_batch)) as executor:
-                    # 初始化任务列表
-                    future_to_segment = {}
-                    
-                    # 提交当前批次的所有任务
-                    for segment_file in current_batch:
-                        future = executor.submit(
-                            self.create_task_worker, 
-                            api_token, 
-                            video_id, 
-                            video_url, 
-                            segment_file,
-                            task_semaphore,
-                            2  # 每个请求完成后延迟2秒再释放信号量
-                        )
-                        future_to_segment[future] = segment_file
-                    
-                    # 等待当前批次所有任务完成并收集结果
-                    for future in concurrent.futures.as_completed(future_to_segment):
-                        segment_file = future_to_segment[future]
-                        try:
-                            result = future.result()
-                            if result["task_id"]:
-                                task_mapping[result["task_id"]] = result
-                                print(f"任务已创建: {result['task_id']} 对应音频 {os.path.basename(segment_file)}")
-                            else:
-                                print(f"创建任务失败，音频: {os.path.basename(segment_file)}")
-                                # 任务失败时，添加回待处理队列，稍后重试（除非达到重试上限）
-                                if segment_file not in remaining_segments:
-                                    # 为避免无限循环，可以添加重试计数器，这里简化处理
-                                    remaining_segments.append(segment_file)
-                        except Exception as e:
-                            print(f"处理任务时出错: {str(e)}, 音频: {os.path.basename(segment_file)}")
-                            # 出错时也添加回待处理队列
-                            if segment_file not in remaining_segments:
-                                remaining_segments.append(segment_file)
-                
-                # 每处理完一批次等待一段时间，避免API限制
-                if remaining_segments:
-                    wait_time = 30  # 增加到30秒
-                    print(f"批次完成，等待 {wait_time} 秒后处理下一批次...")
-                    time.sleep(wait_time)
-            
-            # 检查是否所有片段都创建了任务
-            created_segments = set(info["audio_file"] for info in task_mapping.values())
-            missing_segments = [s for s in segment_files if s not in created_segments]
-            
-            if missing_segments:
-                print(f"警告: 有 {len(missing_segments)} 个音频片段未创建任务: {[os.path.basename(s) for s in missing_segments]}")
-                
-                # 重试那些未创建任务的片段
-                print("尝试为未创建任务的片段重新创建任务...")
-                for segment_file in missing_segments:
-                    print(f"为片段 {os.path.basename(segment_file)} 重试创建任务")
-                    task_id = self.create_lip_sync_task(api_token, video_id, video_url, segment_file)
-                    if task_id:
-                        task_mapping[task_id] = {
+            for segment_file, (cached_path, meta) in cached_segments.items():
+                task_mapping[segment_file] = {
+                    "task_id": meta.get("task_id", ""),
+                    "audio_file": segment_file,
+                    "status": "succeed",
+                    "video_url": meta.get("video_url"),
+                    "video_file": cached_path,
+                    "handle": None
+                }
+
+            if streaming:
+                # 流式合并：合并进程现在启动，片段按顺序一完成就送入，与其余片段的提交、生成重叠
+                merger = StreamingMerger(output_video_path, local_audio_path, sync_adjust_ms)
+                merger.start()
+                # 片段序号 -> 视频来源，None表示失败或未创建任务
+                resolved = {segment_index[s]: path for s, (path, _) in cached_segments.items()}
+                next_segment = 0
+
+                def feed_ready():
+                    nonlocal next_segment
+                    while next_segment in resolved:
+                        source = resolved.pop(next_segment)
+                        offset = next_segment * segment_duration
+                        if source is None:
+                            merger.skip(offset, segment_duration)
+                        else:
+                            segment_file = segment_files[next_segment]
+                            # 新完成的片段在送入合并进程的同时另存一份，写入片段缓存
+                            copy_path = None
+                            if cache is not None and segment_file not in cached_segments:
+                                copy_path = os.path.join(videos_dir, f"segment_{next_segment:03d}.mp4")
+                            with profiler.phase("merge"):
+                                added = merger.add(source, offset, copy_to=copy_path)
+                            if not added:
+                                # 转换失败的片段可能已写入一部分，输出文件不可用，不再等待其余片段
+                                raise ValueError(f"片段 {next_segment} 送入合并进程失败，流式合并中止")
+                            if copy_path:
+                                self.cache_segment(cache, segment_keys[segment_file], task_mapping[segment_file],
+                                                   copy_path, move=True)
+                        next_segment += 1
+
+                feed_ready()
+
+            # 片段提交在共享的并发额度上排队：额度用满时在本地等待，后台轮询器看到任务结束后依次放行
+            # 提交在线程池中进行，不等全部片段提交完，已创建的任务一完成就下载（或送入合并进程）
+            # 同时运行的任务数由共享额度决定，多于额度的提交线程只会在本地排队
+            admission = get_admission()
+            submit_workers = max(1, min(max_concurrent_tasks, admission.ceiling))
+            if max_concurrent_tasks > admission.ceiling:
+                logger.info(f"max_concurrent_tasks={max_concurrent_tasks} 超过共享并发额度 {admission.ceiling}"
+                            f"（KLING_MAX_CONCURRENT_TASKS），同时运行的任务最多 {admission.ceiling} 个")
+            logger.info(f"开始创建口型同步任务，提交线程数: {submit_workers}, 需要提交的片段数: {len(submit_segments)}")
+            logger.info(f"后台每 {poll_interval_seconds} 秒查询一次状态，完成的片段会立即下载")
+            create_task = profiler.bind(self.create_lip_sync_task)
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=submit_workers)
+            submitting = {
+                executor.submit(create_task, api_token, video_id, video_url, segment_file,
+                                audio_url=segment_urls.get(segment_file), poll_interval=poll_interval_seconds): segment_file
+                for segment_file in submit_segments
+            }
+            missing_segments = []
+            pending = {}
+            try:
+                while submitting or pending:
+                    for future in [future for future in submitting if future.done()]:
+                        segment_file = submitting.pop(future)
+                        handle = future.result()
+                        if handle is None:
+                            missing_segments.append(segment_file)
+                            if streaming:
+                                resolved[segment_index[segment_file]] = None
+                                feed_ready()
+                            continue
+                        task_mapping[segment_file] = pending[segment_file] = {
+                            "task_id": handle.task_id,
                             "audio_file": segment_file,
                             "status": "pending",
                             "video_url": None,
-                            "video_file": None
+                            "video_file": None,
+                            "handle": handle
                         }
-                        print(f"成功重新创建任务: {task_id} 用于音频 {os.path.basename(segment_file)}")
-                        # 每个请求后等待几秒
-                        time.sleep(3)
-            
+
+                    # 已下载的片段（包括缓存命中）和未创建任务的片段计为完成，其余按任务状态计入
+                    progress.report_tasks([info["handle"] for info in pending.values()],
+                                          completed=len(task_mapping) - len(pending) + len(missing_segments),
+                                          total=len(segment_files))
+                    for segment_file, task_info in list(pending.items()):
+                        if task_info["handle"].done.is_set():
+                            del pending[segment_file]
+                            with task_context(f"task={task_info['task_id']}"):
+                                self.collect_segment(task_info, videos_dir, download=not streaming)
+                                scratch_job.check()
+                                if streaming:
+                                    resolved[segment_index[segment_file]] = (
+                                        task_info["video_url"] if task_info["status"] == "succeed" else None)
+                                    feed_ready()
+                                elif cache is not None and task_info["status"] == "succeed":
+                                    self.cache_segment(cache, segment_keys[segment_file], task_info,
+                                                       task_info["video_file"])
+                            logger.info(f"还有 {len(pending)} 个任务正在处理，{len(submitting)} 个片段等待提交，"
+                                        f"{len(task_mapping) - len(pending)} 个任务已完成。")
+                    if pending:
+                        # 等待任意一个未完成的任务，最多1秒后重新检查
+                        with profiler.phase("server_wait"):
+                            next(iter(pending.values()))["handle"].wait(1.0)
+                    elif submitting:
+                        concurrent.futures.wait(submitting, timeout=cancellation.CHECK_INTERVAL,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+                        cancellation.check()
+            finally:
+                # 出错或取消时不再提交还没开始的片段；已在排队的提交线程同样会检测到取消
+                executor.shutdown(wait=False, cancel_futures=True)
+
+            if missing_segments:
+                missing_segments.sort(key=segment_index.get)
+                logger.warning(f"警告: 有 {len(missing_segments)} 个音频片段未创建任务: {[os.path.basename(s) for s in missing_segments]}")
+                logger.info("将只处理成功创建任务的片段")
             if not task_mapping:
                 raise ValueError("没有成功创建任何口型同步任务")
-            
-            print(f"成功创建 {len(task_mapping)} 个口型同步任务，共 {len(segment_files)} 个音频片段")
-            
-            # 确认所有片段是否都有对应的任务
-            created_segments = set(info["audio_file"] for info in task_mapping.values())
-            missing_segments = [s for s in segment_files if s not in created_segments]
-            if missing_segments:
-                print(f"警告: 仍有 {len(missing_segments)} 个音频片段未创建任务: {[os.path.basename(s) for s in missing_segments]}")
-                print("将只处理成功创建任务的片段")
-
-            # 成功创建所有任务后，先等待较长时间再开始检查状态
-            initial_wait = 180  # 3分钟
-            print(f"所有任务已创建，等待 {initial_wait} 秒后开始检查任务状态...（{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}）")
-            print("-------------------------------------------------------------------")
-            print(f"您可以去喝杯咖啡，{initial_wait//60}分钟后回来看进度...")
-            print("-------------------------------------------------------------------")
-            # 使用循环等待，每30秒打印一次提示，避免用户误以为程序卡住
-            for i in range(initial_wait // 30):
-                time.sleep(30)
-                remaining = initial_wait - (i+1)*30
-                if remaining > 0:
-                    print(f"还需等待 {remaining} 秒后开始检查任务状态...（{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}）")
-                
-            print(f"等待结束，开始检查任务状态...（{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}）")
-            
-            # Monitor task status and download videos when completed
-            all_completed = False
-            # 默认60秒查询一次状态
-            if poll_interval_seconds < 60:
-                poll_interval_seconds = 60
-                print(f"状态查询间隔调整为 {poll_interval_seconds} 秒")
-                
-            while not all_completed:
-                all_completed = True
-                pending_count = 0
-                processed_count = 0
-                
-                # 打印当前时间
-                current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                print(f"开始查询任务状态... [{current_time}]")
-                
-                for task_id, task_info in task_mapping.items():
-                    if task_info["status"] not in ["succeed", "failed"]:
-                        pending_count += 1
-                        all_completed = False
-                        
-                        # Query task status
-                        status, data = self.query_task_status(api_token, task_id)
-                        print(f"任务 {task_id} 状态: {status}")
-                        
-                        if status == "succeed":
-                            # Get video URL
-                            videos = data.get("task_result", {}).get("videos", [])
-                            if videos and videos[0].get("url"):
-                                video_url = videos[0].get("url")
-                                task_info["video_url"] = video_url
-                                
-                                # Download video
-                                segment_index = os.path.basename(task_info["audio_file"]).split("_")[1].split(".")[0]
-                                video_filename = f"segment_{segment_index}.mp4"
-                                video_path = os.path.join(videos_dir, video_filename)
-                                
-                                if self.download_video(video_url, video_path):
-                                    task_info["video_file"] = video_path
-                                    task_info["status"] = "succeed"
-                                    print(f"成功下载视频片段 {segment_index}: {video_path}")
-                                    processed_count += 1
-                                else:
-                                    task_info["status"] = "failed"
-                                    print(f"下载视频片段 {segment_index} 失败")
-                            else:
-                                task_info["status"] = "failed"
-                                print(f"任务成功但未返回视频URL: {task_id}")
-                        elif status == "failed":
-                            task_info["status"] = "failed"
-                            print(f"任务失败: {task_id}")
-                            processed_count += 1
-                        elif status:  # 添加对其他状态的详细打印
-                            print(f"任务 {task_id} 正在处理中: {status}")
-                            if 'task_status_msg' in data:
-                                print(f"状态消息: {data.get('task_status_msg')}")
-                            # 尝试获取进度信息（如果有）
-                            if 'process_progress' in data:
-                                print(f"进度: {data.get('process_progress')}%")
-                
-                if not all_completed:
-                    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    print(f"[{current_time}] 还有 {pending_count} 个任务正在处理，{processed_count} 个任务已完成。")
-                    print(f"将在 {poll_interval_seconds} 秒后重新检查...")
-                    time.sleep(poll_interval_seconds)
-            
+            logger.info(f"共 {len(segment_files)} 个音频片段，创建 {len(task_mapping) - len(cached_segments)} 个口型同步任务，"
+                        f"{len(cached_segments)} 个使用缓存结果")
+
             # Check if all tasks completed successfully
-            failed_tasks = [task_id for task_id, info in task_mapping.items() if info["status"] == "failed"]
+            failed_tasks = [info["task_id"] for info in task_mapping.values() if info["status"] == "failed"]
             if failed_tasks:
-                print(f"警告: {len(failed_tasks)} 个任务失败: {', '.join(failed_tasks)}")
+                logger.error(f"警告: {len(failed_tasks)} 个任务失败: {', '.join(failed_tasks)}")
             
             # Get successful video files in correct order
             successful_videos = []
             for segment_file in segment_files:
-                segment_index = os.path.basename(segment_file).split("_")[1].split(".")[0]
-                for task_id, info in task_mapping.items():
-                    if info["audio_file"] == segment_file and info["status"] == "succeed":
-                        successful_videos.append(info["video_file"])
-                        break
+                info = task_mapping.get(segment_file)
+                if info is not None and info["status"] == "succeed":
+                    successful_videos.append(info["video_file"] or info["video_url"])
             
             if not successful_videos:
                 raise ValueError("没有成功生成的视频片段可供合并")
@@ -698,25 +712,32 @@ class KLingAILipSyncAsync:
             original_audio_path = local_audio_path
             
             # Merge videos with original audio
-            output_video_path = os.path.join(output_dir, f"{output_filename}.mp4")
-            if self.merge_videos_with_original_audio(successful_videos, original_audio_path, output_video_path, sync_adjust_ms):
-                print(f"所有视频片段已成功合并并使用原始音频: {output_video_path}")
-                # Clean up temp directory
-                # shutil.rmtree(temp_dir)
+            with profiler.phase("merge"):
+                if streaming:
+                    merged = merger.finish()
+                else:
+                    merged = self.merge_videos_with_original_audio(successful_videos, original_audio_path,
+                                                                   output_video_path, sync_adjust_ms)
+            if merged:
+                logger.info(f"所有视频片段已成功合并并使用原始音频: {output_video_path}")
+                # 失败或取消时保留临时目录，由启动时的清理回收
+                scratch_job.finish(keep=keep_artifacts)
                 return (output_video_path,)
             else:
                 raise ValueError("视频合并失败")
             
+        except cancellation.Cancelled:
+            if merger is not None:
+                merger.abort()
+            raise
         except Exception as e:
+            if merger is not None:
+                merger.abort()
             error_msg = f"处理失败: {str(e)}"
-            print(error_msg)
+            logger.error(error_msg)
             return (error_msg,)
     
     @classmethod
-    def IS_CHANGED(cls, api_token, video_id="", video_url="", 
-                 audio_type="url", audio_url="", audio_file="",
-                 segment_duration=10, max_concurrent_tasks=5,
-                 poll_interval_seconds=30,
-                 output_filename="lip_sync_combined"):
+    def IS_CHANGED(cls, **kwargs):
         # Return current time to ensure node always executes
         return time.time() 
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import re
+import sys
+import json
+import logging
+import threading
+import contextlib
+import contextvars
+
+
+# 日志级别通过环境变量 KLING_LOG_LEVEL 设置（DEBUG/INFO/WARNING/ERROR），默认INFO
+LOGGER_NAME = "JM-KLingAI-API"
+DEFAULT_LEVEL = "INFO"
+
+# 当前任务上下文（如任务ID、片段编号），会附加到每条日志前
+_task_context = contextvars.ContextVar("kling_task_context", default="")
+
+# 日志输出前统一脱敏：Bearer令牌和JWT
+_BEARER_PATTERN = re.compile(r"(Bearer\s+)[A-Za-z0-9\-_\.=]+")
+_JWT_PATTERN = re.compile(r"eyJ[A-Za-z0-9\-_=]+\.[A-Za-z0-9\-_=]+\.[A-Za-z0-9\-_.+/=]*")
+
+_configure_lock = threading.Lock()
+_configured = False
+
+
+def redact_token(token):
+    """令牌脱敏，只保留前6个字符"""
+    if not token:
+        return ""
+    token = str(token)
+    return f"{token[:6]}...(共{len(token)}字符)"
+
+
+def redact_text(text):
+    """将文本中的Bearer令牌和JWT替换为脱敏形式"""
+    text = _BEARER_PATTERN.sub(lambda m: m.group(1) + "***", text)
+    return _JWT_PATTERN.sub("<jwt:***>", text)
+
+
+class LazyJSON:
+    """
+    延迟序列化的JSON参数
+    只有日志真正输出时才执行json.dumps，DEBUG关闭时不产生任何序列化开销
+    """
+
+    __slots__ = ("obj", "indent")
+
+    def __init__(self, obj, indent=2):
+        self.obj = obj
+        self.indent = indent
+
+    def __str__(self):
+        try:
+            return json.dumps(self.obj, indent=self.indent, ensure_ascii=False, default=str)
+        except Exception:
+            return repr(self.obj)
+
+
+class RedactedHeaders:
+    """延迟格式化的请求头，Authorization等敏感字段脱敏"""
+
+    __slots__ = ("headers",)
+
+    SENSITIVE = ("authorization", "x-api-key", "cookie")
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def __str__(self):
+        safe = {}
+        for key, value in (self.headers or {}).items():
+            if key.lower() in self.SENSITIVE:
+                value = redact_token(str(value).replace("Bearer ", ""))
+            safe[key] = value
+        return json.dumps(safe, ensure_ascii=False)
+
+
+class _TaskContextFilter(logging.Filter):
+    def filter(self, record):
+        record.task_context = _task_context.get()
+        return True
+
+
+class _KLingFormatter(logging.Formatter):
+    """输出格式: [JM-KLingAI-API][任务上下文] 消息，并在输出前脱敏"""
+
+    def format(self, record):
+        message = super().format(record)
+        context = getattr(record, "task_context", "")
+        prefix = f"[{LOGGER_NAME}]"
+        if record.levelno >= logging.WARNING:
+            prefix += f"[{record.levelname}]"
+        if context:
+            prefix += f"[{context}]"
+        return redact_text(f"{prefix} {message}")
+
+
+def _configure():
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        root = logging.getLogger(LOGGER_NAME)
+        level_name = os.environ.get("KLING_LOG_LEVEL", DEFAULT_LEVEL).upper()
+        root.setLevel(getattr(logging, level_name, logging.INFO))
+        handler = logging.StreamHandler(sys.stdout)
+        handler.addFilter(_TaskContextFilter())
+        handler.setFormatter(_KLingFormatter("%(message)s"))
+        root.addHandler(handler)
+        # 不向ComfyUI的root logger传递，避免重复输出
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name=None):
+    """获取插件日志记录器，name一般为模块名"""
+    _configure()
+    if name:
+        return logging.getLogger(f"{LOGGER_NAME}.{name}")
+    return logging.getLogger(LOGGER_NAME)
+
+
+def set_level(level):
+    """运行时调整日志级别，level为字符串或logging常量"""
+    _configure()
+    if isinstance(level, str):
+        level = getattr(logging, level.upper(), logging.INFO)
+    logging.getLogger(LOGGER_NAME).setLevel(level)
+
+
+@contextlib.contextmanager
+def task_context(context):
+    """
+    在with块内为日志附加任务上下文，例如 with task_context(f"task={task_id}"):
+    注意contextvars不会自动传递到新线程，线程内需要重新设置
+    """
+    token = _task_context.set(str(context) if context else "")
+    try:
+        yield
+    finally:
+        _task_context.reset(token)
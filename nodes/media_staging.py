@@ -0,0 +1,404 @@
+import os
+import io
+import abc
+import hmac
+import time
+import hashlib
+import secrets
+import mimetypes
+import tempfile
+import threading
+import concurrent.futures
+from urllib.parse import quote, unquote, urlparse, parse_qs
+
+from . import profiler
+from .log import get_logger
+
+logger = get_logger("media_staging")
+
+
+# 媒体中转层配置，全部通过环境变量设置
+# KLING_STAGING_BACKEND: local(默认) 或 s3
+# KLING_STAGING_PUBLIC_URL: 可灵服务器可以访问到的本地文件服务地址，例如 https://example.com:8190
+# KLING_STAGING_HOST / KLING_STAGING_PORT: 本地文件服务监听地址，默认只监听127.0.0.1（通过反向代理对外提供）
+# KLING_STAGING_ALLOW_PUBLIC_BIND: 设为1才允许监听非本机地址（如0.0.0.0），否则启动服务时报错
+# KLING_STAGING_DIR: 本地文件存放目录，中转文件以STAGED_PREFIX开头，清理只删除这些文件
+# KLING_STAGING_SECRET: URL签名密钥（未设置时每次进程启动随机生成）
+# KLING_STAGING_TTL: 签名URL有效期（秒）
+# KLING_S3_BUCKET / KLING_S3_ENDPOINT_URL / KLING_S3_PREFIX / KLING_S3_REGION: S3兼容存储配置
+# 本地目录中超过有效期（加上CLEANUP_GRACE）没有再发布过的文件每CLEANUP_INTERVAL秒清理一次；
+# S3后端不做清理，请为前缀配置生命周期规则
+DEFAULT_TTL = 3600
+CLEANUP_INTERVAL = 600
+# URL过期后再保留一段时间，留给已经开始的下载
+CLEANUP_GRACE = 300
+DEFAULT_HOST = "127.0.0.1"
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+# 本地目录中由中转层写入的文件名前缀，目录可能是用户已有的文件夹，其他文件不做任何处理
+STAGED_PREFIX = "kling_staged_"
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_file(path):
+    """计算文件的SHA-256，用于内容去重"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StagingBackend(abc.ABC):
+    """
+    媒体中转存储后端接口
+    子类需要实现 exists / put_file / signed_url
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def exists(self, key):
+        """key对应的内容是否已在后端"""
+
+    @abc.abstractmethod
+    def put_file(self, key, path, content_type):
+        """上传本地文件"""
+
+    @abc.abstractmethod
+    def signed_url(self, key, ttl):
+        """生成ttl秒内有效的访问URL"""
+
+    def touch(self, key):
+        """标记内容刚被发布，清理时按最后发布时间计算"""
+
+    def cleanup(self, max_age):
+        """删除超过max_age秒没有发布过的内容，返回删除的数量"""
+        return 0
+
+
+def _make_request_handler(backend):
+    """
+    创建只读文件服务的请求处理类，校验签名和过期时间后返回文件
+    http.server 在首次启动服务时才导入，不影响插件加载速度
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    class StagingRequestHandler(BaseHTTPRequestHandler):
+        def _resolve(self):
+            parsed = urlparse(self.path)
+            if not parsed.path.startswith("/media/"):
+                return None, 404
+            key = unquote(parsed.path[len("/media/"):])
+            query = parse_qs(parsed.query)
+            expires = query.get("expires", [""])[0]
+            signature = query.get("sig", [""])[0]
+            if not backend.verify(key, expires, signature):
+                return None, 403
+            path = backend.path_for(key)
+            if not os.path.isfile(path):
+                return None, 404
+            return path, 200
+
+        def _send_headers(self, path):
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(os.path.getsize(path)))
+            self.send_header("Cache-Control", "private, max-age=60")
+            self.end_headers()
+
+        def do_HEAD(self):
+            path, status = self._resolve()
+            if path is None:
+                self.send_error(status)
+                return
+            self._send_headers(path)
+
+        def do_GET(self):
+            path, status = self._resolve()
+            if path is None:
+                self.send_error(status)
+                return
+            self._send_headers(path)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    self.wfile.write(chunk)
+
+        def log_message(self, format, *args):
+            # 不打印每次访问日志
+            pass
+
+    return StagingRequestHandler
+
+
+class LocalHTTPBackend(StagingBackend):
+    """
+    内置HTTP文件服务后端
+    文件保存在本地目录，通过带HMAC签名和过期时间的URL对外提供
+    """
+
+    name = "local"
+
+    def __init__(self, root_dir=None, public_url=None, host=None, port=None, secret=None):
+        self.root_dir = root_dir or os.environ.get(
+            "KLING_STAGING_DIR", os.path.join(tempfile.gettempdir(), "jm_kling_staging"))
+        self.host = host or os.environ.get("KLING_STAGING_HOST", DEFAULT_HOST)
+        self.port = int(port if port is not None else os.environ.get("KLING_STAGING_PORT", "8190"))
+        self.public_url = (public_url or os.environ.get("KLING_STAGING_PUBLIC_URL", "")).rstrip("/")
+        secret = secret or os.environ.get("KLING_STAGING_SECRET") or secrets.token_hex(32)
+        self.secret = secret.encode("utf-8")
+        self.server = None
+        self.server_lock = threading.Lock()
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def path_for(self, key):
+        # key只包含哈希和扩展名，防止路径穿越
+        return os.path.join(self.root_dir, STAGED_PREFIX + os.path.basename(key))
+
+    def sign(self, key, expires):
+        message = f"{key}:{expires}".encode("utf-8")
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def verify(self, key, expires, signature):
+        try:
+            if int(expires) < time.time():
+                return False
+        except (TypeError, ValueError):
+            return False
+        return hmac.compare_digest(self.sign(key, expires), signature)
+
+    def ensure_server(self):
+        """首次使用时在后台线程启动文件服务"""
+        with self.server_lock:
+            if self.server is not None:
+                return
+            if self.host not in LOOPBACK_HOSTS and os.environ.get("KLING_STAGING_ALLOW_PUBLIC_BIND") != "1":
+                raise ValueError(f"媒体中转文件服务不允许监听非本机地址 {self.host}，"
+                                 f"如确需对外监听请设置KLING_STAGING_ALLOW_PUBLIC_BIND=1")
+            from http.server import ThreadingHTTPServer
+
+            self.server = ThreadingHTTPServer((self.host, self.port), _make_request_handler(self))
+            self.server.daemon_threads = True
+            # 端口为0时使用系统分配的端口
+            self.port = self.server.server_address[1]
+            thread = threading.Thread(target=self.server.serve_forever, name="kling-staging-http", daemon=True)
+            thread.start()
+            logger.info(f"媒体中转文件服务已启动: {self.host}:{self.port}，目录: {self.root_dir}")
+
+    def exists(self, key):
+        return os.path.isfile(self.path_for(key))
+
+    def touch(self, key):
+        try:
+            os.utime(self.path_for(key))
+        except OSError:
+            pass
+
+    def cleanup(self, max_age):
+        # 文件修改时间即最后发布时间；写了一半的.part文件同样按时间清理
+        removed = 0
+        try:
+            names = os.listdir(self.root_dir)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if not name.startswith(STAGED_PREFIX):
+                continue
+            path = os.path.join(self.root_dir, name)
+            try:
+                if time.time() - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def put_file(self, key, path, content_type):
+        target = self.path_for(key)
+        # 先写临时文件再重命名，避免服务读到不完整的文件
+        temp_target = f"{target}.{threading.get_ident()}.part"
+        with open(path, 'rb') as src, open(temp_target, 'wb') as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                dst.write(chunk)
+        os.replace(temp_target, target)
+
+    def signed_url(self, key, ttl):
+        # 先检查配置，配置不完整时不启动文件服务
+        if not self.public_url:
+            raise ValueError("未设置KLING_STAGING_PUBLIC_URL，可灵服务器无法访问本地文件服务")
+        self.ensure_server()
+        expires = int(time.time()) + int(ttl)
+        signature = self.sign(key, expires)
+        return f"{self.public_url}/media/{quote(key)}?expires={expires}&sig={signature}"
+
+
+class S3Backend(StagingBackend):
+    """
+    S3兼容存储后端（AWS S3、MinIO、R2、OSS等）
+    需要安装boto3，生成预签名的GET URL
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket=None, endpoint_url=None, prefix=None, region=None):
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError("使用S3中转后端需要安装boto3: pip install boto3")
+
+        self.bucket = bucket or os.environ.get("KLING_S3_BUCKET", "")
+        if not self.bucket:
+            raise ValueError("使用S3中转后端需要设置KLING_S3_BUCKET")
+        self.prefix = (prefix if prefix is not None else os.environ.get("KLING_S3_PREFIX", "kling-staging/")).lstrip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or os.environ.get("KLING_S3_ENDPOINT_URL") or None,
+            region_name=region or os.environ.get("KLING_S3_REGION") or None,
+        )
+
+    def object_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except Exception:
+            return False
+
+    def put_file(self, key, path, content_type):
+        self.client.upload_file(path, self.bucket, self.object_key(key),
+                                ExtraArgs={"ContentType": content_type})
+
+    def signed_url(self, key, ttl):
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key)},
+            ExpiresIn=int(ttl),
+        )
+
+
+class MediaStager:
+    """
+    媒体中转：将本地文件、字节或图像发布到中转后端，返回带有效期的签名URL
+    按内容SHA-256去重，相同内容只上传一次
+    """
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = int(ttl or os.environ.get("KLING_STAGING_TTL", DEFAULT_TTL))
+        # key -> 最后发布时间；超过有效期的条目重新检查后端，后端的文件可能已被清理
+        self.uploaded = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.last_cleanup = 0.0
+
+    def _key_lock(self, key):
+        with self.lock:
+            if key not in self.key_locks:
+                self.key_locks[key] = threading.Lock()
+            return self.key_locks[key]
+
+    def _uploaded(self, key, now):
+        published_at = self.uploaded.get(key)
+        return published_at is not None and now - published_at < self.ttl
+
+    def _published(self, key):
+        """记录一次发布并生成签名URL；到清理间隔时在后台清理过期内容"""
+        now = time.time()
+        self.backend.touch(key)
+        with self.lock:
+            self.uploaded[key] = now
+            start_cleanup = now - self.last_cleanup > CLEANUP_INTERVAL
+            if start_cleanup:
+                self.last_cleanup = now
+        if start_cleanup:
+            threading.Thread(target=self.cleanup, name="kling-staging-cleanup", daemon=True).start()
+        return self.backend.signed_url(key, self.ttl)
+
+    def cleanup(self):
+        """清理过期的发布记录和中转文件"""
+        now = time.time()
+        with self.lock:
+            for key, published_at in list(self.uploaded.items()):
+                if now - published_at >= self.ttl:
+                    del self.uploaded[key]
+                    self.key_locks.pop(key, None)
+        try:
+            removed = self.backend.cleanup(self.ttl + CLEANUP_GRACE)
+        except Exception as e:
+            logger.warning(f"清理媒体中转文件失败: {e}")
+            return
+        if removed:
+            logger.info(f"已清理 {removed} 个过期的媒体中转文件")
+
+    def publish_file(self, path, digest=None):
+        """发布本地文件，返回签名URL"""
+        if not os.path.isfile(path):
+            raise ValueError(f"文件不存在: {path}")
+
+        digest = digest or sha256_file(path)
+        ext = os.path.splitext(path)[1].lower()
+        key = f"{digest}{ext}"
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+        # 同一内容并发发布时只上传一次
+        with self._key_lock(key):
+            if not self._uploaded(key, time.time()) and not self.backend.exists(key):
+                with profiler.phase("upload"):
+                    self.backend.put_file(key, path, content_type)
+                logger.info(f"已上传到{self.backend.name}中转: {os.path.basename(path)} -> {key}")
+            return self._published(key)
+
+    def publish_bytes(self, data, suffix):
+        """发布内存中的字节数据，suffix为扩展名（如.jpg）"""
+        digest = hashlib.sha256(data).hexdigest()
+        key = f"{digest}{suffix}"
+        with self._key_lock(key):
+            if not self._uploaded(key, time.time()) and not self.backend.exists(key):
+                fd, temp_path = tempfile.mkstemp(suffix=suffix)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                    with profiler.phase("upload"):
+                        self.backend.put_file(key, temp_path, mimetypes.guess_type(key)[0] or "application/octet-stream")
+                finally:
+                    os.remove(temp_path)
+            return self._published(key)
+
+    def publish_image(self, pil_image, format="JPEG"):
+        """发布PIL图像，返回签名URL"""
+        if pil_image.mode != "RGB" and format == "JPEG":
+            pil_image = pil_image.convert("RGB")
+        buffered = io.BytesIO()
+        with profiler.phase("encode"):
+            pil_image.save(buffered, format=format, quality=95)
+        suffix = ".jpg" if format == "JPEG" else f".{format.lower()}"
+        return self.publish_bytes(buffered.getvalue(), suffix)
+
+    def publish_many(self, paths, max_workers=4):
+        """并行发布多个文件，按输入顺序返回URL列表"""
+        if not paths:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(paths)))) as executor:
+            return list(executor.map(profiler.bind(self.publish_file), paths))
+
+
+_stager = None
+_stager_lock = threading.Lock()
+
+
+def get_stager():
+    """获取全局媒体中转实例，按环境变量选择后端"""
+    global _stager
+    with _stager_lock:
+        if _stager is None:
+            backend_name = os.environ.get("KLING_STAGING_BACKEND", "local").lower()
+            if backend_name == "s3":
+                backend = S3Backend()
+            elif backend_name == "local":
+                backend = LocalHTTPBackend()
+            else:
+                raise ValueError(f"不支持的媒体中转后端: {backend_name}")
+            _stager = MediaStager(backend)
+        return _stager
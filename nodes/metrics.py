@@ -0,0 +1,251 @@
+import time
+import bisect
+import threading
+import contextlib
+
+
+# 默认的耗时分桶（秒），覆盖API请求到长时间渲染任务
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TASK_DURATION_BUCKETS = (10, 30, 60, 120, 180, 300, 600, 900, 1800, 3600)
+THROUGHPUT_BUCKETS = (1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return [{"labels": dict(zip(self.labelnames, key)), "value": value}
+                    for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    """可增可减的当前值"""
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """分桶直方图，记录分布、总和和次数"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """with块计时，结束时记录耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, state in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {state['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            result = []
+            for key, state in sorted(self.values.items()):
+                count = state["count"]
+                result.append({
+                    "labels": dict(zip(self.labelnames, key)),
+                    "count": count,
+                    "sum": state["sum"],
+                    "avg": state["sum"] / count if count else 0.0,
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], state["counts"])),
+                })
+            return result
+
+
+class Registry:
+    """指标注册表，提供Prometheus文本格式和进程内快照两种输出"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                return self.metrics[metric.name]
+            self.metrics[metric.name] = metric
+            return metric
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: {"type": metric.type_name, "help": metric.documentation,
+                              "samples": metric.snapshot()} for metric in metrics}
+
+
+REGISTRY = Registry()
+
+# API请求
+API_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "kling_api_request_duration_seconds", "KLing API请求耗时", ("endpoint", "method", "status")))
+API_RATE_LIMITED = REGISTRY.register(Counter(
+    "kling_api_rate_limited_total", "KLing API返回429的次数", ("endpoint",)))
+API_RETRIES = REGISTRY.register(Counter(
+    "kling_api_retries_total", "KLing API请求重试次数", ("endpoint", "reason")))
+
+# 任务
+TASKS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "kling_tasks_in_flight", "已提交但尚未完成的任务数", ("task_type",)))
+TASK_DURATION = REGISTRY.register(Histogram(
+    "kling_task_duration_seconds", "任务从提交到完成的耗时", ("task_type", "model", "mode", "status"),
+    buckets=TASK_DURATION_BUCKETS))
+
+# 下载
+DOWNLOAD_BYTES = REGISTRY.register(Counter(
+    "kling_download_bytes_total", "下载的字节数", ("kind",)))
+DOWNLOAD_DURATION = REGISTRY.register(Histogram(
+    "kling_download_duration_seconds", "单个文件下载耗时", ("kind",)))
+DOWNLOAD_THROUGHPUT = REGISTRY.register(Histogram(
+    "kling_download_throughput_bytes_per_second", "单个文件下载吞吐", ("kind",), buckets=THROUGHPUT_BUCKETS))
+
+# ffmpeg
+FFMPEG_DURATION = REGISTRY.register(Histogram(
+    "kling_ffmpeg_duration_seconds", "口型同步视频合并中ffmpeg各步骤耗时", ("step",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)))
+
+
+# 已提交任务的开始时间，用于计算提交到完成的耗时
+_tasks_lock = threading.Lock()
+_tasks = {}
+
+
+def task_submitted(task_id, task_type, model="", mode=""):
+    """记录任务提交，in-flight加一"""
+    if not task_id:
+        return
+    with _tasks_lock:
+        if task_id in _tasks:
+            return
+        _tasks[task_id] = (time.time(), task_type, model or "", mode or "")
+    TASKS_IN_FLIGHT.inc(task_type=task_type)
+
+
+def task_finished(task_id, status):
+    """记录任务结束（succeed/failed），只统计本进程提交的任务"""
+    with _tasks_lock:
+        info = _tasks.pop(task_id, None)
+    if info is None:
+        return
+    submitted_at, task_type, model, mode = info
+    TASKS_IN_FLIGHT.dec(task_type=task_type)
+    TASK_DURATION.observe(time.time() - submitted_at, task_type=task_type, model=model, mode=mode, status=status)
+
+
+def mean_task_duration(task_type):
+    """本进程中成功完成的同类任务的平均耗时（秒），没有记录时返回None"""
+    total, count = 0.0, 0
+    with TASK_DURATION.lock:
+        for key, state in TASK_DURATION.values.items():
+            labels = dict(zip(TASK_DURATION.labelnames, key))
+            if labels["status"] == "succeed" and (not task_type or labels["task_type"] == task_type):
+                total += state["sum"]
+                count += state["count"]
+    return total / count if count else None
+
+
+def record_download(kind, num_bytes, seconds):
+    DOWNLOAD_BYTES.inc(num_bytes, kind=kind)
+    DOWNLOAD_DURATION.observe(seconds, kind=kind)
+    if seconds > 0:
+        DOWNLOAD_THROUGHPUT.observe(num_bytes / seconds, kind=kind)
+
+
+def render_prometheus():
+    """Prometheus文本格式输出"""
+    return REGISTRY.render_prometheus()
+
+
+def snapshot():
+    """进程内快照，返回可JSON序列化的dict"""
+    return REGISTRY.snapshot()
@@ -1,16 +1,26 @@
 import os
-import json
+import re
+import logging
 import time
 import random
-import requests
-import folder_paths
 import io
 from io import BytesIO
 import base64
-import numpy as np
-from PIL import Image
-import torch
 
+from . import api_client, cancellation, metrics, preflight, profiler, progress
+from .lazy_import import lazy_module
+from .admission import get_admission, post_task
+from .log import get_logger, LazyJSON
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+folder_paths = lazy_module("folder_paths")
+np = lazy_module("numpy")
+Image = lazy_module("PIL.Image")
+torch = lazy_module("torch")
+
+logger = get_logger("multi_image2image")
+_INVALID_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
 
 
 class KLingAIMultiImage2Image:
@@ -22,9 +32,8 @@ class KLingAIMultiImage2Image:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         self.endpoint = "/v1/images/multi-image2image"
-        self.query_endpoint = "/v1/images/multi-image2image/{}"
         
     @classmethod
     def INPUT_TYPES(s):
@@ -82,15 +91,16 @@ class KLingAIMultiImage2Image:
                     "default": "",
                     "placeholder": "回调URL（可选）"
                 }),
+                "wait_for_result": ("BOOLEAN", {"default": True}),
             }
         }
     
-    RETURN_TYPES = ("IMAGE", "STRING", "STRING", "STRING")
-    RETURN_NAMES = ("image", "image_url", "task_id", "output_dir")
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING", "STRING", TASK_HANDLE_TYPE, "STRING")
+    RETURN_NAMES = ("image", "image_url", "task_id", "output_dir", "task", "timings")
     FUNCTION = "create_multi_image2image_task"
     CATEGORY = "JM-KLingAI-API"
     OUTPUT_NODE = True
-    OUTPUT_IS_LIST = (True, True, False, False)
+    OUTPUT_IS_LIST = (True, True, False, False, False, False)
 
     @classmethod
     def IS_CHANGED(cls, **kwargs):
@@ -110,6 +120,7 @@ class KLingAIMultiImage2Image:
         img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
         return img
     
+    @profiler.timed("encode")
     def image_to_base64(self, image):
         """将ComfyUI图像转换为base64字符串（与image_generation.py保持一致）"""
         if image is None:
@@ -132,7 +143,7 @@ class KLingAIMultiImage2Image:
             return base64.b64encode(buffered.getvalue()).decode("utf-8")
             
         except Exception as e:
-            print(f"图像转换base64错误: {str(e)}")
+            logger.error(f"图像转换base64错误: {str(e)}")
             return None
 
     def download_and_convert_image(self, image_url, filename_prefix, output_dir, index=0):
@@ -149,12 +160,7 @@ class KLingAIMultiImage2Image:
             filepath = os.path.join(save_dir, filename)
             
             # 下载图片
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            
-            # 保存图片
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
+            api_client.download_to_file(image_url, filepath, "image", timeout=30)
             
             # 转换为ComfyUI张量
             pil_image = Image.open(filepath)
@@ -167,22 +173,30 @@ class KLingAIMultiImage2Image:
             # 转换为torch张量并添加批次维度
             image_tensor = torch.from_numpy(image_array)[None,]
             
-            print(f"成功下载并转换图片: {filepath}")
+            logger.info(f"成功下载并转换图片: {filepath}")
             return image_tensor, filepath
             
         except Exception as e:
-            print(f"下载图片失败: {str(e)}")
+            logger.error(f"下载图片失败: {str(e)}")
             return None, None
 
+    @profiler.profiled("multi_image2image")
+    @cancellation.interruptible("multi_image2image")
+    @progress.reporting("multi_image2image")
     def create_multi_image2image_task(self, api_token, prompt="", subject_image1=None, subject_image2=None, 
                                      subject_image3=None, subject_image4=None, scene_image=None, style_image=None,
                                      filename_prefix="kling_multi_image2image", output_dir="", model_name="kling-v2",
-                                     n=1, aspect_ratio="16:9", seed=-1, external_task_id="", callback_url=""):
+                                     n=1, aspect_ratio="16:9", seed=-1, external_task_id="", callback_url="",
+                                     wait_for_result=True):
         try:
             # 验证API token
             if not api_token or not api_token.strip():
                 raise ValueError("API Token不能为空，请在节点中输入")
-            
+
+            # 编码前校验提示词和主体图片尺寸
+            preflight.check(self.endpoint, model_name, prompt=prompt,
+                            images=[subject_image1, subject_image2, subject_image3, subject_image4])
+
             # 生成随机种子（本地使用，不发送给API）
             if seed == -1:
                 seed = random.randint(0, 0xffffffffffffffff)
@@ -222,7 +236,7 @@ class KLingAIMultiImage2Image:
             if len(subject_image_list) > 4:
                 raise ValueError("最多只能提供4张主体图片")
             
-            print(f"提供的主体图片数量: {len(subject_image_list)}")
+            logger.info(f"提供的主体图片数量: {len(subject_image_list)}")
             
             # 准备请求头
             headers = {
@@ -247,14 +261,14 @@ class KLingAIMultiImage2Image:
                 scene_base64 = self.image_to_base64(scene_image)
                 if scene_base64:
                     payload["scene_image"] = scene_base64  # 使用正确的scene_image参数名
-                    print("添加了场景参考图")
+                    logger.info("添加了场景参考图")
             
             # 处理风格参考图
             if style_image is not None:
                 style_base64 = self.image_to_base64(style_image)
                 if style_base64:
                     payload["style_image"] = style_base64
-                    print("添加了风格参考图")
+                    logger.info("添加了风格参考图")
             
             if external_task_id:
                 payload["external_task_id"] = external_task_id
@@ -263,73 +277,64 @@ class KLingAIMultiImage2Image:
             
             # 发送请求
             url = f"{self.api_base}{self.endpoint}"
-            print(f"正在发送请求到: {url}")
-            print(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
-            
-            # 调试：打印请求的详细信息（隐藏base64数据）
-            import copy
-            debug_payload = copy.deepcopy(payload)  # 使用深拷贝
-            for i, img_item in enumerate(debug_payload.get("subject_image_list", [])):
-                if "subject_image" in img_item:
-                    debug_payload["subject_image_list"][i]["subject_image"] = f"[BASE64_IMAGE_{i+1}]"
-            if "scene_image" in debug_payload:
-                debug_payload["scene_image"] = "[BASE64_SCENE_IMAGE]"
-            if "style_image" in debug_payload:
-                debug_payload["style_image"] = "[BASE64_STYLE_IMAGE]"
-            
-            print(f"请求参数 (隐藏base64): {json.dumps(debug_payload, indent=2, ensure_ascii=False)}")
-            
-            # 调试：检查Base64字符串是否有问题（使用原始payload）
-            print("=== Base64验证 ===")
-            for i, img_item in enumerate(payload.get("subject_image_list", [])):
-                base64_str = img_item.get("subject_image", "")
-                if base64_str:
-                    print(f"主体图片{i+1} Base64长度: {len(base64_str)}")
-                    print(f"主体图片{i+1} Base64开头: {base64_str[:50]}")
-                    print(f"主体图片{i+1} Base64结尾: ...{base64_str[-50:]}")
-                    # 检查是否包含无效字符
-                    import re
-                    invalid_chars = re.findall(r'[^A-Za-z0-9+/=]', base64_str)
-                    if invalid_chars:
-                        print(f"主体图片{i+1} Base64包含无效字符: {set(invalid_chars)}")
-                    else:
-                        print(f"主体图片{i+1} Base64格式验证通过")
-            
-            if "scene_image" in payload:
-                scene_base64 = payload["scene_image"]
-                print(f"场景图片 Base64长度: {len(scene_base64)}")
-                print(f"场景图片 Base64开头: {scene_base64[:50]}")
-                print(f"场景图片 Base64结尾: ...{scene_base64[-50:]}")
-                invalid_chars = re.findall(r'[^A-Za-z0-9+/=]', scene_base64)
-                if invalid_chars:
-                    print(f"场景图片 Base64包含无效字符: {set(invalid_chars)}")
-                else:
-                    print(f"场景图片 Base64格式验证通过")
+            logger.info(f"正在发送请求到: {url}")
+            logger.info(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
+            
+            # 调试：打印请求的详细信息（隐藏base64数据），只在DEBUG级别生成
+            if logger.isEnabledFor(logging.DEBUG):
+                debug_payload = dict(payload)
+                debug_payload["subject_image_list"] = [
+                    {"subject_image": f"[BASE64_IMAGE_{i+1}]"} for i in range(len(payload.get("subject_image_list", [])))
+                ]
+                if "scene_image" in debug_payload:
+                    debug_payload["scene_image"] = "[BASE64_SCENE_IMAGE]"
+                if "style_image" in debug_payload:
+                    debug_payload["style_image"] = "[BASE64_STYLE_IMAGE]"
+                logger.debug("请求参数 (隐藏base64): %s", LazyJSON(debug_payload))
+
+                # 检查Base64字符串是否有问题（使用原始payload）
+                base64_items = [(f"主体图片{i+1}", item.get("subject_image", ""))
+                                for i, item in enumerate(payload.get("subject_image_list", []))]
+                if "scene_image" in payload:
+                    base64_items.append(("场景图片", payload["scene_image"]))
+                for label, base64_str in base64_items:
+                    invalid_match = _INVALID_BASE64.search(base64_str)
+                    logger.debug("%s Base64长度: %s, 格式%s", label, len(base64_str),
+                                 f"包含无效字符: {invalid_match.group()!r}" if invalid_match else "验证通过")
             
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
+            response = post_task(url, headers=headers, json=payload, timeout=60)
             
-            print(f"响应状态码: {response.status_code}")
+            logger.info(f"响应状态码: {response.status_code}")
             
             if response.status_code == 200:
                 result = response.json()
-                print(f"响应数据: {json.dumps(result, indent=2, ensure_ascii=False)}")
+                logger.debug("响应数据: %s", LazyJSON(result))
                 
                 if result.get("code") == 0 and "data" in result:
                     task_id = result["data"]["task_id"]
-                    print(f"成功创建多图参考生图任务，任务ID: {task_id} (本地种子: {seed})")
-                    
-                    # 等待并查询任务结果
-                    return self.wait_and_get_result(api_token, task_id, filename_prefix, output_dir)
+                    metrics.task_submitted(task_id, "multi_image2image", model_name)
+                    profiler.annotate(task_id=task_id)
+                    task = track_task(task_id, self.endpoint, api_token, "multi_image2image", model_name)
+                    get_admission().attach(task)
+                    logger.info(f"成功创建多图参考生图任务，任务ID: {task_id} (本地种子: {seed})")
+
+                    if not wait_for_result:
+                        # 立即返回任务句柄，由KLingAI Await Task节点等待结果
+                        empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
+                        return ([empty_tensor], [""], task_id, output_dir or folder_paths.get_output_directory(), task)
+
+                    # 等待并获取任务结果
+                    return self.wait_and_get_result(task, filename_prefix, output_dir)
                 else:
                     error_msg = f"创建多图参考生图任务失败: {result.get('message', '未知错误')}"
-                    print(error_msg)
+                    logger.error(error_msg)
                     # 返回空的张量和URL，而不是空列表
                     empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
-                    return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory())
+                    return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory(), TaskHandle.failed(error_msg))
             else:
                 try:
                     error_data = response.json()
-                    print(f"API错误详情: {json.dumps(error_data, indent=2, ensure_ascii=False)}")
+                    logger.debug("API错误详情: %s", LazyJSON(error_data))
                     
                     # 提供更详细的错误信息
                     if error_data.get('message') == 'The input parameters are not correct':
@@ -339,119 +344,67 @@ class KLingAIMultiImage2Image:
                 except:
                     error_msg = f"API请求失败，状态码: {response.status_code}, 响应内容: {response.text[:500]}"
                 
-                print(f"创建多图参考生图任务错误: {error_msg}")
+                logger.error(f"创建多图参考生图任务错误: {error_msg}")
                 # 返回空的张量和URL，而不是空列表
                 empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
-                return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory())
+                return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory(), TaskHandle.failed(error_msg))
                 
         except Exception as e:
             error_msg = f"创建多图参考生图任务异常: {str(e)}"
-            print(error_msg)
+            logger.error(error_msg)
             # 返回空的张量和URL，而不是空列表
             empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
-            return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory())
+            return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory(), TaskHandle.failed(error_msg))
 
-    def wait_and_get_result(self, api_token, task_id, filename_prefix, output_dir, max_wait_time=600, poll_interval=10):
-        """等待任务完成并获取结果"""
-        start_time = time.time()
-        
-        print(f"[DEBUG] ======== 开始查询任务状态 ========")
-        print(f"任务ID: {task_id}")
-        print(f"最大等待时间: {max_wait_time}秒")
-        print(f"查询间隔: {poll_interval}秒")
-        
-        while time.time() - start_time < max_wait_time:
-            try:
-                # 查询任务状态
-                query_url = f"{self.api_base}{self.query_endpoint.format(task_id)}"
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {api_token.strip()}"
-                }
-                
-                print(f"查询任务状态: {query_url}")
-                response = requests.get(query_url, headers=headers, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    if result.get("code") == 0 and "data" in result:
-                        data = result["data"]
-                        task_status = data.get("task_status")
-                        
-                        print(f"当前任务状态: {task_status}")
-                        
-                        if task_status == "succeed":
-                            # 任务成功，下载图片
-                            task_result = data.get("task_result", {})
-                            images = task_result.get("images", [])
-                            
-                            if images:
-                                print(f"任务成功完成，共生成 {len(images)} 张图片")
-                                
-                                # 下载所有图片
-                                downloaded_images = []
-                                image_urls = []
-                                
-                                for image_info in images:
-                                    image_url = image_info.get("url")
-                                    index = image_info.get("index", 0)
-                                    
-                                    if image_url:
-                                        image_tensor, filepath = self.download_and_convert_image(
-                                            image_url, filename_prefix, output_dir, index
-                                        )
-                                        
-                                        if image_tensor is not None:
-                                            downloaded_images.append(image_tensor)
-                                            image_urls.append(image_url)
-                                
-                                if downloaded_images:
-                                    print(f"[DEBUG] ======== 任务完成 ========")
-                                    return (downloaded_images, image_urls, task_id, output_dir or folder_paths.get_output_directory())
-                                else:
-                                    error_msg = "图片下载失败"
-                                    print(error_msg)
-                                    # 返回空的张量和URL，而不是空列表
-                                    empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
-                                    return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory())
-                            else:
-                                error_msg = "任务完成但未返回图片"
-                                print(error_msg)
-                                # 返回空的张量和URL，而不是空列表
-                                empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
-                                return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory())
-                        
-                        elif task_status == "failed":
-                            error_msg = f"任务失败: {data.get('task_status_msg', '未知原因')}"
-                            print(error_msg)
-                            # 返回空的张量和URL，而不是空列表
-                            empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
-                            return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory())
-                        
-                        elif task_status in ["submitted", "processing"]:
-                            # 任务还在处理中，继续等待
-                            print(f"任务处理中，等待 {poll_interval} 秒后再次查询...")
-                        
-                        else:
-                            print(f"未知任务状态: {task_status}")
-                    
-                    else:
-                        print(f"查询任务状态失败: {result.get('message', '未知错误')}")
-                
-                else:
-                    print(f"查询任务状态请求失败，状态码: {response.status_code}")
-                
-                # 等待一段时间后再次查询
-                time.sleep(poll_interval)
-                
-            except Exception as e:
-                print(f"查询任务状态异常: {str(e)}")
-                time.sleep(poll_interval)
-        
-        # 超时
-        error_msg = f"任务查询超时 ({max_wait_time}秒)"
-        print(error_msg)
+    def wait_and_get_result(self, task, filename_prefix, output_dir, max_wait_time=600):
+        """等待后台轮询器返回任务结果并下载图片"""
+        logger.info(f"等待任务完成，任务ID: {task.task_id}，最大等待时间: {max_wait_time}秒")
+
+        # 任务状态由后台轮询器统一查询，这里只等待完成事件
+        deadline = time.time() + max_wait_time
+        with profiler.phase("server_wait"):
+            while not task.done.is_set() and time.time() < deadline:
+                progress.report_task(task)
+                task.wait(min(1.0, max(0.0, deadline - time.time())))
+        finished = task.done.is_set()
+        if not finished:
+            error_msg = f"任务查询超时 ({max_wait_time}秒)"
+            logger.error(error_msg)
+            # 返回空的张量和URL，而不是空列表
+            empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
+            return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory(), task)
+
+        if task.status != "succeed":
+            error_msg = task.error or f"任务失败: {task.status}"
+            logger.error(error_msg)
+            empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
+            return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory(), task)
+
+        images = task.result_urls()
+        if not images:
+            error_msg = "任务完成但未返回图片"
+            logger.error(error_msg)
+            empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
+            return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory(), task)
+
+        logger.info(f"任务成功完成，共生成 {len(images)} 张图片")
+
+        # 下载所有图片
+        downloaded_images = []
+        image_urls = []
+        for image_url, index in images:
+            image_tensor, filepath = self.download_and_convert_image(
+                image_url, filename_prefix, output_dir, int(index)
+            )
+            if image_tensor is not None:
+                downloaded_images.append(image_tensor)
+                image_urls.append(image_url)
+
+        if downloaded_images:
+            return (downloaded_images, image_urls, task.task_id, output_dir or folder_paths.get_output_directory(), task)
+
+        error_msg = "图片下载失败"
+        logger.error(error_msg)
         # 返回空的张量和URL，而不是空列表
         empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
-        return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory())
+        return ([empty_tensor], [""], error_msg, output_dir or folder_paths.get_output_directory(), task)
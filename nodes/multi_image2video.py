@@ -1,13 +1,21 @@
-import json
 import random
-import requests
 import base64
 import io
-import torch
-import numpy as np
-from PIL import Image
 import time
 
+from . import api_client, cancellation, metrics, preflight, profiler
+from .lazy_import import lazy_module
+from .admission import get_admission, post_task
+from .log import get_logger, LazyJSON
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+torch = lazy_module("torch")
+np = lazy_module("numpy")
+Image = lazy_module("PIL.Image")
+
+logger = get_logger("multi_image2video")
+
 
 class KLingAIMultiImage2Video:
     """
@@ -16,7 +24,7 @@ class KLingAIMultiImage2Video:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         self.endpoint = "/v1/videos/multi-image2video"
         
     @classmethod
@@ -62,8 +70,8 @@ class KLingAIMultiImage2Video:
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT")
-    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed")
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT", TASK_HANDLE_TYPE, "STRING")
+    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed", "task", "timings")
     FUNCTION = "create_multi_image2video_task"
     CATEGORY = "JM-KLingAI-API/multi-image-2-video"
 
@@ -81,6 +89,7 @@ class KLingAIMultiImage2Video:
         img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
         return img
 
+    @profiler.timed("encode")
     def image_to_base64(self, image):
         """将ComfyUI图像转换为base64字符串"""
         if image is None:
@@ -108,7 +117,7 @@ class KLingAIMultiImage2Video:
                         img = Image.fromarray((image[0] * 255).astype('uint8'), 'RGB')
                         pil_image = img
                     except:
-                        print(f"无法处理的图像格式: {type(image)}")
+                        logger.warning(f"无法处理的图像格式: {type(image)}")
                         return None
                 
             # 转换图像为RGB确保格式正确
@@ -123,7 +132,7 @@ class KLingAIMultiImage2Video:
                 new_width = int(width * ratio)
                 new_height = int(height * ratio)
                 pil_image = pil_image.resize((new_width, new_height), Image.LANCZOS)
-                print(f"图像已调整尺寸: {width}x{height} -> {new_width}x{new_height}")
+                logger.info(f"图像已调整尺寸: {width}x{height} -> {new_width}x{new_height}")
                 
             # 检查宽高比是否在1:2.5~2.5:1范围内
             aspect = width / height
@@ -133,12 +142,12 @@ class KLingAIMultiImage2Video:
                     new_height = int(width / 0.4)
                     top = (height - new_height) // 2
                     pil_image = pil_image.crop((0, top, width, top + new_height))
-                    print(f"图像已裁剪到宽高比0.4:1")
+                    logger.info(f"图像已裁剪到宽高比0.4:1")
                 else:  # 太宽
                     new_width = int(height * 2.5)
                     left = (width - new_width) // 2
                     pil_image = pil_image.crop((left, 0, left + new_width, height))
-                    print(f"图像已裁剪到宽高比2.5:1")
+                    logger.info(f"图像已裁剪到宽高比2.5:1")
                     
             # 转换为base64
             buffered = io.BytesIO()
@@ -164,19 +173,21 @@ class KLingAIMultiImage2Video:
                         break
                     quality -= 5
                 
-                print(f"图像已压缩: {quality}%质量, 大小: {img_size_mb:.2f}MB")
+                logger.info(f"图像已压缩: {quality}%质量, 大小: {img_size_mb:.2f}MB")
                 img_bytes = buffered.getvalue()
             
             # 返回base64编码
             base64_str = base64.b64encode(img_bytes).decode("utf-8")
-            print(f"成功转换图像为base64, 大小: {len(base64_str) / 1024:.2f}KB")
+            logger.info(f"成功转换图像为base64, 大小: {len(base64_str) / 1024:.2f}KB")
             
             return base64_str
             
         except Exception as e:
-            print(f"图像转换base64错误: {str(e)}")
+            logger.error(f"图像转换base64错误: {str(e)}")
             return None
 
+    @profiler.profiled("multi_image2video")
+    @cancellation.interruptible("multi_image2video")
     def create_multi_image2video_task(self, api_token, prompt, image1, 
                                     image2=None, image3=None, image4=None,
                                     model_name="kling-v1-6", negative_prompt="", 
@@ -189,12 +200,9 @@ class KLingAIMultiImage2Video:
             # 验证必要参数
             if not api_token:
                 raise ValueError("API令牌不能为空")
-            if not prompt:
-                raise ValueError("正向提示词不能为空")
-            if len(prompt) > 2500:
-                raise ValueError("正向提示词不能超过2500字符")
-            if negative_prompt and len(negative_prompt) > 2500:
-                raise ValueError("负向提示词不能超过2500字符")
+            # 图片尺寸和宽高比在image_to_base64中自动修正，这里不做图片校验
+            preflight.check(self.endpoint, model_name, prompt=prompt, negative_prompt=negative_prompt,
+                            duration=duration)
             if image1 is None:
                 raise ValueError("至少需要提供一张图片")
             
@@ -259,16 +267,16 @@ class KLingAIMultiImage2Video:
 
             # 发送API请求
             url = f"{self.api_base}{self.endpoint}"
-            print(f"正在发送请求到: {url}")
-            print(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
-            print(f"提供的图片数量: {len(image_list)}")
-            print(f"请求体大小: {len(str(payload))} 字符")
+            logger.info(f"正在发送请求到: {url}")
+            logger.info(f"使用本地种子: {seed} (仅用于本地，未发送给API)")
+            logger.info(f"提供的图片数量: {len(image_list)}")
+            logger.info(f"请求体大小: {len(str(payload))} 字符")
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = post_task(url, headers=headers, json=payload)
             response_data = response.json()
             
-            print(f"响应状态码: {response.status_code}")
-            print(f"响应数据: {json.dumps(response_data, indent=2)}")
+            logger.info(f"响应状态码: {response.status_code}")
+            logger.debug("响应数据: %s", LazyJSON(response_data))
 
             # 检查错误并提供详细错误信息
             if response.status_code != 200:
@@ -287,15 +295,19 @@ class KLingAIMultiImage2Video:
             if not task_id:
                 raise Exception("API未返回任务ID")
 
-            print(f"成功创建多图生视频任务，任务ID: {task_id} (本地种子: {seed})")
-            return (task_id, task_status, created_at, updated_at, seed)
+            metrics.task_submitted(task_id, "multi_image2video", model_name, mode)
+            profiler.annotate(task_id=task_id)
+            task = track_task(task_id, self.endpoint, api_token, "multi_image2video", model_name, mode)
+            get_admission().attach(task)
+            logger.info(f"成功创建多图生视频任务，任务ID: {task_id} (本地种子: {seed})")
+            return (task_id, task_status, created_at, updated_at, seed, task)
 
         except ValueError as ve:
-            print(f"参数验证错误: {str(ve)}")
-            return (f"错误: {str(ve)}", "failed", "", "", seed)
+            logger.error(f"参数验证错误: {str(ve)}")
+            return (f"错误: {str(ve)}", "failed", "", "", seed, TaskHandle.failed(str(ve)))
         except Exception as e:
-            print(f"创建多图生视频任务错误: {str(e)}")
-            return (f"错误: {str(e)}", "failed", "", "", seed)
+            logger.error(f"创建多图生视频任务错误: {str(e)}")
+            return (f"错误: {str(e)}", "failed", "", "", seed, TaskHandle.failed(str(e)))
 
     @classmethod
     def IS_CHANGED(cls, **kwargs):
@@ -0,0 +1,217 @@
+import os
+import functools
+
+from .lazy_import import lazy_module
+from .log import get_logger
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+Image = lazy_module("PIL.Image")
+
+logger = get_logger("preflight")
+
+
+# 提交前的本地校验：各端点的参数约束集中在这里，节点提交前调用check()
+# 违反约束的任务在本地直接失败，不再经过网络往返或产生付费的失败任务
+
+# 图片约束：短边至少300px，宽高比在1:2.5到2.5:1之间，文件不超过10MB
+IMAGE_RULES = {"min_side": 300, "aspect": (1 / 2.5, 2.5), "max_mb": 10,
+               "formats": (".jpg", ".jpeg", ".png")}
+# 口型同步的音频约束（视频以video_id或URL提交，不在本地校验）
+AUDIO_RULES = {"max_mb": 5, "formats": (".mp3", ".wav", ".m4a", ".aac", ".acc")}
+
+VIDEO_MODELS = ("kling-v1", "kling-v1-5", "kling-v1-6", "kling-v2-master", "kling-v2-1", "kling-v2-1-master")
+
+CONSTRAINTS = {
+    "/v1/videos/text2video": {
+        "models": VIDEO_MODELS,
+        "prompt": {"required": True, "max_length": 2500},
+        "negative_prompt": {"max_length": 2500},
+        "cfg_scale": (0.0, 1.0),
+        "duration": ("5", "10"),
+    },
+    "/v1/videos/image2video": {
+        "models": VIDEO_MODELS,
+        "prompt": {"max_length": 2500},
+        "negative_prompt": {"max_length": 2500},
+        "cfg_scale": (0.0, 1.0),
+        "duration": ("5", "10"),
+        "image": IMAGE_RULES,
+        "image_tail": IMAGE_RULES,
+    },
+    "/v1/videos/multi-image2video": {
+        "models": ("kling-v1-6",),
+        "prompt": {"required": True, "max_length": 2500},
+        "negative_prompt": {"max_length": 2500},
+        "duration": ("5", "10"),
+        "images": dict(IMAGE_RULES, max_count=4),
+    },
+    "/v1/images/generations": {
+        "models": ("kling-v1", "kling-v1-5", "kling-v2"),
+        "prompt": {"required": True, "max_length": 500},
+        "negative_prompt": {"max_length": 200},
+        "image": IMAGE_RULES,
+    },
+    "/v1/images/multi-image2image": {
+        "models": ("kling-v2",),
+        "prompt": {"max_length": 2500},
+        "images": dict(IMAGE_RULES, max_count=4),
+    },
+    "/v1/videos/lip-sync": {
+        "text": {"max_length": 120},
+        "audio_file": AUDIO_RULES,
+    },
+}
+
+# 字段的中文名称，用于错误信息
+FIELD_LABELS = {
+    "prompt": "正向提示词",
+    "negative_prompt": "负向提示词",
+    "text": "文本内容",
+    "image": "输入图像",
+    "image_tail": "尾帧图像",
+    "images": "图片",
+    "audio_file": "音频文件",
+}
+
+
+class PreflightError(ValueError):
+    """本地校验失败，包含全部违反的约束"""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__("；".join(self.problems))
+
+
+@functools.lru_cache(maxsize=512)
+def _probe_image(path, mtime, size):
+    # PIL.Image.open只读取文件头，不解码像素
+    with Image.open(path) as image:
+        return image.size
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return path, stat.st_mtime, stat.st_size
+
+
+def probe_image(path):
+    """读取图片文件的(宽, 高)，结果按路径、修改时间和大小缓存"""
+    return _probe_image(*_file_key(path))
+
+
+def image_size(image):
+    """返回图像的(宽, 高)：支持IMAGE张量（取第一帧）、PIL图像和本地文件路径，URL返回None"""
+    if image is None:
+        return None
+    if isinstance(image, str):
+        if image.startswith(("http://", "https://")) or not os.path.isfile(image):
+            return None
+        return probe_image(image)
+    if hasattr(image, "shape"):
+        shape = tuple(image.shape)
+        return (shape[-2], shape[-3]) if len(shape) >= 3 else None
+    if hasattr(image, "size"):
+        return tuple(image.size)
+    return None
+
+
+def check_text(label, value, rules):
+    problems = []
+    if rules.get("required") and not (value and value.strip()):
+        problems.append(f"{label}不能为空")
+    if value and len(value) > rules.get("max_length", float("inf")):
+        problems.append(f"{label}不能超过{rules['max_length']}字符（当前{len(value)}字符）")
+    return problems
+
+
+def _ratio(value):
+    """宽高比的显示形式：0.4显示为1:2.5，2.5显示为2.5:1"""
+    return f"1:{1 / value:g}" if value < 1 else f"{value:g}:1"
+
+
+def check_image(label, image, rules):
+    size = image_size(image)
+    if size is None:
+        return []
+    width, height = size
+    problems = []
+    if min(width, height) < rules["min_side"]:
+        problems.append(f"{label}尺寸{width}x{height}过小，宽高至少{rules['min_side']}px")
+    low, high = rules["aspect"]
+    if not low <= width / height <= high:
+        problems.append(f"{label}宽高比{width / height:.2f}超出范围（{_ratio(low)} ~ {_ratio(high)}）")
+    if isinstance(image, str):
+        problems.extend(check_file(label, image, rules))
+    return problems
+
+
+def check_file(label, path, rules):
+    """本地文件的格式和大小校验，URL不做检查"""
+    if not path or path.startswith(("http://", "https://")):
+        return []
+    if not os.path.isfile(path):
+        return [f"{label}不存在: {path}"]
+    problems = []
+    ext = os.path.splitext(path)[1].lower()
+    if "formats" in rules and ext not in rules["formats"]:
+        problems.append(f"{label}格式{ext}不支持，仅支持{'/'.join(f[1:] for f in rules['formats'])}")
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    if size_mb > rules.get("max_mb", float("inf")):
+        problems.append(f"{label}过大: {size_mb:.2f}MB，最大支持{rules['max_mb']}MB")
+    return problems
+
+
+def check_camera_control(camera_control):
+    """simple类型必须且只能有一个方向参数不为0，其他类型不带config"""
+    if not camera_control:
+        return []
+    config = camera_control.get("config") or {}
+    if camera_control.get("type") == "simple":
+        non_zero = sum(1 for value in config.values() if abs(value) > 0.001)
+        if non_zero > 1:
+            return ["摄像机参数错误: simple类型摄像机控制只能设置一个方向参数不为0"]
+        if non_zero == 0:
+            return ["摄像机参数错误: simple类型摄像机控制至少需要一个方向参数不为0"]
+    return []
+
+
+def validate(endpoint, model_name=None, **fields):
+    """按端点约束校验参数，返回违反约束的描述列表；未传入（None）的字段不检查"""
+    rules = CONSTRAINTS.get(endpoint, {})
+    problems = []
+    if model_name and "models" in rules and model_name not in rules["models"]:
+        problems.append(f"模型{model_name}不支持此接口，可选: {', '.join(rules['models'])}")
+
+    for field in ("prompt", "negative_prompt", "text"):
+        if field in rules and fields.get(field) is not None:
+            problems.extend(check_text(FIELD_LABELS[field], fields[field], rules[field]))
+
+    for field in ("image", "image_tail"):
+        if field in rules and fields.get(field) is not None:
+            problems.extend(check_image(FIELD_LABELS[field], fields[field], rules[field]))
+    if "images" in rules and fields.get("images") is not None:
+        images = [image for image in fields["images"] if image is not None]
+        if len(images) > rules["images"]["max_count"]:
+            problems.append(f"最多只能提供{rules['images']['max_count']}张图片")
+        for i, image in enumerate(images):
+            problems.extend(check_image(f"图片{i + 1}", image, rules["images"]))
+
+    if "audio_file" in rules and fields.get("audio_file"):
+        problems.extend(check_file(FIELD_LABELS["audio_file"], fields["audio_file"], rules["audio_file"]))
+
+    if "cfg_scale" in rules and fields.get("cfg_scale") is not None:
+        low, high = rules["cfg_scale"]
+        if not low <= float(fields["cfg_scale"]) <= high:
+            problems.append(f"cfg_scale必须在{low}到{high}之间")
+    if "duration" in rules and fields.get("duration") is not None and str(fields["duration"]) not in rules["duration"]:
+        problems.append(f"视频时长只支持{'/'.join(rules['duration'])}秒")
+    problems.extend(check_camera_control(fields.get("camera_control")))
+    return problems
+
+
+def check(endpoint, model_name=None, **fields):
+    """校验失败时抛出PreflightError（ValueError子类），节点按参数验证错误处理"""
+    problems = validate(endpoint, model_name, **fields)
+    if problems:
+        logger.debug("本地校验未通过: %s %s", endpoint, problems)
+        raise PreflightError(problems)
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import base64
+import atexit
+import threading
+import collections
+from io import BytesIO
+
+from .log import get_logger
+
+logger = get_logger("previews")
+
+
+# 下载节点的预览信息和缩略图
+# 预览信息（文件名、子目录、格式、大小）不再在下载路径上逐个写入 output/.previews/<文件名>.json，
+# 而是放入内存队列，由后台线程定期批量追加到 output/.previews/index.jsonl（每行一条，同一文件以最后一行为准），
+# 获取文件大小和创建目录也在后台线程中完成；进程退出时写出剩余的记录
+# 图片预览使用内存中的缩略图，不再把原图整张编码为PNG的base64
+# KLING_PREVIEW_FLUSH_SECONDS: 批量写入的间隔
+# KLING_PREVIEW_THUMBNAIL_SIZE: 缩略图最长边的像素数
+# KLING_PREVIEW_CACHE_SIZE: 内存中保留的缩略图数量
+DEFAULT_FLUSH_SECONDS = 2.0
+DEFAULT_THUMBNAIL_SIZE = 256
+DEFAULT_CACHE_SIZE = 64
+# 队列中积累到这么多条时不等间隔，立即写入
+MAX_BATCH = 500
+INDEX_NAME = "index.jsonl"
+
+
+class PreviewIndex:
+    """预览信息的追加写入索引，record()只入队，由后台线程批量写入"""
+
+    def __init__(self, flush_seconds=DEFAULT_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self.pending = []
+        self.lock = threading.Lock()
+        # 保证同一时刻只有一个线程写索引文件（后台线程和退出时的flush）
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def record(self, output_dir, filepath, media_type, mime_type):
+        rel_path = os.path.relpath(filepath, start=output_dir)
+        entry = {
+            "filename": os.path.basename(filepath),
+            "type": media_type,
+            "subfolder": os.path.dirname(rel_path),
+            "format": mime_type,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with self.lock:
+            self.pending.append((output_dir, filepath, entry))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="kling-preview-index", daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+            if len(self.pending) >= MAX_BATCH:
+                self.wake.set()
+        return entry
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_seconds)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """把队列中的记录按输出目录追加到各自的索引文件"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return
+        grouped = collections.defaultdict(list)
+        for output_dir, filepath, entry in batch:
+            try:
+                entry["size"] = f"{os.path.getsize(filepath) / (1024 * 1024):.2f} MB"
+            except OSError:
+                pass
+            grouped[output_dir].append(entry)
+        with self.write_lock:
+            for output_dir, entries in grouped.items():
+                index_path = os.path.join(output_dir, ".previews", INDEX_NAME)
+                try:
+                    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+                    with open(index_path, "a", encoding="utf-8") as f:
+                        f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+                except Exception as e:
+                    logger.error(f"写入预览索引出错 (不影响下载): {e}")
+                    continue
+                logger.debug("已写入 %d 条预览信息: %s", len(entries), index_path)
+
+
+class ThumbnailCache:
+    """最近下载图片的缩略图，按文件路径缓存，超过数量时淘汰最久未使用的"""
+
+    def __init__(self, size=DEFAULT_THUMBNAIL_SIZE, max_entries=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self.max_entries = max_entries
+        # 路径 -> [缩略图, data URL（首次使用时编码）]
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, key, pil_image):
+        """生成并缓存缩略图，返回缩略图"""
+        thumbnail = pil_image.copy()
+        thumbnail.thumbnail((self.size, self.size))
+        with self.lock:
+            self.entries[key] = [thumbnail, None]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return thumbnail
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def data_url(self, key):
+        """缩略图的base64 data URL，不在缓存中时返回空字符串"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return ""
+            self.entries.move_to_end(key)
+            if entry[1] is not None:
+                return entry[1]
+            thumbnail = entry[0]
+        buffered = BytesIO()
+        thumbnail.convert("RGB").save(buffered, format="JPEG", quality=85)
+        url = f"data:image/jpeg;base64,{base64.b64encode(buffered.getvalue()).decode('utf-8')}"
+        with self.lock:
+            if self.entries.get(key) is entry:
+                entry[1] = url
+        return url
+
+
+_index = None
+_thumbnails = None
+_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _lock:
+        if _index is None:
+            _index = PreviewIndex(float(os.environ.get("KLING_PREVIEW_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS)))
+        return _index
+
+
+def get_thumbnails():
+    global _thumbnails
+    with _lock:
+        if _thumbnails is None:
+            _thumbnails = ThumbnailCache(
+                int(os.environ.get("KLING_PREVIEW_THUMBNAIL_SIZE", DEFAULT_THUMBNAIL_SIZE)),
+                int(os.environ.get("KLING_PREVIEW_CACHE_SIZE", DEFAULT_CACHE_SIZE)))
+        return _thumbnails
+
+
+def record(output_dir, filepath, media_type, mime_type):
+    """登记一条预览信息，立即返回"""
+    return get_index().record(output_dir, filepath, media_type, mime_type)
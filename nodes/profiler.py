@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import glob
+import inspect
+import datetime
+import functools
+import threading
+import contextlib
+import contextvars
+
+from .log import get_logger
+
+logger = get_logger("profiler")
+
+
+# 节点分阶段耗时
+# 节点执行时激活一个PhaseTimer，api_client、下载和ffmpeg等公共代码通过phase()/record()把耗时记到当前计时器上，
+# 节点结束后以JSON从timings输出，并追加到按天滚动的性能日志
+# KLING_PERF_LOG: 设为0关闭性能日志
+# KLING_PERF_LOG_DIR: 日志目录，默认ComfyUI的user目录下的kling_perf，无界面运行时为当前目录下的kling_perf
+# KLING_PERF_LOG_DAYS: 保留的天数
+DEFAULT_PERF_LOG_DAYS = 14
+
+# 常用阶段名称
+PHASES = ("encode", "upload", "request", "server_wait", "download", "decode", "merge")
+
+_current = contextvars.ContextVar("kling_phase_timer", default=None)
+
+
+class PhaseTimer:
+    """
+    单次节点执行的阶段计时
+    阶段可以嵌套，嵌套期间外层阶段暂停，各阶段耗时互不重叠；未归入任何阶段的时间记为other
+    工作线程（通过bind()带上计时器）中的阶段只累加耗时，并行时各阶段之和可能超过总耗时
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.started = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.phases = {}
+        self.stack = []
+        self.extra = {}
+        self.lock = threading.Lock()
+
+    def _add(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        now = time.perf_counter()
+        if threading.get_ident() != self.thread:
+            try:
+                yield
+            finally:
+                self._add(name, time.perf_counter() - now)
+            return
+        if self.stack:
+            parent, parent_start = self.stack[-1]
+            self._add(parent, now - parent_start)
+        self.stack.append((name, now))
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            _, start = self.stack.pop()
+            self._add(name, now - start)
+            if self.stack:
+                self.stack[-1] = (self.stack[-1][0], now)
+
+    def to_dict(self):
+        total = time.perf_counter() - self.started
+        phases = {name: round(seconds, 4) for name, seconds in self.phases.items()}
+        phases["other"] = round(max(0.0, total - sum(self.phases.values())), 4)
+        return dict(self.extra, node=self.node, total=round(total, 4), phases=phases,
+                    timestamp=datetime.datetime.now().isoformat(timespec="seconds"))
+
+
+def current():
+    return _current.get()
+
+
+def phase(name):
+    """在当前节点的计时器上记录一个阶段，没有激活的计时器时不做任何事"""
+    timer = _current.get()
+    return timer.phase(name) if timer is not None else contextlib.nullcontext()
+
+
+def bind(func):
+    """
+    让线程池中执行的函数在当前节点执行的上下文中运行（contextvars不会自动传给工作线程）：
+    耗时记到当前计时器上，创建的任务记为当前节点的任务（取消时写入任务日志）
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        # 每次调用使用副本，工作线程中设置的值不会互相影响
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+
+def timed(name):
+    """把整个函数的执行时间记为一个阶段"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds):
+    """直接累加一段已测得的耗时（例如在其他线程中测得的时间）"""
+    timer = _current.get()
+    if timer is not None:
+        timer._add(name, seconds)
+
+
+def annotate(**fields):
+    """给本次执行的记录附加字段，例如task_id"""
+    timer = _current.get()
+    if timer is not None:
+        timer.extra.update({key: value for key, value in fields.items() if value})
+
+
+def perf_log_dir():
+    configured = os.environ.get("KLING_PERF_LOG_DIR")
+    if configured:
+        return configured
+    # 只在ComfyUI中（folder_paths已加载）使用其user目录，无界面运行时不导入
+    folder_paths = sys.modules.get("folder_paths")
+    get_user_directory = getattr(folder_paths, "get_user_directory", None)
+    if get_user_directory is not None:
+        return os.path.join(get_user_directory(), "kling_perf")
+    return os.path.join(os.getcwd(), "kling_perf")
+
+
+_log_lock = threading.Lock()
+_pruned_for = None
+
+
+def append_perf_log(entry):
+    """追加到当天的 perf-YYYY-MM-DD.jsonl，每天第一次写入时清理过期文件"""
+    global _pruned_for
+    if os.environ.get("KLING_PERF_LOG", "1") == "0":
+        return
+    try:
+        log_dir = perf_log_dir()
+        today = datetime.date.today()
+        with _log_lock:
+            os.makedirs(log_dir, exist_ok=True)
+            with open(os.path.join(log_dir, f"perf-{today.isoformat()}.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if _pruned_for != today:
+                _pruned_for = today
+                keep_days = int(os.environ.get("KLING_PERF_LOG_DAYS", DEFAULT_PERF_LOG_DAYS))
+                cutoff = (today - datetime.timedelta(days=keep_days)).isoformat()
+                for path in glob.glob(os.path.join(log_dir, "perf-*.jsonl")):
+                    if os.path.basename(path)[5:15] < cutoff:
+                        os.remove(path)
+    except Exception as e:
+        logger.warning(f"写入性能日志失败: {e}")
+
+
+def _finish(timer):
+    entry = timer.to_dict()
+    append_perf_log(entry)
+    logger.debug("阶段耗时: %s", entry)
+    return json.dumps(entry, ensure_ascii=False)
+
+
+def profiled(node):
+    """
+    节点FUNCTION的装饰器：执行期间激活计时器，并把timings JSON追加为最后一个输出
+    使用时在RETURN_TYPES末尾加一个STRING输出
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                timer = PhaseTimer(node)
+                token = _current.set(timer)
+                try:
+                    result = await func(*args, **kwargs)
+                finally:
+                    _current.reset(token)
+                return tuple(result) + (_finish(timer),)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timer = PhaseTimer(node)
+            token = _current.set(timer)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _current.reset(token)
+            return tuple(result) + (_finish(timer),)
+        return wrapper
+    return decorator
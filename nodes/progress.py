@@ -0,0 +1,229 @@
+import os
+import re
+import sys
+import time
+import inspect
+import functools
+import threading
+import contextvars
+
+from . import metrics
+from .log import get_logger
+from .server_routes import get_prompt_server
+
+logger = get_logger("progress")
+
+
+# 节点进度上报
+# 把可灵任务状态、口型同步片段完成数和下载字节数换算成进度，更新ComfyUI节点上的进度条，
+# 并通过websocket发送jm-kling.progress事件（包含状态文字，前端扩展可以据此显示）
+# 更新在KLING_PROGRESS_INTERVAL秒内最多发送一次，被跳过的状态会在下一次更新时补发，结束时立即发送
+# KLING_PROGRESS_INTERVAL: 两次更新之间的最小间隔（秒）
+# KLING_EXPECTED_TASK_SECONDS: 没有历史耗时、接口也不返回进度时估算用的任务耗时
+DEFAULT_PROGRESS_INTERVAL = 0.5
+DEFAULT_EXPECTED_TASK_SECONDS = 180.0
+PROGRESS_EVENT = "jm-kling.progress"
+PROGRESS_STEPS = 100
+
+# 任务状态对应的进度：已提交视为刚开始，处理中按接口进度或耗时估算，最多到PROCESSING_MAX，结束为1
+SUBMITTED_FRACTION = 0.02
+PROCESSING_MIN = 0.05
+PROCESSING_MAX = 0.95
+
+_current = contextvars.ContextVar("kling_progress", default=None)
+_PERCENT = re.compile(r"(\d+(?:\.\d+)?)\s*%?")
+
+
+def _comfy_progress_bar(total):
+    # 只在ComfyUI中（已加载comfy.utils）使用其进度条，不主动导入
+    comfy_utils = sys.modules.get("comfy.utils")
+    progress_bar = getattr(comfy_utils, "ProgressBar", None)
+    if progress_bar is None:
+        return None
+    try:
+        return progress_bar(total)
+    except Exception as e:
+        logger.debug("创建ComfyUI进度条失败: %s", e)
+        return None
+
+
+class ProgressReporter:
+    """
+    单次节点执行的进度，可以在轮询线程中更新
+    需要在节点执行线程中创建：新版ComfyUI的进度条在创建时记录当前执行的节点
+    """
+
+    def __init__(self, node, total=PROGRESS_STEPS, interval=None):
+        self.node = node
+        self.total = total
+        self.interval = float(interval if interval is not None
+                              else os.environ.get("KLING_PROGRESS_INTERVAL", DEFAULT_PROGRESS_INTERVAL))
+        self.bar = _comfy_progress_bar(total)
+        server = get_prompt_server()
+        self.node_id = getattr(server, "last_node_id", None)
+        self.prompt_id = getattr(server, "last_prompt_id", None)
+        self.value = None
+        self.text = ""
+        self.sent_at = 0.0
+        self.lock = threading.Lock()
+
+    def update(self, value, total=None, text="", force=False):
+        """设置当前进度；值和文字都没变化或距离上次发送不足interval秒时跳过，返回是否已发送"""
+        total = total or self.total
+        value = max(0, min(value, total))
+        with self.lock:
+            now = time.monotonic()
+            unchanged = value == self.value and text == self.text
+            if not force and (unchanged or now - self.sent_at < self.interval):
+                return False
+            self.value, self.total, self.text, self.sent_at = value, total, text, now
+        self._send(value, total, text)
+        return True
+
+    def fraction(self, fraction, text="", force=False):
+        return self.update(round(fraction * self.total), text=text, force=force)
+
+    def _send(self, value, total, text):
+        if self.bar is not None:
+            try:
+                self.bar.update_absolute(value, total)
+            except Exception as e:
+                logger.debug("更新ComfyUI进度条失败: %s", e)
+        server = get_prompt_server()
+        if server is None:
+            return
+        try:
+            server.send_sync(PROGRESS_EVENT, {"node": self.node, "node_id": self.node_id, "prompt_id": self.prompt_id,
+                                              "value": value, "max": total, "text": text},
+                             getattr(server, "client_id", None))
+        except Exception as e:
+            logger.debug("发送进度事件失败: %s", e)
+
+
+def current():
+    return _current.get()
+
+
+def update(value, total=None, text="", force=False):
+    """更新当前节点的进度，没有激活的进度时不做任何事"""
+    reporter = _current.get()
+    if reporter is not None:
+        reporter.update(value, total, text, force)
+
+
+def fraction(value, text="", force=False):
+    reporter = _current.get()
+    if reporter is not None:
+        reporter.fraction(value, text, force)
+
+
+def bind(func):
+    """让其他线程中执行的函数更新当前节点的进度"""
+    reporter = _current.get()
+    if reporter is None:
+        return func
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        token = _current.set(reporter)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def expected_task_seconds(task_type=""):
+    """本进程中同类任务的平均耗时，没有记录时使用默认值"""
+    return metrics.mean_task_duration(task_type) or float(
+        os.environ.get("KLING_EXPECTED_TASK_SECONDS", DEFAULT_EXPECTED_TASK_SECONDS))
+
+
+def task_fraction(status, data=None, started_at=None, task_type=""):
+    """
+    把任务状态换算成0~1的进度
+    处理中的任务优先使用接口返回的process_progress，否则按已用时间和预期耗时估算
+    """
+    if status in ("succeed", "failed"):
+        return 1.0
+    if status != "processing":
+        return SUBMITTED_FRACTION
+    data = data or {}
+    match = _PERCENT.match(str(data.get("process_progress") or ""))
+    if match:
+        reported = float(match.group(1)) / 100
+    else:
+        created_at = data.get("created_at")
+        started = created_at / 1000 if created_at else started_at
+        if not started:
+            return PROCESSING_MIN
+        reported = (time.time() - started) / expected_task_seconds(task_type)
+    return min(PROCESSING_MAX, PROCESSING_MIN + (PROCESSING_MAX - PROCESSING_MIN) * max(0.0, reported))
+
+
+def handle_fraction(handle):
+    return task_fraction(handle.status, handle.data, handle.submitted_at, handle.task_type)
+
+
+def report_task(handle):
+    """按任务句柄的状态更新进度"""
+    fraction(handle_fraction(handle), text=handle.status)
+
+
+def report_tasks(handles, completed=0, total=None):
+    """
+    多个任务的整体进度：completed个已处理完，其余按各自状态计入
+    文字显示已完成数/总数
+    """
+    total = total or completed + len(handles)
+    if not total:
+        return
+    done = completed + sum(1 for handle in handles if handle.done.is_set())
+    value = completed + sum(handle_fraction(handle) for handle in handles)
+    fraction(value / total, text=f"{done}/{total}")
+
+
+def report_download(received, expected):
+    """下载进度，expected为0（没有Content-Length）时只显示已下载字节数"""
+    reporter = _current.get()
+    if reporter is None:
+        return
+    text = f"download {received / 1048576:.1f} MB"
+    if expected:
+        reporter.fraction(min(1.0, received / expected), text=text + f" / {expected / 1048576:.1f} MB")
+    else:
+        reporter.update(reporter.value or 0, text=text)
+
+
+def _finish(reporter):
+    reporter.update(reporter.total, text="done", force=True)
+
+
+def reporting(node):
+    """节点FUNCTION的装饰器：执行期间激活进度上报，正常结束时进度设为完成"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                reporter = ProgressReporter(node)
+                token = _current.set(reporter)
+                try:
+                    result = await func(*args, **kwargs)
+                finally:
+                    _current.reset(token)
+                _finish(reporter)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            reporter = ProgressReporter(node)
+            token = _current.set(reporter)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _current.reset(token)
+            _finish(reporter)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,317 @@
+"""
+无界面批量运行器
+
+读取JSONL任务清单，在共享的提交限流和并发额度下提交任务，由后台轮询器跟踪状态，
+完成后下载结果并逐行写出带耗时的结果JSONL。状态文件记录每个任务的进度，中断后重新运行
+同一命令会继续跟踪已提交的任务，不会重复提交（--retry-failed 重新提交失败的任务）。
+不依赖ComfyUI，也不会导入folder_paths。需要在插件目录下运行。
+
+用法:
+    python -m nodes.runner jobs.jsonl --output-dir out --access-key AK --secret-key SK
+    python -m nodes.runner jobs.jsonl --output-dir out --api-token TOKEN --concurrency 5
+
+清单每行一个任务:
+    {"id": "sunset-1", "type": "text2video", "prompt": "海边日落", "duration": "10"}
+    {"id": "cat-2", "type": "image2video", "image": "inputs/cat.png", "model_name": "kling-v1-6"}
+    {"id": "talk-3", "type": "lip-sync-async", "video_url": "https://...", "audio_type": "file", "audio_file": "a.mp3"}
+id和type之外的字段按接口参数原样提交；image/image_tail/audio_file等字段为本地文件时自动转为base64。
+type为lip-sync-async时调用口型同步（异步分段）节点，字段为该节点的参数。
+"""
+import os
+import json
+import time
+import base64
+import argparse
+import threading
+import concurrent.futures
+from urllib.parse import urlparse
+
+from . import api_client, metrics, preflight
+from .admission import PRIORITY_BATCH, get_admission, submit_task
+from .log import get_logger, task_context
+from .task_tracker import track_task
+
+logger = get_logger("runner")
+
+# 任务类型对应的提交端点
+JOB_ENDPOINTS = {
+    "text2video": "/v1/videos/text2video",
+    "image2video": "/v1/videos/image2video",
+    "multi-image2video": "/v1/videos/multi-image2video",
+    "lip-sync": "/v1/videos/lip-sync",
+    "image-generation": "/v1/images/generations",
+    "multi-image2image": "/v1/images/multi-image2image",
+}
+NODE_JOB_TYPES = ("lip-sync-async",)
+
+# 取值为本地文件路径时转为base64的字段
+FILE_FIELDS = ("image", "image_tail", "subject_image", "scene_image", "style_image", "audio_file")
+
+# JWT令牌提前刷新的时间（秒）
+TOKEN_REFRESH_SECONDS = 1800
+
+TERMINAL_STATUSES = ("succeed", "failed")
+
+
+def read_manifest(path):
+    """读取JSONL清单，缺少id时按行号生成"""
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line)
+            job.setdefault("id", f"job-{line_no}")
+            if job.get("type") not in JOB_ENDPOINTS and job.get("type") not in NODE_JOB_TYPES:
+                raise ValueError(f"第{line_no}行任务类型不支持: {job.get('type')}")
+            jobs.append(job)
+    ids = [job["id"] for job in jobs]
+    if len(ids) != len(set(ids)):
+        raise ValueError("清单中的任务id重复")
+    return jobs
+
+
+def inline_files(value, base_dir):
+    """递归把本地文件路径替换为base64内容，URL和其他值保持不变"""
+    if isinstance(value, dict):
+        return {key: (encode_file(item, base_dir) if key in FILE_FIELDS and isinstance(item, str)
+                      else inline_files(item, base_dir)) for key, item in value.items()}
+    if isinstance(value, list):
+        return [inline_files(item, base_dir) for item in value]
+    return value
+
+
+def encode_file(value, base_dir):
+    if urlparse(value).scheme in ("http", "https"):
+        return value
+    path = value if os.path.isabs(value) else os.path.join(base_dir, value)
+    if not os.path.isfile(path):
+        return value
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+class TokenSource:
+    """固定令牌，或用AK/SK生成JWT并在过期前刷新"""
+
+    def __init__(self, api_token="", access_key="", secret_key=""):
+        self.api_token = api_token
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.generated_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.api_token and not self.access_key:
+            return self.api_token
+        with self.lock:
+            if time.time() - self.generated_at > TOKEN_REFRESH_SECONDS:
+                from .api_key import KLingAIAPIKey
+                token = KLingAIAPIKey().generate_token(self.access_key, self.secret_key)[0]
+                if not token:
+                    raise ValueError("生成API令牌失败，请检查Access Key和Secret Key")
+                self.api_token = token
+                self.generated_at = time.time()
+            return self.api_token
+
+
+class StateFile:
+    """任务进度状态，每次变更后原子写入磁盘"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.jobs = json.load(f).get("jobs", {})
+
+    def get(self, job_id):
+        with self.lock:
+            return dict(self.jobs.get(job_id, {}))
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.jobs.setdefault(job_id, {}).update(fields)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"jobs": self.jobs}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class BatchRunner:
+    """按清单提交、跟踪、下载任务并记录结果"""
+
+    def __init__(self, tokens, output_dir, state, results_path, concurrency=5, timeout=3600,
+                 download=True, base_dir="."):
+        self.tokens = tokens
+        self.output_dir = output_dir
+        self.state = state
+        self.results_path = results_path
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.download = download
+        self.base_dir = base_dir
+        self.results_lock = threading.Lock()
+
+    def run(self, jobs, retry_failed=False):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if retry_failed:
+            for job in jobs:
+                if self.state.get(job["id"]).get("status") == "failed":
+                    self.state.update(job["id"], status="", task_id="", error="")
+        pending = [job for job in jobs if self.state.get(job["id"]).get("status") not in TERMINAL_STATUSES]
+        skipped = len(jobs) - len(pending)
+        if skipped:
+            logger.info(f"跳过 {skipped} 个已完成的任务")
+        logger.info(f"开始运行 {len(pending)} 个任务，并发数: {self.concurrency}")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            records = list(executor.map(self.run_job, pending))
+
+        summary = {"total": len(jobs), "skipped": skipped,
+                   "succeed": sum(1 for record in records if record["status"] == "succeed"),
+                   "failed": sum(1 for record in records if record["status"] != "succeed")}
+        logger.info(f"运行结束: {summary}")
+        return summary
+
+    def run_job(self, job):
+        with task_context(job["id"]):
+            started = time.time()
+            try:
+                if job["type"] in NODE_JOB_TYPES:
+                    record = self.run_node_job(job)
+                else:
+                    record = self.run_api_job(job)
+            except Exception as e:
+                logger.error(f"任务出错: {e}")
+                record = {"status": "failed", "error": str(e)}
+            record = dict(record, id=job["id"], type=job["type"], total_seconds=round(time.time() - started, 3))
+            self.state.update(job["id"], status=record["status"], error=record.get("error", ""),
+                              outputs=record.get("outputs", []))
+            self.write_result(record)
+            return record
+
+    def submit(self, job, endpoint):
+        """提交任务并记录task_id；已有task_id时直接恢复跟踪"""
+        saved = self.state.get(job["id"])
+        if saved.get("task_id"):
+            logger.info(f"恢复跟踪已提交的任务: {saved['task_id']}")
+            handle = track_task(saved["task_id"], endpoint, self.tokens.get(), job["type"],
+                                job.get("model_name", ""), job.get("mode", ""), initial_delay=0)
+            handle.submitted_at = saved.get("submitted_at", handle.submitted_at)
+            return handle, 0.0
+
+        payload = {key: value for key, value in job.items() if key not in ("id", "type")}
+        preflight.check(endpoint, payload.get("model_name"), prompt=payload.get("prompt"),
+                        negative_prompt=payload.get("negative_prompt"), cfg_scale=payload.get("cfg_scale"),
+                        duration=payload.get("duration"), camera_control=payload.get("camera_control"),
+                        text=payload.get("input", {}).get("text"))
+        payload = inline_files(payload, self.base_dir)
+
+        submit_start = time.time()
+        admission = get_admission()
+        admission.acquire(priority=PRIORITY_BATCH, url=f"{api_client.api_base()}{endpoint}")
+        try:
+            data = submit_task(endpoint, self.tokens.get(), payload)
+        except BaseException:
+            admission.release()
+            raise
+        task_id = data["task_id"]
+        self.state.update(job["id"], task_id=task_id, endpoint=endpoint, submitted_at=time.time(), status="submitted")
+        metrics.task_submitted(task_id, job["type"], payload.get("model_name", ""), payload.get("mode", ""))
+        handle = track_task(task_id, endpoint, self.tokens.get(), job["type"],
+                            payload.get("model_name", ""), payload.get("mode", ""))
+        admission.attach(handle)
+        logger.info(f"已提交任务: {task_id}")
+        return handle, time.time() - submit_start
+
+    def run_api_job(self, job):
+        endpoint = JOB_ENDPOINTS[job["type"]]
+        handle, submit_seconds = self.submit(job, endpoint)
+        handle.wait(self.timeout)
+        generation_done = time.time()
+        record = {"task_id": handle.task_id, "status": handle.status, "submit_seconds": round(submit_seconds, 3),
+                  "generation_seconds": round(generation_done - handle.submitted_at, 3)}
+        if not handle.done.is_set():
+            return dict(record, status="timeout", error=f"等待超时，当前状态: {handle.status}")
+        if handle.status != "succeed":
+            return dict(record, error=handle.error)
+
+        results = handle.result_urls()
+        record["urls"] = [url for url, _ in results]
+        record["outputs"] = self.download_results(job["id"], results) if self.download else []
+        record["download_seconds"] = round(time.time() - generation_done, 3)
+        return record
+
+    def run_node_job(self, job):
+        from .lip_sync_async import KLingAILipSyncAsync
+
+        node = KLingAILipSyncAsync()
+        node.output_dir = self.output_dir
+        params = {key: value for key, value in job.items() if key not in ("id", "type")}
+        params.setdefault("output_filename", job["id"])
+        if params.get("audio_file") and not os.path.isabs(params["audio_file"]):
+            params["audio_file"] = os.path.join(self.base_dir, params["audio_file"])
+        output = node.process_lip_sync_async(self.tokens.get(), **params)[0]
+        if output and os.path.isfile(output):
+            return {"status": "succeed", "outputs": [output]}
+        return {"status": "failed", "error": output}
+
+    def download_results(self, job_id, results):
+        outputs = []
+        for index, (url, _) in enumerate(results):
+            ext = os.path.splitext(urlparse(url).path)[1] or ".bin"
+            suffix = f"_{index}" if len(results) > 1 else ""
+            path = os.path.join(self.output_dir, f"{job_id}{suffix}{ext}")
+            kind = "video" if ext in (".mp4", ".mov") else "image"
+            api_client.download_to_file(url, path, kind, timeout=120)
+            outputs.append(path)
+        logger.info(f"已下载 {len(outputs)} 个结果文件")
+        return outputs
+
+    def write_result(self, record):
+        with self.results_lock:
+            with open(self.results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无界面批量运行KLing任务")
+    parser.add_argument("manifest", help="JSONL任务清单")
+    parser.add_argument("--output-dir", default="kling_output", help="结果文件目录")
+    parser.add_argument("--state", default="", help="状态文件，默认 <output-dir>/state.json")
+    parser.add_argument("--results", default="", help="结果JSONL，默认 <output-dir>/results.jsonl")
+    parser.add_argument("--api-token", default=os.environ.get("KLING_API_TOKEN", ""))
+    parser.add_argument("--access-key", default=os.environ.get("KLING_ACCESS_KEY", ""))
+    parser.add_argument("--secret-key", default=os.environ.get("KLING_SECRET_KEY", ""))
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="同时处理的任务数，默认与KLING_MAX_CONCURRENT_TASKS一致")
+    parser.add_argument("--timeout", type=int, default=3600, help="单个任务最长等待时间（秒）")
+    parser.add_argument("--no-download", action="store_true", help="只记录结果URL，不下载")
+    parser.add_argument("--retry-failed", action="store_true", help="重新提交状态文件中已失败的任务")
+    args = parser.parse_args(argv)
+
+    if not args.api_token and not (args.access_key and args.secret_key):
+        parser.error("需要 --api-token 或 --access-key/--secret-key")
+
+    jobs = read_manifest(args.manifest)
+    os.makedirs(args.output_dir, exist_ok=True)
+    runner = BatchRunner(
+        TokenSource(args.api_token, args.access_key, args.secret_key),
+        args.output_dir,
+        StateFile(args.state or os.path.join(args.output_dir, "state.json")),
+        args.results or os.path.join(args.output_dir, "results.jsonl"),
+        concurrency=args.concurrency or get_admission().capacity,
+        timeout=args.timeout,
+        download=not args.no_download,
+        base_dir=os.path.dirname(os.path.abspath(args.manifest)),
+    )
+    summary = runner.run(jobs, retry_failed=args.retry_failed)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
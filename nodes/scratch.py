@@ -0,0 +1,248 @@
+import os
+import time
+import uuid
+import socket
+import shutil
+import tempfile
+import threading
+
+from .log import get_logger
+
+logger = get_logger("scratch")
+
+
+# 临时工作目录管理
+# 口型同步等节点的中间文件（原始音频、音频片段、片段视频）放在独立的根目录下，不再写入ComfyUI的output目录
+# 任务成功后删除自己的目录；失败或取消的目录保留下来便于排查，由清理按时间和总大小回收
+# 清理在首次使用时和之后创建任务目录时在后台运行（两次清理至少间隔KLING_SCRATCH_GC_INTERVAL_MINUTES分钟），
+# 长时间运行的ComfyUI也会定期回收；多个进程共用根目录时，锁文件中的进程仍在运行的目录不会被清理
+# KLING_SCRATCH_DIR: 根目录，默认系统临时目录下的jm_kling_scratch
+# KLING_SCRATCH_JOB_QUOTA_MB: 单个任务目录的大小上限，0表示不限
+# KLING_SCRATCH_MAX_AGE_HOURS: 清理时删除超过此时长未修改的目录
+# KLING_SCRATCH_MAX_TOTAL_MB: 根目录总大小上限，超过时从最旧的目录开始删除
+# KLING_SCRATCH_GC_INTERVAL_MINUTES: 两次清理之间的最小间隔
+DEFAULT_JOB_QUOTA_MB = 2048
+DEFAULT_MAX_AGE_HOURS = 24
+DEFAULT_MAX_TOTAL_MB = 10240
+DEFAULT_GC_INTERVAL_MINUTES = 10
+
+# 跨执行复用的缓存（如口型同步片段缓存）放在根目录下的此目录中，由各缓存自己按大小淘汰，清理任务目录时跳过
+CACHE_DIR_NAME = "cache"
+
+# 保留用于排查的目录（keep_artifacts）中的标记文件，按总大小清理时跳过，只按时间清理
+KEEP_MARKER = ".keep"
+
+# 任务目录中记录所属进程（"pid 主机名"）的锁文件
+LOCK_FILE = ".lock"
+# 锁文件的状态：属于本进程、本机仍在运行的其他进程、其他主机（无法检查）
+LOCK_OWN = "own"
+LOCK_LIVE = "live"
+LOCK_REMOTE = "remote"
+
+
+class ScratchQuotaExceeded(Exception):
+    """任务目录超过大小上限"""
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _env_mb(name, default):
+    return int(float(os.environ.get(name, default)) * 1024 * 1024)
+
+
+def pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        # Windows上os.kill(pid, 0)会结束目标进程，改用OpenProcess查询退出码
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def lock_owner(path):
+    """目录锁文件的状态：LOCK_OWN/LOCK_LIVE/LOCK_REMOTE，没有锁文件或所属进程已退出时返回None"""
+    try:
+        with open(os.path.join(path, LOCK_FILE), "r", encoding="utf-8") as f:
+            pid, _, host = f.read().strip().partition(" ")
+        pid = int(pid)
+    except (OSError, ValueError):
+        return None
+    if host != socket.gethostname():
+        return LOCK_REMOTE
+    if pid == os.getpid():
+        return LOCK_OWN
+    return LOCK_LIVE if pid_alive(pid) else None
+
+
+class ScratchJob:
+    """单次执行的临时目录"""
+
+    def __init__(self, space, path, quota):
+        self.space = space
+        self.path = path
+        self.quota = quota
+
+    def subdir(self, name):
+        path = os.path.join(self.path, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def check(self):
+        """检查目录大小，超过上限时抛出ScratchQuotaExceeded"""
+        if not self.quota:
+            return
+        size = dir_size(self.path)
+        if size > self.quota:
+            raise ScratchQuotaExceeded(f"临时目录超过大小上限: {size / 1048576:.1f} MB > "
+                                       f"{self.quota / 1048576:.0f} MB ({self.path})")
+
+    def finish(self, keep=False):
+        """任务成功后调用：删除目录，keep为True时保留并标记"""
+        self.space.active.discard(self.path)
+        if keep:
+            open(os.path.join(self.path, KEEP_MARKER), "w").close()
+            try:
+                os.remove(os.path.join(self.path, LOCK_FILE))
+            except OSError:
+                pass
+            logger.info(f"保留临时目录: {self.path}")
+            return
+        shutil.rmtree(self.path, ignore_errors=True)
+        logger.debug("已删除临时目录: %s", self.path)
+
+
+class ScratchSpace:
+    """临时目录根目录，负责创建任务目录和回收旧目录"""
+
+    def __init__(self, root=None, job_quota=None, max_age=None, max_total=None, gc_interval=None):
+        self.root = root or os.environ.get("KLING_SCRATCH_DIR") or os.path.join(tempfile.gettempdir(),
+                                                                                "jm_kling_scratch")
+        self.job_quota = job_quota if job_quota is not None else _env_mb("KLING_SCRATCH_JOB_QUOTA_MB",
+                                                                         DEFAULT_JOB_QUOTA_MB)
+        self.max_age = max_age if max_age is not None else float(
+            os.environ.get("KLING_SCRATCH_MAX_AGE_HOURS", DEFAULT_MAX_AGE_HOURS)) * 3600
+        self.max_total = max_total if max_total is not None else _env_mb("KLING_SCRATCH_MAX_TOTAL_MB",
+                                                                         DEFAULT_MAX_TOTAL_MB)
+        self.gc_interval = gc_interval if gc_interval is not None else float(
+            os.environ.get("KLING_SCRATCH_GC_INTERVAL_MINUTES", DEFAULT_GC_INTERVAL_MINUTES)) * 60
+        # 本进程中正在使用的目录，清理时跳过
+        self.active = set()
+        self.gc_lock = threading.Lock()
+        # 只保护gc_started_at，清理进行中创建任务目录不会被阻塞
+        self.schedule_lock = threading.Lock()
+        self.gc_started_at = None
+
+    def job(self, prefix):
+        name = f"{prefix}_{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        # 其他共用根目录的进程清理时据此跳过本目录
+        with open(os.path.join(path, LOCK_FILE), "w", encoding="utf-8") as f:
+            f.write(f"{os.getpid()} {socket.gethostname()}")
+        self.active.add(path)
+        logger.info(f"创建临时工作目录: {path}")
+        self.collect_in_background()
+        return ScratchJob(self, path, self.job_quota)
+
+    def collect_in_background(self):
+        """距离上次清理超过gc_interval时在后台线程清理，返回是否启动了清理"""
+        with self.schedule_lock:
+            now = time.monotonic()
+            if self.gc_started_at is not None and now - self.gc_started_at < self.gc_interval:
+                return False
+            self.gc_started_at = now
+        threading.Thread(target=self.collect_garbage, name="kling-scratch-gc", daemon=True).start()
+        return True
+
+    def cache_dir(self, name):
+        """跨执行复用的缓存目录，不参与任务目录的清理和总大小统计"""
+        return os.path.join(self.root, CACHE_DIR_NAME, name)
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            path = os.path.join(self.root, name)
+            if name == CACHE_DIR_NAME or path in self.active or not os.path.isdir(path):
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            entries.append((mtime, path))
+        return sorted(entries)
+
+    def collect_garbage(self, now=None):
+        """
+        删除过期的目录，再从最旧的开始删除直到总大小不超过上限；返回(删除数, 释放字节数)
+        本机其他进程仍在使用的目录不删除；其他主机的目录无法检查，和keep_artifacts保留的目录一样只按时间清理
+        """
+        now = now or time.time()
+        removed, freed = 0, 0
+        with self.gc_lock:
+            remaining, in_use = [], 0
+            for mtime, path in self._entries():
+                size = dir_size(path)
+                owner = lock_owner(path)
+                if owner == LOCK_LIVE:
+                    in_use += size
+                elif self.max_age and now - mtime > self.max_age:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed, freed = removed + 1, freed + size
+                else:
+                    remaining.append((path, size, owner == LOCK_REMOTE))
+            if self.max_total:
+                total = (sum(size for _, size, _ in remaining) + in_use
+                         + sum(dir_size(path) for path in list(self.active)))
+                for path, size, remote in remaining:
+                    if total <= self.max_total:
+                        break
+                    if remote or os.path.exists(os.path.join(path, KEEP_MARKER)):
+                        continue
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed, freed, total = removed + 1, freed + size, total - size
+        if removed:
+            logger.info(f"已清理 {removed} 个临时目录，释放 {freed / 1048576:.1f} MB: {self.root}")
+        return removed, freed
+
+
+_scratch = None
+_scratch_lock = threading.Lock()
+
+
+def get_scratch():
+    """获取全局临时目录管理器，首次调用时在后台线程清理旧目录"""
+    global _scratch
+    with _scratch_lock:
+        if _scratch is None:
+            _scratch = ScratchSpace()
+            _scratch.collect_in_background()
+        return _scratch
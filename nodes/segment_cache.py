@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from .log import get_logger
+from .scratch import get_scratch
+
+logger = get_logger("segment_cache")
+
+
+# 口型同步片段结果缓存
+# 按(视频来源, 片段音频的SHA-256, 任务参数)缓存已成功的片段视频，重新运行时只提交没有缓存结果的片段
+# KLING_SEGMENT_CACHE_DIR: 缓存目录，默认临时目录根目录（KLING_SCRATCH_DIR）下的cache/lip_sync_segments
+# KLING_SEGMENT_CACHE_MAX_MB: 缓存总大小上限，写入后超过时从最久未使用的条目开始删除，0表示不限
+CACHE_NAME = "lip_sync_segments"
+DEFAULT_MAX_MB = 4096
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SegmentCache:
+    """
+    片段视频缓存，每个条目是 <key>.mp4 和记录来源任务的 <key>.json
+    只缓存下载成功的片段，失败的片段下次运行会重新提交
+    """
+
+    def __init__(self, root, max_bytes=0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def key(self, video_source, audio_path, **params):
+        """视频来源、片段音频内容和任务参数共同决定一个片段结果"""
+        identity = {"video": video_source, "audio_sha256": file_sha256(audio_path), "params": params}
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.root, f"{key}.mp4"), os.path.join(self.root, f"{key}.json")
+
+    def get(self, key):
+        """返回(视频路径, 元数据)，没有缓存时返回(None, None)"""
+        video_path, meta_path = self._paths(key)
+        if not (os.path.isfile(video_path) and os.path.isfile(meta_path)):
+            return None, None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # 修改时间作为最近使用时间，淘汰时先删除最久未使用的条目
+            os.utime(video_path)
+            return video_path, meta
+        except (OSError, ValueError) as e:
+            logger.warning(f"片段缓存元数据损坏，忽略: {meta_path} ({e})")
+            return None, None
+
+    def put(self, key, video_file, move=False, **meta):
+        """
+        把下载好的片段复制进缓存，move为True时移动（同一文件系统上只是重命名）；
+        元数据最后写入，写入中断时不会留下半个条目
+        """
+        video_path, meta_path = self._paths(key)
+        try:
+            with self.lock:
+                os.makedirs(self.root, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".mp4.tmp")
+            os.close(fd)
+            if move:
+                shutil.move(video_file, temp_path)
+            else:
+                shutil.copyfile(video_file, temp_path)
+            os.replace(temp_path, video_path)
+            fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".json.tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(dict(meta, cached_at=int(time.time())), f, ensure_ascii=False)
+            os.replace(temp_path, meta_path)
+        except OSError as e:
+            logger.warning(f"写入片段缓存失败: {e}")
+            return None
+        self.evict(keep=video_path)
+        return video_path
+
+    def evict(self, keep=None):
+        """总大小超过上限时按最近使用时间从旧到新删除条目，keep为刚写入的条目，不删除"""
+        if not self.max_bytes:
+            return
+        with self.lock:
+            entries, total = [], 0
+            for name in os.listdir(self.root):
+                if not name.endswith(".mp4"):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+                total += stat.st_size
+            removed = 0
+            for _, path, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                for entry_path in (path, path[:-len(".mp4")] + ".json"):
+                    try:
+                        os.remove(entry_path)
+                    except OSError:
+                        pass
+                total -= size
+                removed += 1
+        if removed:
+            logger.info(f"片段缓存超过上限，已删除 {removed} 个最久未使用的条目，当前 {total / 1048576:.1f} MB")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_segment_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SegmentCache(
+                os.environ.get("KLING_SEGMENT_CACHE_DIR") or get_scratch().cache_dir(CACHE_NAME),
+                int(float(os.environ.get("KLING_SEGMENT_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024))
+        return _cache
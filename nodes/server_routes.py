@@ -0,0 +1,54 @@
+import sys
+
+from . import circuit_breaker, metrics
+from .log import get_logger
+
+logger = get_logger("server_routes")
+
+_registered = False
+
+
+def get_prompt_server():
+    """
+    获取ComfyUI的PromptServer实例
+    只使用已经加载的server模块，不在ComfyUI之外（如基准脚本、命令行）主动导入
+    """
+    server = sys.modules.get("server")
+    prompt_server = getattr(server, "PromptServer", None) if server else None
+    return getattr(prompt_server, "instance", None) if prompt_server else None
+
+
+def register_routes():
+    """在ComfyUI服务器上注册插件的HTTP接口，重复调用只注册一次"""
+    global _registered
+    if _registered:
+        return True
+
+    prompt_server = get_prompt_server()
+    if prompt_server is None:
+        return False
+
+    from aiohttp import web
+
+    routes = prompt_server.routes
+
+    @routes.get("/jm-kling/metrics")
+    async def prometheus_metrics(request):
+        # Prometheus文本格式
+        return web.Response(text=metrics.render_prometheus(),
+                            content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    @routes.get("/jm-kling/metrics.json")
+    async def metrics_snapshot(request):
+        return web.json_response(metrics.snapshot())
+
+    @routes.get("/jm-kling/circuit")
+    async def circuit_status(request):
+        # 各接口组的熔断状态，有接口组未关闭时返回503，编排系统可以据此切换流量
+        state = circuit_breaker.status()
+        return web.json_response(state, status=503 if state["open"] else 200)
+
+    _registered = True
+    logger.info("已注册指标接口: /jm-kling/metrics, /jm-kling/metrics.json, /jm-kling/circuit")
+    return True
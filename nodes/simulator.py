@@ -0,0 +1,536 @@
+"""
+KLing API 本地模拟服务
+
+在本地模拟可灵API的任务提交、状态查询、任务列表分页查询、JWT鉴权、429限流、任务失败、回调和结果文件下载，
+用于在没有网络和真实账号的情况下对各节点做吞吐和轮询行为的基准测试与回归测试。
+
+用法:
+    python -m nodes.simulator --port 8787 --access-key ak --secret-key sk
+    然后在启动ComfyUI或基准脚本前设置 KLING_API_BASE=http://127.0.0.1:8787
+
+也可以在代码中使用:
+    with KLingSimulator(SimulatorConfig(completion_seconds=2)) as sim:
+        os.environ["KLING_API_BASE"] = sim.base_url
+"""
+import os
+import hmac
+import json
+import math
+import time
+import uuid
+import zlib
+import base64
+import random
+import shutil
+import struct
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .log import get_logger
+
+logger = get_logger("simulator")
+
+
+# 提交端点及其结果类型
+TASK_ENDPOINTS = {
+    "/v1/videos/text2video": "video",
+    "/v1/videos/image2video": "video",
+    "/v1/videos/multi-image2video": "video",
+    "/v1/videos/lip-sync": "video",
+    "/v1/images/generations": "image",
+    "/v1/images/multi-image2image": "image",
+}
+
+# 各端点的必填参数，缺失时返回参数错误
+REQUIRED_FIELDS = {
+    "/v1/videos/text2video": ("prompt",),
+    "/v1/videos/image2video": ("image",),
+    "/v1/videos/multi-image2video": ("image_list",),
+    "/v1/videos/lip-sync": ("input",),
+    "/v1/images/generations": ("prompt",),
+    "/v1/images/multi-image2image": ("subject_image_list",),
+}
+
+# 与可灵API一致的业务错误码
+CODE_AUTH_EMPTY = 1001
+CODE_AUTH_INVALID = 1002
+CODE_AUTH_NOT_YET_VALID = 1003
+CODE_AUTH_EXPIRED = 1004
+CODE_INVALID_PARAMS = 1201
+CODE_NOT_FOUND = 1203
+CODE_RATE_LIMITED = 1302
+CODE_CONCURRENCY_LIMITED = 1303
+
+
+class SimulatorConfig:
+    """
+    模拟服务配置
+    access_key/secret_key 为空时只检查JWT格式和有效期，不校验签名
+    completion_seconds 为任务完成耗时的中位数，实际耗时服从对数正态分布（completion_sigma）
+    rate_limit_rps 和 max_concurrent_tasks 为0表示不限制
+    """
+
+    def __init__(self, access_key="", secret_key="", require_auth=True,
+                 latency_ms=50.0, latency_jitter_ms=20.0,
+                 completion_seconds=5.0, completion_sigma=0.3,
+                 failure_rate=0.0, rate_limit_rps=0.0, max_concurrent_tasks=0,
+                 video_duration=5, seed=None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.require_auth = require_auth
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.completion_seconds = completion_seconds
+        self.completion_sigma = completion_sigma
+        self.failure_rate = failure_rate
+        self.rate_limit_rps = rate_limit_rps
+        self.max_concurrent_tasks = max_concurrent_tasks
+        self.video_duration = video_duration
+        self.seed = seed
+
+
+def _b64url_decode(segment):
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _b64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def make_token(access_key, secret_key, ttl=1800):
+    """生成与API Key节点相同格式的HS256 JWT，只依赖标准库"""
+    now = int(time.time())
+    header = _b64url_encode(json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode())
+    payload = _b64url_encode(json.dumps({"iss": access_key, "exp": now + ttl, "nbf": now - 5},
+                                        separators=(",", ":")).encode())
+    signing_input = f"{header}.{payload}".encode("ascii")
+    signature = _b64url_encode(hmac.new(secret_key.encode(), signing_input, hashlib.sha256).digest())
+    return f"{header}.{payload}.{signature}"
+
+
+def make_png(width=64, height=64, seed_text=""):
+    """生成纯色PNG，颜色由seed_text决定"""
+    digest = hashlib.md5(seed_text.encode()).digest()
+    row = b"\x00" + bytes(digest[:3]) * width
+    raw = row * height
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+def make_mp4(duration=5, cache_dir=None):
+    """
+    生成测试视频，有ffmpeg时生成可播放的H.264视频，否则返回只含ftyp头的占位文件
+    同一时长只生成一次
+    """
+    cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "jm_kling_simulator")
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"testsrc_{duration}s.mp4")
+    if not os.path.isfile(path) and shutil.which("ffmpeg"):
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc=size=320x240:rate=24:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest",
+            path,
+        ]
+        if subprocess.run(cmd, capture_output=True).returncode != 0 and os.path.exists(path):
+            os.remove(path)
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    # ftyp box + 空的free box
+    ftyp = b"ftypisom" + struct.pack(">I", 512) + b"isomiso2avc1mp41"
+    return struct.pack(">I", len(ftyp) + 4) + ftyp + struct.pack(">I", 8) + b"free"
+
+
+class SimulatedTask:
+    """模拟任务，状态根据提交后经过的时间计算"""
+
+    def __init__(self, endpoint, kind, payload, completion_seconds, will_fail):
+        self.task_id = uuid.uuid4().hex[:18]
+        self.endpoint = endpoint
+        self.kind = kind
+        self.payload = payload
+        self.external_task_id = payload.get("external_task_id") or ""
+        self.callback_url = payload.get("callback_url") or ""
+        self.created_at = time.time()
+        self.completion_seconds = completion_seconds
+        self.will_fail = will_fail
+        self.image_count = max(1, int(payload.get("n", 1) or 1)) if kind == "image" else 0
+
+    @property
+    def complete_at(self):
+        return self.created_at + self.completion_seconds
+
+    def status(self, now=None):
+        elapsed = (now or time.time()) - self.created_at
+        if elapsed >= self.completion_seconds:
+            return "failed" if self.will_fail else "succeed"
+        # 前10%的时间处于排队状态
+        if elapsed < self.completion_seconds * 0.1:
+            return "submitted"
+        return "processing"
+
+    def to_data(self, base_url, video_duration, now=None):
+        now = now or time.time()
+        status = self.status(now)
+        data = {
+            "task_id": self.task_id,
+            "task_status": status,
+            "task_status_msg": "",
+            "task_info": {"external_task_id": self.external_task_id},
+            "created_at": int(self.created_at * 1000),
+            "updated_at": int(min(now, self.complete_at) * 1000),
+        }
+        if status == "processing":
+            progress = (now - self.created_at) / self.completion_seconds
+            data["process_progress"] = f"{min(99, int(progress * 100))}%"
+        elif status == "failed":
+            data["task_status_msg"] = "Simulated failure"
+        elif status == "succeed":
+            if self.kind == "video":
+                data["task_result"] = {"videos": [{
+                    "id": f"{self.task_id}-video",
+                    "url": f"{base_url}/assets/{self.task_id}.mp4",
+                    "duration": str(video_duration),
+                }]}
+            else:
+                data["task_result"] = {"images": [
+                    {"index": index, "url": f"{base_url}/assets/{self.task_id}_{index}.png"}
+                    for index in range(self.image_count)
+                ]}
+        return data
+
+
+class KLingSimulator:
+    """本地KLing API模拟服务"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or SimulatorConfig()
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.random = random.Random(self.config.seed)
+        self.tasks = {}
+        self.external_ids = {}
+        self.stats = {"requests": 0, "submitted": 0, "queries": 0, "rate_limited": 0,
+                      "concurrency_limited": 0, "unauthorized": 0, "callbacks": 0, "downloads": 0,
+                      "list_queries": 0}
+        self.bucket_tokens = float(self.config.rate_limit_rps or 0)
+        self.bucket_updated = time.monotonic()
+        self.mp4_bytes = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        """在后台线程启动服务，返回base_url"""
+        self.server = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="kling-simulator", daemon=True)
+        self.thread.start()
+        logger.info(f"KLing API模拟服务已启动: {self.base_url}")
+        return self.base_url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # ---- 模拟行为 ----
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _sample_latency(self):
+        with self.lock:
+            latency = self.random.gauss(self.config.latency_ms, self.config.latency_jitter_ms)
+        return max(0.0, latency) / 1000.0
+
+    def _sample_task(self):
+        with self.lock:
+            duration = self.config.completion_seconds * math.exp(self.random.gauss(0, self.config.completion_sigma))
+            will_fail = self.random.random() < self.config.failure_rate
+        return duration, will_fail
+
+    def _take_token(self):
+        """令牌桶限流，桶容量等于每秒请求数"""
+        rps = self.config.rate_limit_rps
+        if not rps:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.bucket_tokens = min(rps, self.bucket_tokens + (now - self.bucket_updated) * rps)
+            self.bucket_updated = now
+            if self.bucket_tokens < 1:
+                return False
+            self.bucket_tokens -= 1
+            return True
+
+    def _running_tasks(self):
+        now = time.time()
+        with self.lock:
+            return sum(1 for task in self.tasks.values() if task.complete_at > now)
+
+    def check_auth(self, authorization):
+        """校验Bearer JWT，返回 (错误码, 错误信息)，通过时错误码为0"""
+        if not self.config.require_auth:
+            return 0, ""
+        if not authorization or not authorization.startswith("Bearer "):
+            return CODE_AUTH_EMPTY, "Authorization is empty"
+        token = authorization[len("Bearer "):].strip()
+        try:
+            header_b64, payload_b64, signature_b64 = token.split(".")
+            header = json.loads(_b64url_decode(header_b64))
+            payload = json.loads(_b64url_decode(payload_b64))
+        except Exception:
+            return CODE_AUTH_INVALID, "Authorization is invalid"
+        if header.get("alg") != "HS256":
+            return CODE_AUTH_INVALID, "Authorization is invalid"
+        if self.config.secret_key:
+            expected = hmac.new(self.config.secret_key.encode(), f"{header_b64}.{payload_b64}".encode("ascii"),
+                                hashlib.sha256).digest()
+            try:
+                signature = _b64url_decode(signature_b64)
+            except Exception:
+                signature = b""
+            if not hmac.compare_digest(expected, signature):
+                return CODE_AUTH_INVALID, "Authorization is invalid"
+        if self.config.access_key and payload.get("iss") != self.config.access_key:
+            return CODE_AUTH_INVALID, "Authorization is invalid"
+        now = time.time()
+        if payload.get("nbf") and now < payload["nbf"]:
+            return CODE_AUTH_NOT_YET_VALID, "Authorization is not active"
+        if payload.get("exp") and now >= payload["exp"]:
+            return CODE_AUTH_EXPIRED, "Authorization is expired"
+        return 0, ""
+
+    def _schedule_callback(self, task):
+        if not task.callback_url:
+            return
+        timer = threading.Timer(max(0.0, task.complete_at - time.time()), self._send_callback, args=(task,))
+        timer.daemon = True
+        timer.start()
+
+    def _send_callback(self, task):
+        body = json.dumps(task.to_data(self.base_url, self.config.video_duration)).encode()
+        request = urllib.request.Request(task.callback_url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+            self._count("callbacks")
+        except Exception as e:
+            logger.warning(f"模拟回调失败: {task.callback_url}: {e}")
+
+    # ---- 请求处理 ----
+
+    @staticmethod
+    def _response(http_status, code=0, message="SUCCEED", data=None):
+        body = {"code": code, "message": message, "request_id": uuid.uuid4().hex}
+        if data is not None:
+            body["data"] = data
+        return http_status, "application/json", json.dumps(body).encode()
+
+    def dispatch(self, method, path, headers, body):
+        """处理一次请求，返回 (HTTP状态码, Content-Type, 响应体)"""
+        self._count("requests")
+        parsed = urlparse(path)
+        route = parsed.path.rstrip("/")
+
+        if method == "GET" and route == "/_simulator/stats":
+            with self.lock:
+                stats = dict(self.stats, tasks=len(self.tasks))
+            return 200, "application/json", json.dumps(stats).encode()
+
+        if method == "GET" and route.startswith("/assets/"):
+            return self._serve_asset(route[len("/assets/"):])
+
+        time.sleep(self._sample_latency())
+
+        code, message = self.check_auth(headers.get("Authorization", ""))
+        if code:
+            self._count("unauthorized")
+            return self._response(401, code, message)
+
+        if not self._take_token():
+            self._count("rate_limited")
+            return self._response(429, CODE_RATE_LIMITED, "API request is too fast")
+
+        if method == "POST" and route in TASK_ENDPOINTS:
+            return self._submit(route, body)
+
+        if method == "GET" and route in TASK_ENDPOINTS:
+            return self._list(route, parse_qs(parsed.query))
+
+        if method == "GET":
+            endpoint, _, query_id = route.rpartition("/")
+            if endpoint in TASK_ENDPOINTS:
+                return self._query(endpoint, query_id)
+
+        return self._response(404, CODE_NOT_FOUND, "route not found")
+
+    def _submit(self, endpoint, body):
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self._response(400, CODE_INVALID_PARAMS, "The input parameters are not correct")
+        missing = [name for name in REQUIRED_FIELDS.get(endpoint, ()) if not payload.get(name)]
+        if missing:
+            return self._response(400, CODE_INVALID_PARAMS, f"missing parameter: {', '.join(missing)}")
+
+        limit = self.config.max_concurrent_tasks
+        if limit and self._running_tasks() >= limit:
+            self._count("concurrency_limited")
+            return self._response(429, CODE_CONCURRENCY_LIMITED, "parallel task over resource pack limit")
+
+        completion_seconds, will_fail = self._sample_task()
+        task = SimulatedTask(endpoint, TASK_ENDPOINTS[endpoint], payload, completion_seconds, will_fail)
+        with self.lock:
+            self.tasks[task.task_id] = task
+            if task.external_task_id:
+                self.external_ids[task.external_task_id] = task.task_id
+            self.stats["submitted"] += 1
+        self._schedule_callback(task)
+
+        data = task.to_data(self.base_url, self.config.video_duration)
+        return self._response(200, data={key: data[key] for key in
+                                         ("task_id", "task_status", "task_info", "created_at", "updated_at")})
+
+    def _query(self, endpoint, query_id):
+        self._count("queries")
+        with self.lock:
+            task = self.tasks.get(query_id) or self.tasks.get(self.external_ids.get(query_id, ""))
+        if task is None or task.endpoint != endpoint:
+            return self._response(404, CODE_NOT_FOUND, "task not found")
+        return self._response(200, data=task.to_data(self.base_url, self.config.video_duration))
+
+    def _list(self, endpoint, query):
+        """任务列表查询，按创建时间倒序分页，pageNum从1开始，pageSize最大500"""
+        self._count("list_queries")
+        try:
+            page_num = int(query.get("pageNum", ["1"])[0])
+            page_size = int(query.get("pageSize", ["30"])[0])
+        except ValueError:
+            return self._response(400, CODE_INVALID_PARAMS, "The input parameters are not correct")
+        if page_num < 1 or not 1 <= page_size <= 500:
+            return self._response(400, CODE_INVALID_PARAMS, "pageNum/pageSize out of range")
+        with self.lock:
+            tasks = sorted((task for task in self.tasks.values() if task.endpoint == endpoint),
+                           key=lambda task: task.created_at, reverse=True)
+        page = tasks[(page_num - 1) * page_size:page_num * page_size]
+        now = time.time()
+        return self._response(200, data=[task.to_data(self.base_url, self.config.video_duration, now)
+                                         for task in page])
+
+    def _serve_asset(self, name):
+        stem, ext = os.path.splitext(name)
+        task_id = stem.split("_")[0]
+        with self.lock:
+            task = self.tasks.get(task_id)
+        if task is None or task.status() != "succeed":
+            return 404, "text/plain", b"not found"
+        self._count("downloads")
+        if ext == ".png":
+            return 200, "image/png", make_png(seed_text=stem)
+        if ext == ".mp4":
+            if self.mp4_bytes is None:
+                self.mp4_bytes = make_mp4(self.config.video_duration)
+            return 200, "video/mp4", self.mp4_bytes
+        return 404, "text/plain", b"not found"
+
+
+def _make_handler(simulator):
+    class SimulatorRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _handle(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, content_type, payload = simulator.dispatch(method, self.path, self.headers, body)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            if method != "HEAD":
+                self.wfile.write(payload)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_HEAD(self):
+            self._handle("HEAD")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def log_message(self, format, *args):
+            logger.debug("模拟服务: " + format, *args)
+
+    return SimulatorRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KLing API 本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--access-key", default="", help="校验JWT的iss，为空时不校验")
+    parser.add_argument("--secret-key", default="", help="校验JWT签名，为空时不校验")
+    parser.add_argument("--no-auth", action="store_true", help="不校验Authorization")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="API响应延迟均值(毫秒)")
+    parser.add_argument("--latency-jitter-ms", type=float, default=20.0, help="API响应延迟标准差(毫秒)")
+    parser.add_argument("--completion-seconds", type=float, default=5.0, help="任务完成耗时中位数(秒)")
+    parser.add_argument("--completion-sigma", type=float, default=0.3, help="任务耗时对数正态分布的sigma")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="任务失败比例(0~1)")
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0, help="每秒请求上限，超过返回429")
+    parser.add_argument("--max-concurrent-tasks", type=int, default=0, help="同时处理的任务上限，超过返回429")
+    parser.add_argument("--video-duration", type=int, default=5, help="结果视频时长(秒)")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现")
+    args = parser.parse_args()
+
+    config = SimulatorConfig(
+        access_key=args.access_key, secret_key=args.secret_key, require_auth=not args.no_auth,
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+        completion_seconds=args.completion_seconds, completion_sigma=args.completion_sigma,
+        failure_rate=args.failure_rate, rate_limit_rps=args.rate_limit_rps,
+        max_concurrent_tasks=args.max_concurrent_tasks, video_duration=args.video_duration, seed=args.seed,
+    )
+    simulator = KLingSimulator(config, host=args.host, port=args.port)
+    simulator.start()
+    print(f"设置 KLING_API_BASE={simulator.base_url} 后节点将请求模拟服务，Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import time
+import threading
+
+from . import cancellation, metrics
+from .log import get_logger
+
+logger = get_logger("single_flight")
+
+
+# 相同请求合并
+# 多个节点（或多个工作流）同时查询同一个任务时，同一时刻只发送一个请求，其他调用方等待并共用结果；
+# 成功的结果保留一小段时间，调用方按自己的轮询间隔决定能接受多旧的结果，N个观察者每个间隔只产生一次请求
+# 结果最多保留MAX_AGE秒
+MAX_AGE = 60.0
+# 条目数超过此值时清理过期条目
+PRUNE_THRESHOLD = 256
+
+# outcome: request 实际发送；shared 共用进行中的请求；cached 使用缓存的结果
+SINGLE_FLIGHT_CALLS = metrics.REGISTRY.register(metrics.Counter(
+    "kling_single_flight_calls_total", "状态查询的合并情况", ("outcome",)))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = 0.0
+
+
+class SingleFlight:
+    """按key合并并发调用，并缓存最近一次成功的结果"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _prune(self, now):
+        if len(self.calls) <= PRUNE_THRESHOLD:
+            return
+        for key, call in list(self.calls.items()):
+            if call.done.is_set() and now - call.finished_at > MAX_AGE:
+                del self.calls[key]
+
+    def do(self, key, func, max_age=0.0, cacheable=lambda result: True):
+        """
+        执行func并返回结果；相同key的调用正在进行时等待它的结果，
+        max_age秒内有成功且cacheable的结果时直接返回
+        """
+        max_age = min(max_age, MAX_AGE)
+        with self.lock:
+            now = time.monotonic()
+            call = self.calls.get(key)
+            if call is not None and call.done.is_set():
+                if call.error is None and now - call.finished_at < max_age:
+                    SINGLE_FLIGHT_CALLS.inc(outcome="cached")
+                    return call.result
+                call = None
+            leader = call is None
+            if leader:
+                self._prune(now)
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            SINGLE_FLIGHT_CALLS.inc(outcome="shared")
+            cancellation.wait(call.done)
+            if isinstance(call.error, cancellation.Cancelled):
+                # 发起请求的一方被取消，本调用方自己重新请求
+                return self.do(key, func, max_age, cacheable)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLE_FLIGHT_CALLS.inc(outcome="request")
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.finished_at = time.monotonic()
+            if call.error is not None or not cacheable(call.result):
+                # 失败和不可缓存的结果只给正在等待的调用方，不留给后来者
+                with self.lock:
+                    if self.calls.get(key) is call:
+                        del self.calls[key]
+            call.done.set()
+        return call.result
+
+
+_single_flight = SingleFlight()
+
+
+def do(key, func, max_age=0.0, cacheable=lambda result: True):
+    return _single_flight.do(key, func, max_age, cacheable)
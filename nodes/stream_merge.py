@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+import subprocess
+import collections
+
+from . import cancellation, metrics
+from .log import get_logger
+
+logger = get_logger("stream_merge")
+
+
+# 口型同步片段的流式合并
+# 整个合并只有一个写最终文件的ffmpeg进程，从stdin读取MPEG-TS：
+# 每个片段完成后由一个只做封装转换的ffmpeg直接读取片段URL（或缓存文件），转成MPEG-TS写入合并进程，
+# 片段视频不落盘，也没有file_list.txt、_temp.mp4、_silent.mp4等中间文件，磁盘写入约为输出文件大小
+# （启用片段缓存时，新完成的片段由同一个转换进程另存一份mp4写入缓存，不会重复下载）
+# 片段按音频片段的顺序送入，时间戳偏移为音频片段的起始时间；先完成的靠后片段等前面的片段处理完再送入
+# 任务失败的片段在输出中留空（skip记录空缺的时间段）；片段转换失败时可能已经写入了半个片段，整个合并失败
+# KLING_STREAM_FASTSTART: 设为1时输出加-movflags +faststart，把moov移到文件开头，便于网页边下边播；
+#   ffmpeg写完后要把整个文件重写一遍，磁盘写入翻倍，默认关闭
+# KLING_STREAM_READ_TIMEOUT: 读取片段URL时无数据的超时时间（秒），超时后该片段转换失败，避免合并卡在一个连接上
+DEFAULT_READ_TIMEOUT = 60
+CHUNK_SIZE = 256 * 1024
+# 保留的ffmpeg错误输出行数
+STDERR_LINES = 20
+
+
+class StderrDrain:
+    """在后台读取子进程的stderr，避免管道写满阻塞，保留最后几行用于报错"""
+
+    def __init__(self, stream):
+        self.lines = collections.deque(maxlen=STDERR_LINES)
+        self.thread = threading.Thread(target=self._run, args=(stream,), daemon=True)
+        self.thread.start()
+
+    def _run(self, stream):
+        for line in iter(stream.readline, b""):
+            self.lines.append(line.decode("utf-8", errors="replace").rstrip())
+        stream.close()
+
+    def text(self):
+        self.thread.join(1.0)
+        return "\n".join(self.lines)
+
+
+class StreamingMerger:
+    """
+    流式合并：start()启动合并进程，按顺序add()各片段，finish()等待写完
+    sync_adjust_ms为正时延迟音频，为负时延迟视频，与文件合并方式一致
+    """
+
+    def __init__(self, output_path, audio_path, sync_adjust_ms=0):
+        self.output_path = output_path
+        self.audio_path = audio_path
+        self.sync_adjust_ms = sync_adjust_ms
+        self.process = None
+        self.stderr = None
+        self.segments = 0
+        self.bytes = 0
+        # 输出中空缺的时间段（秒），对应失败或未创建任务的片段
+        self.gaps = []
+        # 片段转换失败的原因，设置后不再接受片段，finish()返回失败
+        self.error = None
+
+    def start(self):
+        video_input = ["-f", "mpegts", "-i", "pipe:0"]
+        audio_input = ["-i", self.audio_path]
+        offset = f"{abs(self.sync_adjust_ms) / 1000.0}"
+        if self.sync_adjust_ms > 0:
+            audio_input = ["-itsoffset", offset] + audio_input
+        elif self.sync_adjust_ms < 0:
+            video_input = ["-itsoffset", offset] + video_input
+        faststart = ["-movflags", "+faststart"] if os.environ.get("KLING_STREAM_FASTSTART", "0") == "1" else []
+        cmd = (["ffmpeg", "-y", "-v", "error"] + video_input + audio_input +
+               ["-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac", "-shortest"] +
+               faststart + [self.output_path])
+        logger.info(f"启动流式合并: {' '.join(cmd)}")
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE)
+        self.stderr = StderrDrain(self.process.stderr)
+
+    def add(self, source, offset_seconds, copy_to=None):
+        """
+        把一个片段（URL或本地文件）转成MPEG-TS写入合并进程，返回是否成功；失败后合并不能再继续
+        传入copy_to时同一个进程把片段原样另存为mp4（用于片段缓存）
+        """
+        if self.error:
+            return False
+        cmd = ["ffmpeg", "-y", "-v", "error"]
+        if "://" in source:
+            timeout = float(os.environ.get("KLING_STREAM_READ_TIMEOUT", DEFAULT_READ_TIMEOUT))
+            cmd += ["-rw_timeout", str(int(timeout * 1000000))]
+        cmd += ["-i", source, "-map", "0:v", "-c:v", "copy",
+                "-output_ts_offset", f"{offset_seconds}", "-f", "mpegts", "pipe:1"]
+        if copy_to:
+            cmd += ["-map", "0", "-c", "copy", "-f", "mp4", copy_to]
+        start = time.perf_counter()
+        written = 0
+        remux = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        remux_stderr = StderrDrain(remux.stderr)
+        try:
+            with metrics.FFMPEG_DURATION.time(step="stream_segment"):
+                for chunk in iter(lambda: remux.stdout.read(CHUNK_SIZE), b""):
+                    cancellation.check()
+                    self.process.stdin.write(chunk)
+                    written += len(chunk)
+                remux.wait()
+        except BaseException:
+            remux.kill()
+            remux.wait()
+            raise
+        finally:
+            remux.stdout.close()
+
+        if remux.returncode != 0:
+            self.error = f"片段转换失败: {source} {remux_stderr.text()}"
+            logger.error(self.error)
+            return False
+        self.segments += 1
+        self.bytes += written
+        metrics.record_download("video", written, time.perf_counter() - start)
+        logger.info(f"片段已送入合并进程: {source}（偏移 {offset_seconds:.2f} 秒，{written / 1048576:.1f} MB）")
+        return True
+
+    def skip(self, offset_seconds, duration):
+        """记录一个没有视频的片段，输出中该时间段留空"""
+        self.gaps.append((offset_seconds, offset_seconds + duration))
+
+    def finish(self):
+        """关闭输入并等待合并进程写完，返回是否成功；有片段转换失败时返回失败"""
+        if self.error:
+            self.abort()
+            return False
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        while True:
+            try:
+                self.process.wait(timeout=cancellation.CHECK_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                cancellation.check()
+        if self.process.returncode != 0:
+            logger.error(f"流式合并失败: {self.stderr.text()}")
+            self._remove_output()
+            return False
+        if self.gaps:
+            logger.warning(f"输出视频中有 {len(self.gaps)} 处空缺（片段失败）: "
+                           f"{', '.join(f'{start:g}-{end:g}秒' for start, end in self.gaps)}")
+        logger.info(f"流式合并完成: {self.output_path}，共 {self.segments} 个片段")
+        return self.segments > 0
+
+    def abort(self):
+        """结束合并进程并删除写了一半的输出文件"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+            self._remove_output()
+
+    def _remove_output(self):
+        try:
+            os.remove(self.output_path)
+        except OSError:
+            pass
@@ -0,0 +1,323 @@
+import os
+import time
+import threading
+import concurrent.futures
+
+from . import api_client, cancellation, metrics
+from .log import get_logger, task_context, LazyJSON
+
+logger = get_logger("task_tracker")
+
+
+# 后台轮询配置
+# KLING_POLL_INTERVAL: 每个任务两次查询之间的间隔（秒）
+# KLING_POLL_INITIAL_DELAY: 提交后第一次查询前的等待时间（秒）
+# KLING_POLL_WORKERS: 并行查询的线程数
+# KLING_BULK_POLL_MIN: 同一接口同一账号到期任务数达到此值时改用任务列表接口批量查询，0表示关闭
+# KLING_LIST_PAGE_SIZE / KLING_LIST_MAX_PAGES: 批量查询每页任务数和每轮最多翻页数
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_INITIAL_DELAY = 5.0
+DEFAULT_POLL_WORKERS = 4
+DEFAULT_BULK_POLL_MIN = 3
+DEFAULT_LIST_PAGE_SIZE = 100
+DEFAULT_LIST_MAX_PAGES = 3
+# 列表按创建时间倒序，翻到比最早的待查任务还早这么多秒的任务时停止翻页
+LIST_CREATED_SLACK_SECONDS = 60
+
+# 节点之间传递任务句柄使用的自定义类型
+TASK_HANDLE_TYPE = "KLING_TASK"
+
+# 提交端点对应的查询端点
+QUERY_ENDPOINTS = {
+    "/v1/videos/text2video": "/v1/videos/text2video/{}",
+    "/v1/videos/image2video": "/v1/videos/image2video/{}",
+    "/v1/videos/multi-image2video": "/v1/videos/multi-image2video/{}",
+    "/v1/videos/lip-sync": "/v1/videos/lip-sync/{}",
+    "/v1/images/generations": "/v1/images/generations/{}",
+    "/v1/images/multi-image2image": "/v1/images/multi-image2image/{}",
+}
+
+
+class TaskHandle:
+    """
+    提交任务后立即返回的任务句柄
+    后台轮询线程负责更新状态，等待节点通过wait()获取结果
+    """
+
+    def __init__(self, task_id, endpoint, api_token, task_type, model="", mode="",
+                 poll_interval=None, initial_delay=None):
+        self.task_id = task_id
+        self.endpoint = endpoint
+        self.api_token = api_token
+        self.task_type = task_type
+        self.model = model
+        self.mode = mode
+        # 为空时使用轮询器的默认值
+        self.poll_interval = poll_interval
+        self.initial_delay = initial_delay
+        self.submitted_at = time.time()
+        self.status = "submitted"
+        self.error = ""
+        self.data = {}
+        self.polls = 0
+        self.next_poll_at = 0.0
+        self.done = threading.Event()
+        self.callbacks = []
+        self.callbacks_lock = threading.Lock()
+
+    @classmethod
+    def failed(cls, message, task_type="", endpoint=""):
+        """提交失败时返回的句柄，等待节点会直接得到错误信息"""
+        handle = cls("", endpoint, "", task_type)
+        handle.finish("failed", error=message)
+        return handle
+
+    def finish(self, status, data=None, error=""):
+        # 所有结束路径（成功、失败、401/404）都在这里结束任务指标，in-flight和耗时统计不会漏记
+        metrics.task_finished(self.task_id, status)
+        self.status = status
+        self.data = data or self.data
+        self.error = error
+        with self.callbacks_lock:
+            self.done.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def add_done_callback(self, callback):
+        """任务结束时调用callback(handle)，已结束时立即调用"""
+        with self.callbacks_lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception as e:
+            logger.error(f"任务结束回调出错: {e}")
+
+    def wait(self, timeout=None):
+        # 等待期间响应ComfyUI的取消
+        return cancellation.wait(self.done, timeout)
+
+    @property
+    def query_url(self):
+        return f"{api_client.api_base()}{QUERY_ENDPOINTS[self.endpoint].format(self.task_id)}"
+
+    def result_urls(self):
+        """成功任务的全部结果，返回 [(url, id), ...]"""
+        task_result = self.data.get("task_result", {})
+        if "images" in task_result:
+            return [(image.get("url", ""), str(image.get("index", i)))
+                    for i, image in enumerate(task_result.get("images", [])) if image.get("url")]
+        return [(video.get("url", ""), video.get("id", ""))
+                for video in task_result.get("videos", []) if video.get("url")]
+
+    def __repr__(self):
+        return f"<KLingTask {self.task_type}:{self.task_id or '-'} {self.status}>"
+
+
+class TaskTracker:
+    """
+    后台任务轮询器
+    所有已提交任务由一个调度线程统一轮询，执行节点不再需要在ComfyUI执行线程里sleep
+    """
+
+    def __init__(self, poll_interval=None, initial_delay=None, workers=None):
+        self.poll_interval = float(poll_interval or os.environ.get("KLING_POLL_INTERVAL", DEFAULT_POLL_INTERVAL))
+        self.initial_delay = float(initial_delay if initial_delay is not None
+                                   else os.environ.get("KLING_POLL_INITIAL_DELAY", DEFAULT_INITIAL_DELAY))
+        self.workers = int(workers or os.environ.get("KLING_POLL_WORKERS", DEFAULT_POLL_WORKERS))
+        self.bulk_min = int(os.environ.get("KLING_BULK_POLL_MIN", DEFAULT_BULK_POLL_MIN))
+        self.list_page_size = int(os.environ.get("KLING_LIST_PAGE_SIZE", DEFAULT_LIST_PAGE_SIZE))
+        self.list_max_pages = int(os.environ.get("KLING_LIST_MAX_PAGES", DEFAULT_LIST_MAX_PAGES))
+        # 不支持列表查询的接口，之后只用逐个查询
+        self.bulk_unsupported = set()
+        self.handles = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.executor = None
+
+    def track(self, handle):
+        """登记任务并确保后台轮询线程已启动，返回handle；任务同时记为当前节点的任务"""
+        if handle.done.is_set() or not handle.task_id:
+            return handle
+        cancellation.own(handle)
+        initial_delay = handle.initial_delay if handle.initial_delay is not None else self.initial_delay
+        handle.next_poll_at = time.time() + initial_delay
+        with self.lock:
+            self.handles[handle.task_id] = handle
+            if self.thread is None or not self.thread.is_alive():
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="kling-poll")
+                self.thread = threading.Thread(target=self._run, name="kling-task-tracker", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return handle
+
+    def pending(self):
+        with self.lock:
+            return [handle for handle in self.handles.values() if not handle.done.is_set()]
+
+    def _run(self):
+        while True:
+            now = time.time()
+            pending = self.pending()
+            due = [handle for handle in pending if handle.next_poll_at <= now]
+            if due:
+                self._poll_due(due, pending)
+                continue
+
+            with self.lock:
+                # 清理已完成的任务
+                for task_id in [t for t, h in self.handles.items() if h.done.is_set()]:
+                    del self.handles[task_id]
+                if not self.handles:
+                    self.thread = None
+                    self.executor.shutdown(wait=False)
+                    return
+
+            if not pending:
+                continue
+            next_due = min(handle.next_poll_at for handle in pending)
+            self.wakeup.clear()
+            self.wakeup.wait(max(0.05, next_due - time.time()))
+
+    def _poll_due(self, due, pending):
+        """
+        到期任务按接口和账号分组，任务较多的组先用列表接口批量刷新，
+        列表中没有找到的任务再逐个查询
+        批量查询时顺带刷新同组在半个轮询间隔内即将到期的任务，使各任务的查询时间对齐
+        """
+        groups = {}
+        for handle in due:
+            groups.setdefault((handle.endpoint, handle.api_token), []).append(handle)
+
+        stragglers = []
+        for (endpoint, api_token), handles in groups.items():
+            if self.bulk_min and endpoint not in self.bulk_unsupported:
+                window = time.time() + self.poll_interval / 2
+                batch = [handle for handle in pending if handle.endpoint == endpoint
+                         and handle.api_token == api_token and handle.next_poll_at <= window]
+                if len(batch) >= self.bulk_min:
+                    stragglers.extend(self._poll_list(endpoint, api_token, batch))
+                    continue
+            stragglers.extend(handles)
+        if stragglers:
+            list(self.executor.map(self._poll, stragglers))
+
+    def _poll_list(self, endpoint, api_token, handles):
+        """通过分页任务列表接口一次刷新多个任务，返回列表中未找到的任务"""
+        now = time.time()
+        for handle in handles:
+            handle.next_poll_at = now + (handle.poll_interval or self.poll_interval)
+        remaining = {handle.task_id: handle for handle in handles}
+        oldest = min(handle.submitted_at for handle in handles)
+        url = f"{api_client.api_base()}{endpoint}"
+
+        for page in range(1, self.list_max_pages + 1):
+            try:
+                response = api_client.get(url, headers=self._headers(api_token), timeout=30,
+                                          params={"pageNum": page, "pageSize": self.list_page_size})
+                response_data = response.json()
+            except Exception as e:
+                logger.warning("批量查询任务状态出错，改为逐个查询: %s", e)
+                break
+            if response.status_code != 200:
+                if response.status_code in (400, 404, 405):
+                    self.bulk_unsupported.add(endpoint)
+                    logger.info("接口 %s 不支持任务列表查询，之后改为逐个查询", endpoint)
+                else:
+                    logger.warning("批量查询任务状态错误: %s", response_data.get("message", "未知错误"))
+                break
+
+            items = response_data.get("data") or []
+            for data in items:
+                handle = remaining.pop(data.get("task_id"), None)
+                if handle is not None:
+                    handle.polls += 1
+                    with task_context(f"task={handle.task_id}"):
+                        self._apply(handle, data)
+            if not remaining or len(items) < self.list_page_size:
+                break
+            created = [item.get("created_at") for item in items if item.get("created_at")]
+            if created and min(created) / 1000 < oldest - LIST_CREATED_SLACK_SECONDS:
+                break
+
+        logger.debug("批量查询 %s: %s 个任务，%s 个需要逐个查询", endpoint, len(handles), len(remaining))
+        return list(remaining.values())
+
+    @staticmethod
+    def _headers(api_token):
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_token.strip()}",
+        }
+
+    def _poll(self, handle):
+        with task_context(f"task={handle.task_id}"):
+            handle.next_poll_at = time.time() + (handle.poll_interval or self.poll_interval)
+            handle.polls += 1
+            try:
+                # 其他节点刚查询过同一任务时直接使用其结果
+                response = api_client.get_status(handle.query_url, headers=self._headers(handle.api_token),
+                                                 poll_interval=handle.poll_interval or self.poll_interval, timeout=30)
+                response_data = response.json()
+            except api_client.CircuitOpenError as e:
+                # 熔断期间跳过本次查询，打开时间过后的查询作为试探请求
+                logger.debug("跳过查询: %s", e)
+                return
+            except Exception as e:
+                logger.warning("查询任务状态出错，稍后重试: %s", e)
+                api_client.record_retry(handle.query_url, "network_error")
+                return
+
+            if response.status_code == 429:
+                logger.info("查询被限流，稍后重试")
+                return
+            if response.status_code != 200:
+                message = response_data.get("message", "未知错误")
+                if response.status_code in (401, 404):
+                    handle.finish("failed", error=f"查询任务失败: {message} (错误码: {response_data.get('code')})")
+                    logger.error(handle.error)
+                else:
+                    logger.warning("查询任务状态错误: %s，稍后重试", message)
+                return
+
+            self._apply(handle, response_data.get("data", {}))
+
+    def _apply(self, handle, data):
+        """根据查询到的任务数据更新句柄状态"""
+        status = data.get("task_status", "")
+        handle.status = status or handle.status
+        handle.data = data
+        logger.debug("任务状态: %s, 数据: %s", status, LazyJSON(data))
+
+        if status == "succeed":
+            logger.info("任务完成，耗时 %.1f 秒", time.time() - handle.submitted_at)
+            handle.finish(status, data)
+        elif status == "failed":
+            handle.finish(status, data, error=f"任务失败: {data.get('task_status_msg', '未知错误')}")
+            logger.error(handle.error)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    """获取全局任务轮询器"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = TaskTracker()
+        return _tracker
+
+
+def track_task(task_id, endpoint, api_token, task_type, model="", mode="", poll_interval=None, initial_delay=None):
+    """为刚提交的任务创建句柄并交给后台轮询"""
+    return get_tracker().track(TaskHandle(task_id, endpoint, api_token, task_type, model, mode,
+                                          poll_interval, initial_delay))
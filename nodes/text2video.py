@@ -1,6 +1,11 @@
-import json
 import random
-import requests
+
+from . import api_client, cancellation, metrics, preflight, profiler
+from .admission import get_admission, post_task
+from .log import get_logger, LazyJSON
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+logger = get_logger("text2video")
 
 
 class KLingAIText2Video:
@@ -10,7 +15,7 @@ class KLingAIText2Video:
     """
     
     def __init__(self):
-        self.api_base = "https://api.klingai.com"
+        self.api_base = api_client.api_base()
         self.endpoint = "/v1/videos/text2video"
         
     @classmethod
@@ -48,11 +53,13 @@ class KLingAIText2Video:
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT")
-    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed")
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "INT", TASK_HANDLE_TYPE, "STRING")
+    RETURN_NAMES = ("task_id", "task_status", "created_at", "updated_at", "seed", "task", "timings")
     FUNCTION = "create_video_task"
     CATEGORY = "JM-KLingAI-API/text-2-video"
 
+    @profiler.profiled("text2video")
+    @cancellation.interruptible("text2video")
     def create_video_task(self, api_token, prompt, model_name="kling-v1", 
                          negative_prompt="", cfg_scale=0.5, mode="std",
                          aspect_ratio="16:9", duration="5", seed=-1):
@@ -63,10 +70,8 @@ class KLingAIText2Video:
             # Validate inputs
             if not api_token:
                 raise ValueError("API token is required")
-            if not prompt or len(prompt) > 2500:
-                raise ValueError("Prompt is required and cannot exceed 2500 characters")
-            if negative_prompt and len(negative_prompt) > 2500:
-                raise ValueError("Negative prompt cannot exceed 2500 characters")
+            preflight.check(self.endpoint, model_name, prompt=prompt, negative_prompt=negative_prompt,
+                            cfg_scale=cfg_scale, duration=duration)
 
             # Generate random seed if not provided or -1 (only for local use)
             if seed == -1:
@@ -91,15 +96,15 @@ class KLingAIText2Video:
 
             # Make API request
             url = f"{self.api_base}{self.endpoint}"
-            print(f"Making request to: {url}")
-            print(f"With payload: {json.dumps(payload, indent=2)}")
-            print(f"Using local seed: {seed} (not sent to API)")
+            logger.info(f"Making request to: {url}")
+            logger.debug("With payload: %s", LazyJSON(payload))
+            logger.info(f"Using local seed: {seed} (not sent to API)")
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = post_task(url, headers=headers, json=payload)
             response_data = response.json()
             
-            print(f"Response status: {response.status_code}")
-            print(f"Response data: {json.dumps(response_data, indent=2)}")
+            logger.info(f"Response status: {response.status_code}")
+            logger.debug("Response data: %s", LazyJSON(response_data))
 
             # Check for errors and provide detailed error messages
             if response.status_code != 200:
@@ -118,15 +123,19 @@ class KLingAIText2Video:
             if not task_id:
                 raise Exception("No task ID received from API")
 
-            print(f"Successfully created video task with ID: {task_id} (local seed: {seed})")
-            return (task_id, task_status, created_at, updated_at, seed)
+            metrics.task_submitted(task_id, "text2video", model_name, mode)
+            profiler.annotate(task_id=task_id)
+            task = track_task(task_id, self.endpoint, api_token, "text2video", model_name, mode)
+            get_admission().attach(task)
+            logger.info(f"Successfully created video task with ID: {task_id} (local seed: {seed})")
+            return (task_id, task_status, created_at, updated_at, seed, task)
 
         except ValueError as ve:
-            print(f"Validation Error: {str(ve)}")
-            return (f"Error: {str(ve)}", "failed", "", "", seed)
+            logger.error(f"Validation Error: {str(ve)}")
+            return (f"Error: {str(ve)}", "failed", "", "", seed, TaskHandle.failed(str(ve)))
         except Exception as e:
-            print(f"Error creating video task: {str(e)}")
-            return (f"Error: {str(e)}", "failed", "", "", seed)
+            logger.error(f"Error creating video task: {str(e)}")
+            return (f"Error: {str(e)}", "failed", "", "", seed, TaskHandle.failed(str(e)))
 
     def IS_CHANGED(self, api_token, prompt, model_name="kling-v1", 
                   negative_prompt="", cfg_scale=0.5, mode="std",
@@ -0,0 +1,199 @@
+import json
+import time
+import concurrent.futures
+
+from . import api_client, cancellation, metrics, preflight, profiler, progress
+from .admission import PRIORITY_BATCH, get_admission, submit_task
+from .log import get_logger, task_context
+from .task_tracker import TASK_HANDLE_TYPE, TaskHandle, track_task
+
+logger = get_logger("text2video_batch")
+
+# 每行可以覆盖的参数
+ROW_OVERRIDES = ("model_name", "mode", "aspect_ratio", "duration", "negative_prompt", "cfg_scale")
+
+
+def parse_prompt_rows(prompts):
+    """
+    解析批量提示词，每行一个任务
+    普通文本行作为prompt；以{开头的行按JSON解析，可包含prompt以及model_name/mode/aspect_ratio/duration等覆盖参数
+    """
+    rows = []
+    for line in prompts.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {"prompt": "", "parse_error": f"JSON解析失败: {e}"}
+        else:
+            row = {"prompt": line}
+        rows.append(row)
+    return rows
+
+
+class KLingAIText2VideoBatch:
+    """
+    KLingAI Text to Video Batch Node
+    批量提交文生视频任务：在共享限流和并发额度下并发提交，按输入顺序返回列表结果
+    """
+
+    def __init__(self):
+        self.endpoint = "/v1/videos/text2video"
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "api_token": ("STRING", {"default": "", "multiline": False}),
+                "prompts": ("STRING", {
+                    "default": "",
+                    "multiline": True,
+                    "placeholder": "每行一个提示词，或每行一个JSON: {\"prompt\": \"...\", \"duration\": \"10\"}"
+                }),
+            },
+            "optional": {
+                "prompt_list": ("STRING", {"forceInput": True}),
+                "model_name": (["kling-v1", "kling-v1-6"], {"default": "kling-v1"}),
+                "negative_prompt": ("STRING", {"default": "", "multiline": True}),
+                "cfg_scale": ("FLOAT", {"default": 0.5, "min": 0.0, "max": 1.0, "step": 0.1}),
+                "mode": (["std", "pro"], {"default": "std"}),
+                "aspect_ratio": (["16:9", "9:16", "1:1"], {"default": "16:9"}),
+                "duration": (["5", "10"], {"default": "5"}),
+                "max_concurrency": ("INT", {"default": 4, "min": 1, "max": 32}),
+                "wait_for_results": ("BOOLEAN", {"default": True}),
+                "timeout_seconds": ("INT", {"default": 3600, "min": 60, "max": 86400, "step": 60}),
+            }
+        }
+
+    # 列表输入：prompt_list可以连接其他节点输出的字符串列表
+    INPUT_IS_LIST = True
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", TASK_HANDLE_TYPE, "STRING", "STRING")
+    RETURN_NAMES = ("task_ids", "video_urls", "video_ids", "statuses", "tasks", "errors_json", "timings")
+    OUTPUT_IS_LIST = (True, True, True, True, True, False, False)
+    FUNCTION = "create_video_tasks"
+    CATEGORY = "JM-KLingAI-API/text-2-video"
+
+    def build_rows(self, prompts, prompt_list, defaults):
+        rows = parse_prompt_rows(prompts)
+        rows.extend({"prompt": prompt} for prompt in prompt_list if prompt and prompt.strip())
+        for row in rows:
+            for key in ROW_OVERRIDES:
+                row.setdefault(key, defaults[key])
+        return rows
+
+    def submit_row(self, api_token, index, row):
+        """提交单行任务，返回任务句柄，失败时返回失败句柄和结构化错误"""
+        with task_context(f"batch#{index}"):
+            if row.get("parse_error"):
+                return TaskHandle.failed(row["parse_error"], "text2video", self.endpoint), {"message": row["parse_error"]}
+            prompt = row.get("prompt", "")
+            problems = preflight.validate(self.endpoint, row["model_name"], prompt=prompt,
+                                          negative_prompt=row["negative_prompt"], cfg_scale=row["cfg_scale"],
+                                          duration=row["duration"])
+            if problems:
+                message = "；".join(problems)
+                return TaskHandle.failed(message, "text2video", self.endpoint), {"message": message}
+
+            payload = {
+                "model_name": row["model_name"],
+                "prompt": prompt,
+                "negative_prompt": row["negative_prompt"],
+                "cfg_scale": float(row["cfg_scale"]),
+                "mode": row["mode"],
+                "aspect_ratio": row["aspect_ratio"],
+                "duration": str(row["duration"]),
+            }
+
+            admission = get_admission()
+            try:
+                admission.acquire(priority=PRIORITY_BATCH, url=f"{api_client.api_base()}{self.endpoint}")
+            except api_client.CircuitOpenError as e:
+                logger.error(f"提交失败: {e}")
+                return TaskHandle.failed(str(e), "text2video", self.endpoint), e.to_dict()
+            try:
+                data = submit_task(self.endpoint, api_token, payload)
+            except api_client.KLingAPIError as e:
+                admission.release()
+                logger.error(f"提交失败: {e}")
+                return TaskHandle.failed(str(e), "text2video", self.endpoint), e.to_dict()
+            except Exception as e:
+                admission.release()
+                logger.error(f"提交失败: {e}")
+                return TaskHandle.failed(str(e), "text2video", self.endpoint), {"message": str(e)}
+            except cancellation.Cancelled:
+                admission.release()
+                raise
+
+            task_id = data["task_id"]
+            metrics.task_submitted(task_id, "text2video", row["model_name"], row["mode"])
+            handle = track_task(task_id, self.endpoint, api_token, "text2video", row["model_name"], row["mode"])
+            admission.attach(handle)
+            logger.info(f"已提交任务: {task_id}")
+            return handle, None
+
+    @profiler.profiled("text2video_batch")
+    @cancellation.interruptible("text2video_batch")
+    @progress.reporting("text2video_batch")
+    def create_video_tasks(self, api_token, prompts, prompt_list=None, model_name=None, negative_prompt=None,
+                           cfg_scale=None, mode=None, aspect_ratio=None, duration=None, max_concurrency=None,
+                           wait_for_results=None, timeout_seconds=None):
+        # INPUT_IS_LIST时所有输入都是列表，普通参数取第一个值
+        def first(value, default):
+            return value[0] if value else default
+
+        api_token = first(api_token, "")
+        defaults = {
+            "model_name": first(model_name, "kling-v1"),
+            "negative_prompt": first(negative_prompt, ""),
+            "cfg_scale": first(cfg_scale, 0.5),
+            "mode": first(mode, "std"),
+            "aspect_ratio": first(aspect_ratio, "16:9"),
+            "duration": first(duration, "5"),
+        }
+        rows = self.build_rows(first(prompts, ""), prompt_list or [], defaults)
+        max_concurrency = first(max_concurrency, 4)
+        wait_for_results = first(wait_for_results, True)
+        timeout_seconds = first(timeout_seconds, 3600)
+
+        if not api_token or not rows:
+            message = "API令牌不能为空" if not api_token else "没有有效的提示词"
+            logger.error(message)
+            return ([], [], [], [], [], json.dumps([{"index": None, "message": message}], ensure_ascii=False))
+
+        logger.info(f"批量提交 {len(rows)} 个文生视频任务，并发数: {max_concurrency}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            submitted = list(executor.map(profiler.bind(lambda item: self.submit_row(api_token, *item)), enumerate(rows)))
+
+        handles = [handle for handle, _ in submitted]
+        if wait_for_results:
+            deadline = time.time() + timeout_seconds
+            with profiler.phase("server_wait"):
+                pending = list(handles)
+                while pending and time.time() < deadline:
+                    progress.report_tasks(handles)
+                    # 等待任意一个未完成的任务，最多1秒后更新进度
+                    pending[0].wait(min(1.0, max(0.0, deadline - time.time())))
+                    pending = [handle for handle in pending if not handle.done.is_set()]
+
+        task_ids, video_urls, video_ids, statuses, errors = [], [], [], [], []
+        for index, (handle, error) in enumerate(submitted):
+            results = handle.result_urls() if handle.status == "succeed" else []
+            task_ids.append(handle.task_id)
+            video_urls.append(results[0][0] if results else "")
+            video_ids.append(results[0][1] if results else "")
+            statuses.append(handle.status)
+            if error is None and handle.done.is_set() and handle.status != "succeed":
+                error = {"message": handle.error or handle.status}
+            if error is not None:
+                errors.append(dict(error, index=index, prompt=rows[index].get("prompt", ""), task_id=handle.task_id))
+
+        logger.info(f"批量任务完成: 成功 {statuses.count('succeed')} 个，失败 {len(errors)} 个，共 {len(rows)} 个")
+        return (task_ids, video_urls, video_ids, statuses, handles, json.dumps(errors, ensure_ascii=False))
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # 每次执行都会产生新的付费任务，提示词不变时也不缓存
+        return time.time()
@@ -1,11 +1,18 @@
 import os
 import re
 import glob
-import requests
 from pathlib import Path
-import folder_paths
 import time
-import json
+
+from . import api_client, cancellation, previews, profiler, progress
+from .lazy_import import lazy_module
+from .log import get_logger, LazyJSON
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+requests = lazy_module("requests")
+folder_paths = lazy_module("folder_paths")
+
+logger = get_logger("video_downloader")
 
 
 class KLingAIVideoDownloader:
@@ -38,12 +45,12 @@ class KLingAIVideoDownloader:
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING",)
-    RETURN_NAMES = ("video_path", "video_url",)
+    RETURN_TYPES = ("STRING", "STRING", "STRING")
+    RETURN_NAMES = ("video_path", "video_url", "timings")
     FUNCTION = "download_video"
     CATEGORY = "JM-KLingAI-API"
     OUTPUT_NODE = True  # 标记为可作为终端节点的节点
-    OUTPUT_IS_LIST = (False, False,)  # 指示输出不是列表
+    OUTPUT_IS_LIST = (False, False, False)  # 指示输出不是列表
 
     def get_next_sequence_number(self, directory, filename_prefix):
         """
@@ -70,6 +77,9 @@ class KLingAIVideoDownloader:
         Path(directory).mkdir(parents=True, exist_ok=True)
         return directory
 
+    @profiler.profiled("video_downloader")
+    @cancellation.interruptible("video_downloader")
+    @progress.reporting("video_downloader")
     def download_video(self, video_url, filename_prefix="KLingAI", custom_output_dir=""):
         """
         Download video from URL and save to local directory
@@ -78,7 +88,7 @@ class KLingAIVideoDownloader:
             # 在实际执行时验证输入
             if video_url is None or (isinstance(video_url, str) and not video_url.strip()):
                 error_msg = "视频URL不能为空"
-                print(error_msg)
+                logger.error(error_msg)
                 return (error_msg, video_url)
                 
             if not filename_prefix:
@@ -96,17 +106,10 @@ class KLingAIVideoDownloader:
             filepath = os.path.join(output_dir, filename)
 
             # Download video
-            print(f"正在从 {video_url} 下载视频")
-            response = requests.get(video_url, stream=True)
-            response.raise_for_status()
+            logger.info(f"正在从 {video_url} 下载视频")
+            api_client.download_to_file(video_url, filepath, "video")
 
-            # Save video
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-
-            print(f"视频成功下载到: {filepath}")
+            logger.info(f"视频成功下载到: {filepath}")
             
             # 为了确保在历史记录中显示，创建预览信息
             self.save_video_preview_info(filepath)
@@ -115,50 +118,26 @@ class KLingAIVideoDownloader:
 
         except ValueError as ve:
             error_msg = f"参数错误: {str(ve)}"
-            print(error_msg)
+            logger.error(error_msg)
             return (error_msg, video_url)  # 返回错误消息而不是None
         except requests.exceptions.RequestException as re:
             error_msg = f"下载错误: {str(re)}"
-            print(error_msg)
+            logger.error(error_msg)
             return (error_msg, video_url)  # 返回错误消息而不是None
         except Exception as e:
             error_msg = f"视频下载错误: {str(e)}"
-            print(error_msg)
+            logger.error(error_msg)
             return (error_msg, video_url)  # 返回错误消息而不是None
 
     def save_video_preview_info(self, filepath):
         """
-        保存视频预览信息以确保在历史记录中显示
+        登记视频预览信息以确保在历史记录中显示，由后台线程批量写入 .previews/index.jsonl
         """
         try:
-            # 获取相对路径以便在UI中正确显示
-            rel_path = os.path.relpath(filepath, start=self.default_output_dir)
-            file_info = {
-                "filename": os.path.basename(filepath),
-                "type": "video",
-                "subfolder": os.path.dirname(rel_path) if os.path.dirname(rel_path) else "",
-                "format": "video/mp4"
-            }
-            
-            # 获取文件大小
-            file_size = os.path.getsize(filepath)
-            file_info["size"] = f"{file_size / (1024 * 1024):.2f} MB"
-            
-            # 打印预览信息
-            print(f"视频文件信息: {json.dumps(file_info, ensure_ascii=False)}")
-            
-            # 尝试将信息写入预览文件
-            preview_dir = os.path.join(self.default_output_dir, ".previews")
-            if not os.path.exists(preview_dir):
-                os.makedirs(preview_dir, exist_ok=True)
-                
-            preview_file = os.path.join(preview_dir, f"{os.path.basename(filepath)}.json")
-            with open(preview_file, 'w', encoding='utf-8') as f:
-                json.dump(file_info, f, ensure_ascii=False, indent=2)
-                
-            print(f"已保存预览信息: {preview_file}")
+            file_info = previews.record(self.default_output_dir, filepath, "video", "video/mp4")
+            logger.debug("视频文件信息: %s", LazyJSON(file_info))
         except Exception as e:
-            print(f"保存预览信息出错 (不影响下载): {str(e)}")
+            logger.error(f"保存预览信息出错 (不影响下载): {str(e)}")
 
     # 确保节点可以在没有连接的情况下运行
     @classmethod
@@ -0,0 +1,206 @@
+import os
+import json
+import math
+import uuid
+import subprocess
+
+from . import api_client, cancellation, metrics, profiler, progress
+from .lazy_import import lazy_module
+from .log import get_logger
+from .stream_merge import StderrDrain
+
+# 重量级依赖延迟到首次执行时导入，保证ComfyUI启动速度
+folder_paths = lazy_module("folder_paths")
+torch = lazy_module("torch")
+np = lazy_module("numpy")
+
+logger = get_logger("video_frames")
+
+
+def probe_video(path):
+    """用ffprobe读取视频流的宽高、帧率和时长"""
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate,nb_frames,duration:format=duration",
+        "-of", "json", path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe读取视频失败: {result.stderr.strip()}")
+    info = json.loads(result.stdout)
+    stream = info["streams"][0]
+    num, _, den = stream.get("r_frame_rate", "0/1").partition("/")
+    fps = float(num) / float(den or 1) if float(den or 1) else 0.0
+    duration = float(stream.get("duration") or info.get("format", {}).get("duration") or 0)
+    return {
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "fps": fps,
+        "duration": duration,
+    }
+
+
+def output_size(width, height, target_width, target_height):
+    """计算输出尺寸，只指定一边时按比例缩放，结果取偶数"""
+    if target_width and target_height:
+        return target_width, target_height
+    if target_width:
+        return target_width, max(2, int(round(height * target_width / width / 2)) * 2)
+    if target_height:
+        return max(2, int(round(width * target_height / height / 2)) * 2), target_height
+    return width, height
+
+
+class KLingAIVideoFrames:
+    """
+    KLingAI Video Frames Node
+    通过ffmpeg管道流式解码视频帧，支持抽帧间隔、时间范围和目标分辨率
+    帧直接写入预分配（可选内存映射）的缓冲区，内存占用只取决于选中的帧
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "video_path": ("STRING", {"default": "", "multiline": False}),
+            },
+            "optional": {
+                "video_url": ("STRING", {
+                    "default": "",
+                    "multiline": False,
+                    "placeholder": "可选: video_path为空时先下载此URL"
+                }),
+                "frame_stride": ("INT", {"default": 1, "min": 1, "max": 1000}),
+                "start_time": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 3600.0, "step": 0.1}),
+                "end_time": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 3600.0, "step": 0.1}),
+                "width": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 2}),
+                "height": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 2}),
+                "max_frames": ("INT", {"default": 0, "min": 0, "max": 100000}),
+                "use_mmap": ("BOOLEAN", {"default": False}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "INT", "FLOAT", "STRING", "STRING")
+    RETURN_NAMES = ("frames", "frame_count", "fps", "video_path", "timings")
+    FUNCTION = "decode_frames"
+    CATEGORY = "JM-KLingAI-API"
+
+    def download(self, video_url):
+        """
+        下载video_url到ComfyUI输出目录，返回本地路径
+        直接调用下载函数而不是下载节点，避免多记一条性能日志和多出的timings输出
+        """
+        output_dir = folder_paths.get_output_directory()
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"KLingAI_frames_{uuid.uuid4().hex[:12]}.mp4")
+        logger.info(f"正在从 {video_url} 下载视频")
+        api_client.download_to_file(video_url, path, "video")
+        return path
+
+    def allocate(self, count, height, width, use_mmap):
+        """预分配float32帧缓冲区，内存映射模式下放在ComfyUI临时目录"""
+        shape = (count, height, width, 3)
+        if not use_mmap:
+            return np.empty(shape, dtype=np.float32)
+        temp_dir = folder_paths.get_temp_directory()
+        os.makedirs(temp_dir, exist_ok=True)
+        path = os.path.join(temp_dir, f"kling_frames_{uuid.uuid4().hex}.f32")
+        buffer = np.memmap(path, dtype=np.float32, mode="w+", shape=shape)
+        try:
+            # 映射建立后即可删除文件名，进程结束时空间自动回收（Windows上会失败，保留文件）
+            os.remove(path)
+        except OSError:
+            logger.debug("内存映射文件保留在: %s", path)
+        logger.info(f"使用内存映射缓冲区: {count} 帧 {width}x{height}")
+        return buffer
+
+    @profiler.profiled("video_frames")
+    @cancellation.interruptible("video_frames")
+    @progress.reporting("video_frames")
+    def decode_frames(self, video_path, video_url="", frame_stride=1, start_time=0.0, end_time=0.0,
+                      width=0, height=0, max_frames=0, use_mmap=False):
+        """
+        流式解码视频帧为IMAGE批次
+        """
+        try:
+            if not video_path and video_url:
+                video_path = self.download(video_url)
+            if not video_path or not os.path.isfile(video_path):
+                raise ValueError(f"视频文件不存在: {video_path}")
+            if end_time and end_time <= start_time:
+                raise ValueError("结束时间必须大于开始时间")
+
+            info = probe_video(video_path)
+            fps = info["fps"] or 24.0
+            out_width, out_height = output_size(info["width"], info["height"], width, height)
+            end = min(end_time, info["duration"]) if end_time and info["duration"] else (end_time or info["duration"])
+            span = max(0.0, end - start_time)
+
+            # 按时长估算帧数上限，多预留1帧应对时间戳取整
+            capacity = math.ceil(span * fps / frame_stride) + 1 if span else 1
+            if max_frames:
+                capacity = min(capacity, max_frames)
+            logger.info(f"解码视频: {video_path}，{info['width']}x{info['height']}@{fps:.2f}fps -> "
+                        f"{out_width}x{out_height}，间隔 {frame_stride} 帧，最多 {capacity} 帧")
+
+            filters = []
+            if frame_stride > 1:
+                filters.append(f"select=not(mod(n\\,{frame_stride}))")
+            if (out_width, out_height) != (info["width"], info["height"]):
+                filters.append(f"scale={out_width}:{out_height}")
+            cmd = ["ffmpeg", "-v", "error"]
+            if start_time:
+                cmd += ["-ss", str(start_time)]
+            cmd += ["-i", video_path]
+            if end_time:
+                cmd += ["-t", str(span)]
+            if filters:
+                cmd += ["-vf", ",".join(filters)]
+            cmd += ["-vsync", "0", "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+
+            buffer = self.allocate(capacity, out_height, out_width, use_mmap)
+            frame = np.empty((out_height, out_width, 3), dtype=np.uint8)
+            frame_bytes = memoryview(frame).cast("B")
+            count = 0
+            with metrics.FFMPEG_DURATION.time(step="decode_frames"), profiler.phase("decode"):
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                # stderr在后台线程读取：损坏的输入会让ffmpeg写出大量错误，管道写满后ffmpeg阻塞，stdout读取随之卡住
+                stderr = StderrDrain(process.stderr)
+                try:
+                    while count < capacity:
+                        cancellation.check()
+                        # 逐帧读入复用的uint8缓冲区，再写入预分配的float32输出
+                        read = 0
+                        while read < len(frame_bytes):
+                            n = process.stdout.readinto(frame_bytes[read:])
+                            if not n:
+                                break
+                            read += n
+                        if read < len(frame_bytes):
+                            break
+                        np.multiply(frame, 1.0 / 255.0, out=buffer[count], casting="unsafe")
+                        count += 1
+                        progress.update(count, capacity, text=f"decode {count}/{capacity}")
+                finally:
+                    process.stdout.close()
+                    if process.poll() is None:
+                        process.kill()
+                    process.wait()
+            if count == 0:
+                raise RuntimeError(f"未解码到任何帧: {stderr.text().strip()}")
+
+            frames = torch.from_numpy(buffer[:count])
+            logger.info(f"解码完成: {count} 帧，张量形状: {tuple(frames.shape)}")
+            return (frames, count, fps / frame_stride, video_path)
+
+        except Exception as e:
+            logger.error(f"解码视频帧错误: {str(e)}")
+            return (torch.zeros((1, 64, 64, 3), dtype=torch.float32), 0, 0.0, f"错误: {str(e)}")
+
+    @classmethod
+    def IS_CHANGED(cls, video_path, video_url="", frame_stride=1, start_time=0.0, end_time=0.0,
+                   width=0, height=0, max_frames=0, use_mmap=False):
+        # 文件内容变化时重新解码
+        if video_path and os.path.isfile(video_path):
+            return f"{video_path}:{os.path.getmtime(video_path)}"
+        return video_url
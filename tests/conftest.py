@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+# 测试不写性能日志
+os.environ.setdefault("KLING_PERF_LOG", "0")
+
+
+@pytest.fixture
+def simulator(monkeypatch):
+    """
+    启动本地KLing API模拟服务并把节点指向它，返回启动函数：simulator(**SimulatorConfig参数)
+    轮询、限流和并发额度的全局单例在每个测试中重新创建，读取这里设置的环境变量
+    """
+    pytest.importorskip("requests")
+    from nodes import admission, circuit_breaker, task_tracker
+    from nodes.simulator import KLingSimulator, SimulatorConfig
+
+    monkeypatch.setenv("KLING_SUBMIT_RPS", "0")
+    monkeypatch.setenv("KLING_BULK_POLL_MIN", "0")
+    monkeypatch.setenv("KLING_POLL_INTERVAL", "0.2")
+    monkeypatch.setenv("KLING_POLL_INITIAL_DELAY", "0")
+    monkeypatch.setattr(admission, "_admission", None)
+    monkeypatch.setattr(admission, "_submit_limiter", None)
+    monkeypatch.setattr(task_tracker, "_tracker", None)
+    monkeypatch.setattr(circuit_breaker, "_breakers", {})
+
+    started = []
+
+    def start(**config):
+        config.setdefault("require_auth", False)
+        config.setdefault("latency_ms", 5.0)
+        config.setdefault("latency_jitter_ms", 0.0)
+        config.setdefault("completion_seconds", 0.5)
+        config.setdefault("completion_sigma", 0.0)
+        config.setdefault("seed", 0)
+        sim = KLingSimulator(SimulatorConfig(**config))
+        sim.start()
+        started.append(sim)
+        monkeypatch.setenv("KLING_API_BASE", sim.base_url)
+        return sim
+
+    yield start
+    for sim in started:
+        sim.stop()
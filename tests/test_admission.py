@@ -0,0 +1,175 @@
+import threading
+import time
+
+import pytest
+
+from nodes import admission
+from nodes.admission import AdmissionController, AdmissionTimeout, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+
+def test_acquire_times_out_when_full():
+    controller = AdmissionController(2)
+    assert controller.acquire(timeout=0.1)
+    assert controller.acquire(timeout=0.1)
+    assert not controller.acquire(timeout=0.1)
+    assert controller.in_flight == 2
+    controller.release()
+    assert controller.acquire(timeout=0.1)
+
+
+def test_waiter_admitted_on_release():
+    controller = AdmissionController(1)
+    controller.acquire()
+    admitted = threading.Event()
+    thread = threading.Thread(target=lambda: controller.acquire(timeout=2) and admitted.set())
+    thread.start()
+    time.sleep(0.1)
+    assert not admitted.is_set()
+    controller.release()
+    thread.join()
+    assert admitted.is_set()
+    assert controller.in_flight == 1
+
+
+def test_interactive_priority_admitted_first():
+    controller = AdmissionController(1)
+    controller.acquire()
+    order = []
+
+    def wait(name, priority):
+        controller.acquire(timeout=2, priority=priority)
+        order.append(name)
+        controller.release()
+
+    batch = threading.Thread(target=wait, args=("batch", PRIORITY_BATCH))
+    batch.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=wait, args=("interactive", PRIORITY_INTERACTIVE))
+    interactive.start()
+    time.sleep(0.05)
+    controller.release()
+    batch.join()
+    interactive.join()
+    assert order == ["interactive", "batch"]
+
+
+def test_limit_lowers_capacity_and_waits_for_release():
+    controller = AdmissionController(4, recover_seconds=3600)
+    for _ in range(3):
+        controller.acquire()
+    threading.Timer(0.2, controller.release).start()
+    start = time.monotonic()
+    # 持有额度的一方收到1303：实际只容得下其他2个任务
+    controller.wait_after_limit(timeout=2)
+    assert 0.15 <= time.monotonic() - start < 1.5
+    assert controller.capacity == 2
+    assert controller.ceiling == 4
+
+
+def test_capacity_recovers_after_quiet_period():
+    controller = AdmissionController(3, recover_seconds=0)
+    for _ in range(3):
+        controller.acquire()
+    controller.wait_after_limit(timeout=0.01)
+    assert controller.capacity == 2
+    controller.release()
+    assert controller.capacity == 3
+    controller.release()
+    assert controller.capacity == 3
+
+
+def test_post_task_times_out_when_cap_stays_full(monkeypatch):
+    controller = AdmissionController(1)
+    controller.acquire()
+    monkeypatch.setattr(admission, "get_admission", lambda: controller)
+    monkeypatch.setenv("KLING_ADMISSION_WAIT_SECONDS", "0.2")
+    with pytest.raises(AdmissionTimeout, match="1/1"):
+        admission.post_task("http://127.0.0.1:1/v1/videos/text2video", json={})
+    assert controller.in_flight == 1
+
+
+def test_post_task_waits_out_1303(simulator, monkeypatch):
+    sim = simulator(max_concurrent_tasks=1, completion_seconds=0.3)
+    url = f"{sim.base_url}/v1/videos/text2video"
+    controller = AdmissionController(2, recover_seconds=3600)
+    monkeypatch.setattr(admission, "get_admission", lambda: controller)
+
+    first = admission.post_task(url, json={"prompt": "a"})
+    assert first.status_code == 200
+    # 第一个任务在可灵端结束后归还额度
+    threading.Timer(0.4, controller.release).start()
+    second = admission.post_task(url, json={"prompt": "b"})
+    assert second.status_code == 200
+    assert second.json()["data"]["task_id"]
+    assert sim.stats["concurrency_limited"] >= 1
+    assert controller.capacity == 1
+
+
+def test_post_task_returns_1303_after_deadline(simulator, monkeypatch):
+    sim = simulator(max_concurrent_tasks=1, completion_seconds=30)
+    url = f"{sim.base_url}/v1/videos/text2video"
+    controller = AdmissionController(2, recover_seconds=3600)
+    monkeypatch.setattr(admission, "get_admission", lambda: controller)
+    monkeypatch.setenv("KLING_ADMISSION_WAIT_SECONDS", "0.3")
+
+    assert admission.post_task(url, json={"prompt": "a"}).status_code == 200
+    response = admission.post_task(url, json={"prompt": "b"})
+    assert response.json()["code"] == admission.CODE_CONCURRENCY_LIMITED
+    # 没有创建出任务，额度已归还
+    assert controller.in_flight == 1
+
+
+def test_submit_task_retries_past_1303(simulator, monkeypatch):
+    sim = simulator(max_concurrent_tasks=1, completion_seconds=0.3)
+    controller = AdmissionController(2, recover_seconds=3600)
+    monkeypatch.setattr(admission, "get_admission", lambda: controller)
+    controller.acquire()
+    controller.acquire()
+
+    first = admission.submit_task("/v1/videos/text2video", "token", {"prompt": "a"})
+    threading.Timer(0.4, controller.release).start()
+    second = admission.submit_task("/v1/videos/text2video", "token", {"prompt": "b"})
+    assert first["task_id"] != second["task_id"]
+    assert sim.stats["concurrency_limited"] >= 1
+    assert sim.stats["submitted"] == 2
+
+
+def test_submit_task_gives_up_on_1303_after_deadline(simulator, monkeypatch):
+    from nodes import api_client
+
+    sim = simulator(max_concurrent_tasks=1, completion_seconds=30)
+    controller = AdmissionController(2, recover_seconds=3600)
+    monkeypatch.setattr(admission, "get_admission", lambda: controller)
+    monkeypatch.setenv("KLING_SUBMIT_LIMIT_WAIT_SECONDS", "0.3")
+
+    admission.submit_task("/v1/videos/text2video", "token", {"prompt": "a"})
+    start = time.monotonic()
+    with pytest.raises(api_client.KLingAPIError, match="KLING_SUBMIT_LIMIT_WAIT_SECONDS") as excinfo:
+        admission.submit_task("/v1/videos/text2video", "token", {"prompt": "b"})
+    assert excinfo.value.code == admission.CODE_CONCURRENCY_LIMITED
+    assert time.monotonic() - start < 2
+    assert sim.stats["submitted"] == 1
+
+
+def test_rate_limiter_spaces_submits():
+    limiter = admission.RateLimiter(10)
+    start = time.monotonic()
+    for _ in range(13):
+        limiter.wait()
+    # 桶内10个令牌立即可用，之后每0.1秒一个
+    assert 0.25 <= time.monotonic() - start < 0.6
+
+
+def test_rate_limiter_wait_is_cancellable():
+    from nodes import cancellation
+
+    # 桶内不足1个令牌，需要等待约9秒
+    limiter = admission.RateLimiter(0.1)
+    cancellation.cancel()
+    try:
+        start = time.monotonic()
+        with pytest.raises(cancellation.Cancelled):
+            limiter.wait()
+        assert time.monotonic() - start < 1
+    finally:
+        cancellation.reset()
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from nodes import cancellation, profiler
+from nodes.cancellation import Cancelled
+from nodes.task_tracker import TaskHandle
+
+
+class InterruptProcessingException(Exception):
+    pass
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    path = tmp_path / "journal.jsonl"
+    monkeypatch.setenv("KLING_TASK_JOURNAL", str(path))
+    yield path
+    cancellation.reset()
+
+
+@pytest.fixture
+def comfy(monkeypatch):
+    """ComfyUI的model_management替身，interrupted控制中断标志"""
+    state = SimpleNamespace(interrupted=False)
+    monkeypatch.setitem(sys.modules, "comfy.model_management", SimpleNamespace(
+        processing_interrupted=lambda: state.interrupted, InterruptProcessingException=InterruptProcessingException))
+    return state
+
+
+def read_journal(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def handle(task_id):
+    return TaskHandle(task_id, "/v1/videos/text2video", "token", "text2video")
+
+
+def test_wait_and_sleep_raise_when_cancelled(journal):
+    start = time.monotonic()
+    threading.Timer(0.1, cancellation.cancel).start()
+    with pytest.raises(Cancelled):
+        cancellation.sleep(5)
+    assert time.monotonic() - start < 1
+    cancellation.reset()
+    assert not cancellation.wait(threading.Event(), 0.01)
+
+
+def test_cancel_journals_owned_pending_tasks(journal):
+    done = TaskHandle.failed("bad prompt")
+    pending = handle("task-1")
+
+    @cancellation.interruptible("test_node")
+    def node():
+        cancellation.own(done)
+        cancellation.own(pending)
+        cancellation.cancel()
+        cancellation.check()
+
+    with pytest.raises(Cancelled):
+        node()
+    entries = read_journal(journal)
+    assert len(entries) == 1
+    assert entries[0].pop("time")
+    assert entries[0] == {"event": "cancelled", "node": "test_node", "task_id": "task-1",
+                          "task_type": "text2video", "endpoint": "/v1/videos/text2video"}
+
+    # 任务之后在后台完成，结果追加到任务日志
+    pending.finish("succeed", {"task_result": {"videos": [{"id": "v1", "url": "https://example.com/v.mp4"}]}})
+    finished = read_journal(journal)[-1]
+    assert (finished["event"], finished["task_id"], finished["urls"]) == (
+        "finished", "task-1", ["https://example.com/v.mp4"])
+
+
+def test_other_nodes_tasks_not_journaled(journal):
+    other = handle("other-node")
+    cancellation.own(other)
+
+    @cancellation.interruptible("test_node")
+    def node():
+        raise Cancelled()
+
+    with pytest.raises(Cancelled):
+        node()
+    assert not journal.exists()
+
+
+def test_converted_to_comfy_interrupt(journal, comfy):
+    @cancellation.interruptible("test_node")
+    def node():
+        comfy.interrupted = True
+        cancellation.sleep(5)
+
+    with pytest.raises(InterruptProcessingException):
+        node()
+
+
+def test_nested_nodes_convert_only_at_outermost(journal, comfy):
+    inner_task = handle("inner-task")
+
+    @cancellation.interruptible("inner_node")
+    def inner():
+        cancellation.own(inner_task)
+        comfy.interrupted = True
+        cancellation.check()
+
+    @cancellation.interruptible("outer_node")
+    def outer():
+        try:
+            inner()
+        except Exception:
+            return ("swallowed",)
+
+    with pytest.raises(InterruptProcessingException):
+        outer()
+    # 内层的任务登记到外层，只记录一次
+    assert [(entry["node"], entry["task_id"]) for entry in read_journal(journal)] == [("outer_node", "inner-task")]
+
+
+def test_async_node_and_worker_threads(journal, comfy):
+    worker_task = handle("worker-task")
+
+    def submit():
+        cancellation.own(worker_task)
+
+    @cancellation.interruptible("async_node")
+    async def node():
+        # 工作线程通过profiler.bind把任务登记到当前节点
+        thread = threading.Thread(target=profiler.bind(submit))
+        thread.start()
+        thread.join()
+        comfy.interrupted = True
+        await asyncio.sleep(0)
+        cancellation.check()
+
+    with pytest.raises(InterruptProcessingException):
+        asyncio.run(node())
+    assert read_journal(journal)[0]["task_id"] == "worker-task"
@@ -0,0 +1,95 @@
+import time
+
+from nodes.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def make_breaker(**kwargs):
+    kwargs.setdefault("error_rate", 0.5)
+    kwargs.setdefault("min_requests", 4)
+    kwargs.setdefault("window_seconds", 60)
+    kwargs.setdefault("open_seconds", 0.2)
+    return CircuitBreaker("/v1/test", **kwargs)
+
+
+def trip(breaker):
+    for _ in range(breaker.min_requests):
+        breaker.record(False, "HTTP 500")
+    assert breaker.state == OPEN
+
+
+def test_stays_closed_below_min_requests():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(False, "HTTP 500")
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_stays_closed_below_error_rate():
+    breaker = make_breaker()
+    for ok in (True, True, True, False, True, False):
+        breaker.record(ok, "" if ok else "HTTP 500")
+    assert breaker.state == CLOSED
+
+
+def test_opens_at_error_rate_and_rejects():
+    breaker = make_breaker()
+    for ok in (True, False, True, False):
+        breaker.record(ok, "" if ok else "HTTP 502")
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_after() <= 0.2
+    snapshot = breaker.snapshot()
+    assert snapshot["state"] == OPEN
+    assert snapshot["last_error"] == "HTTP 502"
+
+
+def test_old_outcomes_leave_the_window():
+    breaker = make_breaker(window_seconds=0.1)
+    for _ in range(3):
+        breaker.record(False, "HTTP 500")
+    time.sleep(0.15)
+    breaker.record(False, "HTTP 500")
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_single_probe():
+    breaker = make_breaker()
+    trip(breaker)
+    time.sleep(0.25)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_probe_success_closes():
+    breaker = make_breaker()
+    trip(breaker)
+    time.sleep(0.25)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["requests"] == 0
+    assert breaker.allow()
+
+
+def test_probe_failure_reopens():
+    breaker = make_breaker()
+    trip(breaker)
+    time.sleep(0.25)
+    assert breaker.allow()
+    breaker.record(False, "timeout")
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.snapshot()["last_error"] == "timeout"
+
+
+def test_abandoned_probe_releases_slot():
+    breaker = make_breaker()
+    trip(breaker)
+    time.sleep(0.25)
+    assert breaker.allow()
+    # 试探请求被取消：不计入结果，下一个请求可以继续试探
+    breaker.record(None)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from nodes import hedging
+from nodes.hedging import Hedger
+
+
+class Response:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def outcomes(key):
+    return {sample["labels"]["outcome"]: sample["value"] for sample in hedging.HEDGED_REQUESTS.snapshot()
+            if sample["labels"]["endpoint"] == key}
+
+
+def warmed(key, seconds=0.01, max_ratio=1.0):
+    """已有足够耗时样本的对冲器，阈值为样本的p95"""
+    hedger = Hedger(max_ratio=max_ratio, max_workers=4)
+    for _ in range(hedging.MIN_SAMPLES):
+        hedger._observe(key, seconds)
+    return hedger
+
+
+def slow_first(first_seconds, responses):
+    """第一次调用很慢，之后的调用立即返回"""
+    calls = []
+    lock = threading.Lock()
+
+    def func():
+        with lock:
+            calls.append(len(calls))
+            index = calls[-1]
+        if index == 0:
+            time.sleep(first_seconds)
+        return responses[index]
+    return func, calls
+
+
+def test_delay_is_p95_of_recent_latencies():
+    hedger = Hedger(max_ratio=1.0)
+    assert hedger.delay("key") == hedging.DEFAULT_DELAY
+    for index in range(100):
+        hedger._observe("key", index / 100)
+    assert hedger.delay("key") == pytest.approx(0.94)
+    for _ in range(hedging.MIN_SAMPLES):
+        hedger._observe("fast", 0.0)
+        hedger._observe("slow", 100.0)
+    assert hedger.delay("fast") == hedging.MIN_DELAY
+    assert hedger.delay("slow") == hedging.MAX_DELAY
+
+
+def test_fast_request_not_hedged():
+    hedger = warmed("fast-key")
+    func, calls = slow_first(0, [Response("primary")])
+    assert hedger.call("fast-key", func).name == "primary"
+    assert len(calls) == 1
+    assert outcomes("fast-key") == {}
+
+
+def test_slow_primary_hedged_past_p95():
+    hedger = warmed("slow-key", seconds=0.1)
+    primary, hedge = Response("primary"), Response("hedge")
+    func, calls = slow_first(2, [primary, hedge])
+    start = time.monotonic()
+    assert hedger.call("slow-key", func) is hedge
+    # 阈值约0.1秒，不必等原请求的2秒
+    assert time.monotonic() - start < 1
+    assert len(calls) == 2
+    assert outcomes("slow-key") == {"hedge_won": 1}
+    # 原请求之后返回的响应被关闭
+    deadline = time.monotonic() + 5
+    while not primary.closed and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert primary.closed
+
+
+def test_hedge_ratio_capped():
+    hedger = warmed("capped-key", max_ratio=0)
+    func, calls = slow_first(0.3, [Response("primary"), Response("hedge")])
+    assert hedger.call("capped-key", func).name == "primary"
+    assert len(calls) == 1
+    assert outcomes("capped-key") == {"capped": 1}
+
+
+def test_both_failures_raise_primary_error():
+    hedger = warmed("failing-key")
+    attempts = []
+
+    def func():
+        attempts.append(1)
+        time.sleep(0.2)
+        raise ConnectionError(f"attempt {len(attempts)}")
+
+    with pytest.raises(ConnectionError):
+        hedger.call("failing-key", func)
+    assert len(attempts) == 2
+    assert outcomes("failing-key") == {"failed": 1}
+
+
+def test_disabled_runs_once(monkeypatch):
+    monkeypatch.setenv("KLING_HEDGE", "0")
+    func, calls = slow_first(0, [Response("primary")])
+    assert hedging.call("disabled-key", func).name == "primary"
+    assert len(calls) == 1
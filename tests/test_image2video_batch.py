@@ -0,0 +1,59 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from nodes import image2video_batch
+from nodes.image2video_batch import KLingAIImage2VideoBatch
+
+
+def frames(count, width=512, height=512):
+    """只带shape的IMAGE批次替身，[B, H, W, C]"""
+    return SimpleNamespace(shape=(count, height, width, 3))
+
+
+def test_per_frame_jobs():
+    node = KLingAIImage2VideoBatch()
+    assert node.plan_jobs(frames(3), None, "per_frame") == [(0, None, None), (1, None, None), (2, None, None)]
+    assert node.plan_jobs(frames(2), frames(1), "per_frame") == [(0, "image_tail", 0), (1, "image_tail", 0)]
+    assert node.plan_jobs(frames(2), frames(2), "per_frame") == [(0, "image_tail", 0), (1, "image_tail", 1)]
+    with pytest.raises(ValueError, match="尾帧数量"):
+        node.plan_jobs(frames(3), frames(2), "per_frame")
+
+
+def test_consecutive_pairs_jobs():
+    node = KLingAIImage2VideoBatch()
+    assert node.plan_jobs(frames(3), None, "consecutive_pairs") == [(0, "image", 1), (1, "image", 2)]
+    with pytest.raises(ValueError, match="至少需要2帧"):
+        node.plan_jobs(frames(1), None, "consecutive_pairs")
+
+
+def test_consecutive_pairs_rejects_image_tail():
+    with pytest.raises(ValueError, match="image_tail"):
+        KLingAIImage2VideoBatch().plan_jobs(frames(3), frames(1), "consecutive_pairs")
+
+
+def test_batch_submits_every_frame(simulator, monkeypatch):
+    sim = simulator()
+    # 编码依赖torch/PIL，这里只关心每个任务拿到的是哪一帧
+    monkeypatch.setattr(image2video_batch, "encode_frame",
+                        lambda tensor, index, use_media_staging: f"{tensor.name}-{index}")
+    image = SimpleNamespace(shape=(3, 512, 512, 3), name="image")
+
+    task_ids, statuses, handles, errors_json = KLingAIImage2VideoBatch().create_image2video_tasks(
+        "token", image, pairing="consecutive_pairs", external_task_id="job")[:4]
+    assert len(set(task_ids)) == 2
+    assert statuses == ["submitted", "submitted"]
+    assert json.loads(errors_json) == []
+    payloads = [sim.tasks[task_id].payload for task_id in task_ids]
+    assert [(p["image"], p["image_tail"], p["external_task_id"]) for p in payloads] == [
+        ("image-0", "image-1", "job-0"), ("image-1", "image-2", "job-1")]
+    for handle in handles:
+        handle.finish("failed", error="test done")
+
+
+def test_batch_reports_validation_error():
+    result = KLingAIImage2VideoBatch().create_image2video_tasks(
+        "token", frames(3), image_tail=frames(1), pairing="consecutive_pairs")
+    assert result[:3] == ([], [], [])
+    assert "image_tail" in json.loads(result[3])[0]["message"]
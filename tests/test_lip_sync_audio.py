@@ -0,0 +1,88 @@
+import os
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+from nodes import lip_sync_async
+from nodes.lip_sync_async import UPLOAD_SAMPLE_RATE, KLingAILipSyncAsync
+
+
+class FakeSegment:
+    """pydub.AudioSegment替身：按毫秒切片，导出时写入固定大小的文件并记录参数"""
+
+    exports = []
+
+    def __init__(self, duration_ms, channels=2, frame_rate=44100):
+        self.duration_ms = duration_ms
+        self.channels = channels
+        self.frame_rate = frame_rate
+        self.raw_data = b"\0" * (duration_ms * 10)
+
+    def __len__(self):
+        return self.duration_ms
+
+    def __getitem__(self, item):
+        return FakeSegment(item.stop - item.start, self.channels, self.frame_rate)
+
+    def set_channels(self, channels):
+        return FakeSegment(self.duration_ms, channels, self.frame_rate)
+
+    def set_frame_rate(self, frame_rate):
+        return FakeSegment(self.duration_ms, self.channels, frame_rate)
+
+    def export(self, path, **kwargs):
+        FakeSegment.exports.append((os.path.basename(path), self.channels, self.frame_rate, kwargs))
+        with open(path, "wb") as f:
+            f.write(b"a" * self.duration_ms)
+
+
+@pytest.fixture
+def fake_pydub(monkeypatch):
+    FakeSegment.exports = []
+    monkeypatch.setattr(lip_sync_async, "pydub", SimpleNamespace(
+        AudioSegment=SimpleNamespace(from_file=lambda path, format: FakeSegment(25000))))
+    return FakeSegment.exports
+
+
+def test_segments_reencoded_to_mono_mp3(tmp_path, fake_pydub):
+    files = KLingAILipSyncAsync().split_audio("speech.wav", 10, str(tmp_path), upload_codec="mp3", upload_bitrate=48)
+    # 25秒按10秒切分，最后5秒的片段同样保留
+    assert [os.path.basename(path) for path in files] == ["segment_000.mp3", "segment_001.mp3", "segment_002.mp3"]
+    assert sorted(fake_pydub)[0] == ("segment_000.mp3", 1, UPLOAD_SAMPLE_RATE,
+                                     {"format": "mp3", "codec": "libmp3lame", "bitrate": "48k"})
+
+
+def test_m4a_uses_aac_in_ipod_container(tmp_path, fake_pydub):
+    files = KLingAILipSyncAsync().split_audio("speech.wav", 10, str(tmp_path), upload_codec="m4a")
+    assert all(path.endswith(".m4a") for path in files)
+    assert {tuple(sorted(kwargs.items())) for _, _, _, kwargs in fake_pydub} == {
+        (("bitrate", "64k"), ("codec", "aac"), ("format", "ipod"))}
+
+
+def test_source_codec_keeps_original_format(tmp_path, fake_pydub):
+    files = KLingAILipSyncAsync().split_audio("speech.wav", 10, str(tmp_path))
+    assert all(path.endswith(".wav") for path in files)
+    assert {(channels, frame_rate, tuple(kwargs.items())) for _, channels, frame_rate, kwargs in fake_pydub} == {
+        (2, 44100, (("format", "wav"),))}
+
+
+def test_short_tail_segment_skipped(tmp_path, monkeypatch, fake_pydub):
+    monkeypatch.setattr(lip_sync_async.pydub.AudioSegment, "from_file", lambda path, format: FakeSegment(21500))
+    files = KLingAILipSyncAsync().split_audio("speech.wav", 10, str(tmp_path), upload_codec="mp3")
+    assert len(files) == 2
+
+
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="需要ffmpeg")
+def test_real_mp3_smaller_than_wav(tmp_path):
+    pydub = pytest.importorskip("pydub")
+    from pydub.generators import Sine
+
+    wav = str(tmp_path / "speech.wav")
+    Sine(440).to_audio_segment(duration=4000).set_channels(2).export(wav, format="wav")
+
+    files = KLingAILipSyncAsync().split_audio(wav, 10, str(tmp_path), upload_codec="mp3")
+    assert len(files) == 1
+    encoded = pydub.AudioSegment.from_file(files[0])
+    assert (encoded.channels, encoded.frame_rate) == (1, UPLOAD_SAMPLE_RATE)
+    assert os.path.getsize(files[0]) * 10 < os.path.getsize(wav)
@@ -0,0 +1,123 @@
+import os
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from nodes.media_staging import CLEANUP_GRACE, STAGED_PREFIX, LocalHTTPBackend, MediaStager
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = LocalHTTPBackend(root_dir=str(tmp_path), public_url="http://media.example.com", port=0,
+                               secret="test-secret")
+    yield backend
+    if backend.server is not None:
+        backend.server.shutdown()
+        backend.server.server_close()
+
+
+def fetch_status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, b""
+
+
+def test_sign_and_verify(backend):
+    expires = int(time.time()) + 60
+    signature = backend.sign("abc.mp3", expires)
+    assert backend.verify("abc.mp3", str(expires), signature)
+    assert not backend.verify("abd.mp3", str(expires), signature)
+    assert not backend.verify("abc.mp3", str(expires + 1), signature)
+    assert not backend.verify("abc.mp3", str(expires), signature[:-1] + "0")
+    assert not backend.verify("abc.mp3", "not-a-number", signature)
+
+
+def test_expired_signature_rejected(backend):
+    expires = int(time.time()) - 1
+    assert not backend.verify("abc.mp3", str(expires), backend.sign("abc.mp3", expires))
+
+
+def test_signature_depends_on_secret(tmp_path):
+    first = LocalHTTPBackend(root_dir=str(tmp_path), public_url="http://x", secret="one")
+    second = LocalHTTPBackend(root_dir=str(tmp_path), public_url="http://x", secret="two")
+    assert first.sign("k", 1) != second.sign("k", 1)
+
+
+def test_path_for_stays_in_root(backend, tmp_path):
+    path = backend.path_for("../../etc/passwd")
+    assert os.path.dirname(path) == str(tmp_path)
+    assert os.path.basename(path) == f"{STAGED_PREFIX}passwd"
+
+
+def test_signed_url_requires_public_url_before_starting_server(tmp_path):
+    backend = LocalHTTPBackend(root_dir=str(tmp_path), public_url="", port=0)
+    backend.public_url = ""
+    with pytest.raises(ValueError, match="KLING_STAGING_PUBLIC_URL"):
+        backend.signed_url("k.mp3", 60)
+    assert backend.server is None
+
+
+def test_public_bind_needs_opt_in(tmp_path, monkeypatch):
+    monkeypatch.delenv("KLING_STAGING_ALLOW_PUBLIC_BIND", raising=False)
+    backend = LocalHTTPBackend(root_dir=str(tmp_path), public_url="http://x", host="0.0.0.0", port=0)
+    with pytest.raises(ValueError, match="KLING_STAGING_ALLOW_PUBLIC_BIND"):
+        backend.ensure_server()
+
+
+def test_publish_serves_signed_url_only(backend, tmp_path):
+    backend.ensure_server()
+    backend.public_url = f"http://127.0.0.1:{backend.port}"
+    stager = MediaStager(backend, ttl=60)
+    source = tmp_path / "voice.mp3"
+    source.write_bytes(b"audio-bytes")
+
+    url = stager.publish_file(str(source))
+    assert fetch_status(url) == (200, b"audio-bytes")
+    assert fetch_status(url.replace("sig=", "sig=0"))[0] == 403
+    assert fetch_status(url.split("?")[0])[0] == 403
+
+
+def test_same_content_uploaded_once(backend, monkeypatch):
+    stager = MediaStager(backend, ttl=60)
+    monkeypatch.setattr(backend, "ensure_server", lambda: None)
+    uploads = []
+    put_file = backend.put_file
+    monkeypatch.setattr(backend, "put_file", lambda *args: uploads.append(args[0]) or put_file(*args))
+
+    first = stager.publish_bytes(b"same", ".jpg")
+    second = stager.publish_bytes(b"same", ".jpg")
+    stager.publish_bytes(b"other", ".jpg")
+    assert first.split("?")[0] == second.split("?")[0]
+    assert len(uploads) == 2
+
+
+def test_cleanup_only_removes_stale_staged_files(backend, tmp_path):
+    stale = time.time() - 3600 - CLEANUP_GRACE - 10
+    unrelated = tmp_path / "my_notes.txt"
+    unrelated.write_text("keep me")
+    os.utime(unrelated, (stale, stale))
+    old = backend.path_for("old.jpg")
+    fresh = backend.path_for("fresh.jpg")
+    for path in (old, fresh):
+        with open(path, "wb") as f:
+            f.write(b"x")
+    os.utime(old, (stale, stale))
+
+    assert backend.cleanup(3600 + CLEANUP_GRACE) == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(fresh)
+    assert unrelated.read_text() == "keep me"
+
+
+def test_stager_forgets_expired_uploads(backend, monkeypatch):
+    monkeypatch.setattr(backend, "ensure_server", lambda: None)
+    stager = MediaStager(backend, ttl=60)
+    stager.publish_bytes(b"data", ".png")
+    key = next(iter(stager.uploaded))
+    stager.uploaded[key] -= 61
+    stager.cleanup()
+    assert key not in stager.uploaded
@@ -0,0 +1,75 @@
+import pytest
+
+from nodes import metrics
+from nodes.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_counter_render_and_label_check():
+    counter = Counter("test_requests_total", "requests", ("endpoint",))
+    counter.inc(endpoint="/a")
+    counter.inc(2, endpoint='/b"x')
+    assert counter.render() == [
+        "# HELP test_requests_total requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{endpoint="/a"} 1',
+        'test_requests_total{endpoint="/b\\"x"} 2',
+    ]
+    with pytest.raises(ValueError):
+        counter.inc(status="200")
+
+
+def test_gauge_set_and_dec():
+    gauge = Gauge("test_in_flight", "in flight")
+    gauge.set(3)
+    gauge.dec()
+    assert gauge.snapshot() == [{"labels": {}, "value": 2}]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+    lines = histogram.render()
+    assert 'test_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_seconds_count 4" in lines
+    snapshot, = histogram.snapshot()
+    assert snapshot["sum"] == pytest.approx(5.65)
+    assert snapshot["buckets"] == {"0.1": 2, "1.0": 1, "+Inf": 1}
+
+
+def test_registry_returns_existing_metric():
+    registry = Registry()
+    first = registry.register(Counter("test_total", "first"))
+    assert registry.register(Counter("test_total", "second")) is first
+    first.inc()
+    assert registry.render_prometheus().endswith("test_total 1\n")
+    assert registry.snapshot()["test_total"]["samples"] == [{"labels": {}, "value": 1}]
+
+
+def in_flight(task_type):
+    for sample in metrics.TASKS_IN_FLIGHT.snapshot():
+        if sample["labels"] == {"task_type": task_type}:
+            return sample["value"]
+    return 0
+
+
+def test_task_lifecycle_updates_in_flight_and_duration():
+    metrics.task_submitted("metrics-task-1", "metrics-test", "kling-v1", "std")
+    metrics.task_submitted("metrics-task-1", "metrics-test", "kling-v1", "std")
+    assert in_flight("metrics-test") == 1
+
+    metrics.task_finished("metrics-task-1", "succeed")
+    metrics.task_finished("metrics-task-1", "succeed")
+    # 非本进程提交的任务不计入
+    metrics.task_finished("unknown-task", "failed")
+    assert in_flight("metrics-test") == 0
+    assert metrics.mean_task_duration("metrics-test") is not None
+
+
+def test_record_download():
+    before = {s["labels"]["kind"]: s["value"] for s in metrics.DOWNLOAD_BYTES.snapshot()}.get("metrics-test", 0)
+    metrics.record_download("metrics-test", 1000, 0.5)
+    after = {s["labels"]["kind"]: s["value"] for s in metrics.DOWNLOAD_BYTES.snapshot()}["metrics-test"]
+    assert after - before == 1000
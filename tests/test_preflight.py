@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+
+from nodes import preflight
+from nodes.preflight import PreflightError, validate
+
+TEXT2VIDEO = "/v1/videos/text2video"
+IMAGE2VIDEO = "/v1/videos/image2video"
+MULTI_IMAGE2VIDEO = "/v1/videos/multi-image2video"
+IMAGE_GENERATION = "/v1/images/generations"
+LIP_SYNC = "/v1/videos/lip-sync"
+
+
+def tensor(width, height):
+    """只带shape的IMAGE替身，[B, H, W, C]"""
+    return SimpleNamespace(shape=(1, height, width, 3))
+
+
+def test_valid_text2video_passes():
+    assert validate(TEXT2VIDEO, "kling-v1", prompt="a cat", negative_prompt="", cfg_scale=0.5, duration="5") == []
+
+
+@pytest.mark.parametrize("fields, expected", [
+    ({"prompt": ""}, "正向提示词不能为空"),
+    ({"prompt": "   "}, "正向提示词不能为空"),
+    ({"prompt": "x" * 2501}, "不能超过2500字符"),
+    ({"prompt": "a", "negative_prompt": "x" * 2501}, "负向提示词不能超过2500字符"),
+    ({"prompt": "a", "cfg_scale": 1.5}, "cfg_scale必须在0.0到1.0之间"),
+    ({"prompt": "a", "duration": "7"}, "视频时长只支持5/10秒"),
+])
+def test_text2video_rules(fields, expected):
+    problems = validate(TEXT2VIDEO, **fields)
+    assert len(problems) == 1
+    assert expected in problems[0]
+
+
+def test_unsupported_model():
+    problems = validate(MULTI_IMAGE2VIDEO, "kling-v1", prompt="a")
+    assert problems == ["模型kling-v1不支持此接口，可选: kling-v1-6"]
+
+
+def test_prompt_limit_differs_per_endpoint():
+    assert validate(TEXT2VIDEO, prompt="x" * 600) == []
+    assert validate(IMAGE_GENERATION, prompt="x" * 600) == ["正向提示词不能超过500字符（当前600字符）"]
+
+
+def test_all_problems_reported_together():
+    with pytest.raises(PreflightError) as info:
+        preflight.check(TEXT2VIDEO, "kling-v9", prompt="", cfg_scale=2, duration="3")
+    assert len(info.value.problems) == 4
+    assert isinstance(info.value, ValueError)
+
+
+@pytest.mark.parametrize("size, expected", [
+    ((1280, 720), None),
+    ((300, 300), None),
+    ((299, 600), "尺寸299x600过小"),
+    ((1000, 300), "宽高比3.33超出范围（1:2.5 ~ 2.5:1）"),
+    ((300, 800), "宽高比0.38超出范围（1:2.5 ~ 2.5:1）"),
+])
+def test_image_rules(size, expected):
+    problems = validate(IMAGE2VIDEO, image=tensor(*size))
+    if expected is None:
+        assert problems == []
+    else:
+        assert len(problems) == 1
+        assert expected in problems[0]
+
+
+def test_image_tail_and_pil_size():
+    problems = validate(IMAGE2VIDEO, image=SimpleNamespace(size=(640, 480)), image_tail=tensor(100, 100))
+    assert problems == ["尾帧图像尺寸100x100过小，宽高至少300px"]
+
+
+def test_image_urls_not_checked():
+    assert validate(IMAGE2VIDEO, image="https://example.com/a.png") == []
+
+
+def test_images_max_count_skips_empty_slots():
+    four = [tensor(512, 512)] * 4
+    assert validate(MULTI_IMAGE2VIDEO, prompt="a", images=four + [None]) == []
+    assert validate(MULTI_IMAGE2VIDEO, prompt="a", images=four * 2) == ["最多只能提供4张图片"]
+    problems = validate(MULTI_IMAGE2VIDEO, prompt="a", images=[tensor(512, 512), tensor(250, 400)])
+    assert problems == ["图片2尺寸250x400过小，宽高至少300px"]
+
+
+def test_lip_sync_text_limit():
+    assert validate(LIP_SYNC, text="x" * 120) == []
+    assert validate(LIP_SYNC, text="x" * 121) == ["文本内容不能超过120字符（当前121字符）"]
+
+
+def test_audio_file_rules(tmp_path):
+    ok = tmp_path / "voice.mp3"
+    ok.write_bytes(b"\0" * 1024)
+    assert validate(LIP_SYNC, audio_file=str(ok)) == []
+
+    wrong_format = tmp_path / "voice.ogg"
+    wrong_format.write_bytes(b"\0" * 1024)
+    assert validate(LIP_SYNC, audio_file=str(wrong_format)) == [
+        "音频文件格式.ogg不支持，仅支持mp3/wav/m4a/aac/acc"]
+
+    too_large = tmp_path / "long.wav"
+    too_large.write_bytes(b"\0" * (6 * 1024 * 1024))
+    assert validate(LIP_SYNC, audio_file=str(too_large)) == ["音频文件过大: 6.00MB，最大支持5MB"]
+
+    missing = str(tmp_path / "missing.mp3")
+    assert validate(LIP_SYNC, audio_file=missing) == [f"音频文件不存在: {missing}"]
+
+
+@pytest.mark.parametrize("camera_control, problems", [
+    (None, 0),
+    ({"type": "down_back"}, 0),
+    ({"type": "simple", "config": {"horizontal": 5, "zoom": 0}}, 0),
+    ({"type": "simple", "config": {"horizontal": 0, "zoom": 0}}, 1),
+    ({"type": "simple", "config": {"horizontal": 5, "zoom": -3}}, 1),
+])
+def test_camera_control(camera_control, problems):
+    assert len(validate(TEXT2VIDEO, prompt="a", camera_control=camera_control)) == problems
+
+
+def test_unknown_endpoint_has_no_rules():
+    assert validate("/v1/unknown", "any-model", prompt="") == []
@@ -0,0 +1,75 @@
+import json
+import time
+
+import pytest
+
+from nodes import previews
+from nodes.previews import INDEX_NAME, PreviewIndex, ThumbnailCache
+
+
+def read_index(output_dir):
+    path = output_dir / ".previews" / INDEX_NAME
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_record_is_queued_and_flushed_in_batch(tmp_path):
+    # 间隔很长：只有显式flush时写入
+    index = PreviewIndex(flush_seconds=3600)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.png").write_bytes(b"x" * 1024 * 1024)
+    entry = index.record(str(tmp_path), str(tmp_path / "sub" / "a.png"), "output", "image/png")
+    index.record(str(tmp_path), str(tmp_path / "b.mp4"), "output", "video/mp4")
+    assert (entry["filename"], entry["subfolder"], entry["format"]) == ("a.png", "sub", "image/png")
+    assert not (tmp_path / ".previews").exists()
+
+    index.flush()
+    entries = read_index(tmp_path)
+    assert [e["filename"] for e in entries] == ["a.png", "b.mp4"]
+    assert entries[0]["size"] == "1.00 MB"
+    # 文件不存在时只是没有size
+    assert "size" not in entries[1]
+    index.flush()
+    assert len(read_index(tmp_path)) == 2
+
+
+def test_entries_grouped_by_output_dir(tmp_path):
+    index = PreviewIndex(flush_seconds=3600)
+    for name in ("one", "two"):
+        (tmp_path / name).mkdir()
+        index.record(str(tmp_path / name), str(tmp_path / name / f"{name}.png"), "output", "image/png")
+    index.flush()
+    assert [e["filename"] for e in read_index(tmp_path / "one")] == ["one.png"]
+    assert [e["filename"] for e in read_index(tmp_path / "two")] == ["two.png"]
+
+
+def test_background_thread_flushes(tmp_path):
+    index = PreviewIndex(flush_seconds=0.05)
+    index.record(str(tmp_path), str(tmp_path / "a.png"), "output", "image/png")
+    deadline = time.monotonic() + 5
+    while not (tmp_path / ".previews" / INDEX_NAME).exists() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert [e["filename"] for e in read_index(tmp_path)] == ["a.png"]
+
+
+def test_full_batch_written_without_waiting(tmp_path, monkeypatch):
+    monkeypatch.setattr(previews, "MAX_BATCH", 3)
+    index = PreviewIndex(flush_seconds=3600)
+    for i in range(3):
+        index.record(str(tmp_path), str(tmp_path / f"{i}.png"), "output", "image/png")
+    deadline = time.monotonic() + 5
+    while not (tmp_path / ".previews" / INDEX_NAME).exists() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert len(read_index(tmp_path)) == 3
+
+
+def test_thumbnail_cache_evicts_least_recently_used():
+    Image = pytest.importorskip("PIL.Image")
+    cache = ThumbnailCache(size=32, max_entries=2)
+    thumbnail = cache.put("a", Image.new("RGB", (640, 320)))
+    assert thumbnail.size == (32, 16)
+    cache.put("b", Image.new("RGB", (64, 64)))
+    assert cache.get("a") is thumbnail
+    cache.put("c", Image.new("RGB", (64, 64)))
+    assert cache.get("b") is None
+    assert cache.data_url("a").startswith("data:image/jpeg;base64,")
+    assert cache.data_url("missing") == ""
@@ -0,0 +1,84 @@
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import time
+
+from nodes import profiler
+
+
+@profiler.profiled("TestNode")
+def slow_node(seconds):
+    with profiler.phase("request"):
+        time.sleep(seconds)
+        with profiler.phase("download"):
+            time.sleep(seconds)
+    profiler.annotate(task_id="task-1", empty="")
+    return ("done",)
+
+
+def test_profiled_appends_timings():
+    result, timings = slow_node(0.05)
+    assert result == "done"
+    entry = json.loads(timings)
+    assert entry["node"] == "TestNode"
+    assert entry["task_id"] == "task-1"
+    assert "empty" not in entry
+    # 嵌套期间外层阶段暂停，两个阶段各约0.05秒
+    assert 0.04 <= entry["phases"]["request"] < 0.09
+    assert 0.04 <= entry["phases"]["download"] < 0.09
+    assert entry["total"] >= entry["phases"]["request"] + entry["phases"]["download"]
+
+
+def test_profiled_async_node():
+    @profiler.profiled("AsyncNode")
+    async def node():
+        with profiler.phase("server_wait"):
+            await asyncio.sleep(0.02)
+        return ("ok",)
+
+    result, timings = asyncio.run(node())
+    assert result == "ok"
+    assert json.loads(timings)["phases"]["server_wait"] >= 0.015
+
+
+def test_phase_without_timer_is_noop():
+    assert profiler.current() is None
+    with profiler.phase("request"):
+        pass
+    profiler.record("request", 1.0)
+    profiler.annotate(task_id="x")
+
+
+def test_bind_carries_timer_into_worker_threads():
+    @profiler.profiled("PoolNode")
+    def node():
+        def work():
+            with profiler.phase("upload"):
+                time.sleep(0.02)
+            return profiler.current() is not None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            bound = [executor.submit(profiler.bind(work)).result() for _ in range(2)]
+            unbound = executor.submit(work).result()
+        return (bound, unbound)
+
+    bound, unbound, timings = node()
+    assert bound == [True, True]
+    assert unbound is False
+    # 工作线程中的阶段只累加耗时
+    assert json.loads(timings)["phases"]["upload"] >= 0.035
+
+
+def test_perf_log_written_and_pruned(tmp_path, monkeypatch):
+    monkeypatch.setenv("KLING_PERF_LOG", "1")
+    monkeypatch.setenv("KLING_PERF_LOG_DIR", str(tmp_path))
+    monkeypatch.setenv("KLING_PERF_LOG_DAYS", "2")
+    monkeypatch.setattr(profiler, "_pruned_for", None)
+    old = tmp_path / f"perf-{(datetime.date.today() - datetime.timedelta(days=5)).isoformat()}.jsonl"
+    old.write_text("{}\n", encoding="utf-8")
+
+    slow_node(0)
+    today = tmp_path / f"perf-{datetime.date.today().isoformat()}.jsonl"
+    assert json.loads(today.read_text(encoding="utf-8").splitlines()[-1])["node"] == "TestNode"
+    assert not old.exists()
@@ -0,0 +1,114 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from nodes import progress
+from nodes.task_tracker import TaskHandle
+
+
+class FakeServer:
+    last_node_id = "7"
+    last_prompt_id = "prompt-1"
+    client_id = "client-1"
+
+    def __init__(self):
+        self.events = []
+
+    def send_sync(self, event, data, sid=None):
+        self.events.append((event, data, sid))
+
+
+class FakeProgressBar:
+    def __init__(self, total):
+        self.total = total
+        self.updates = []
+
+    def update_absolute(self, value, total=None):
+        self.updates.append((value, total))
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """ComfyUI的PromptServer和comfy.utils.ProgressBar替身"""
+    server = FakeServer()
+    monkeypatch.setitem(sys.modules, "server", SimpleNamespace(PromptServer=SimpleNamespace(instance=server)))
+    monkeypatch.setitem(sys.modules, "comfy.utils", SimpleNamespace(ProgressBar=FakeProgressBar))
+    return server
+
+
+def handle(status, data=None, task_type="text2video"):
+    task = TaskHandle("task", "/v1/videos/text2video", "token", task_type)
+    task.status, task.data = status, data or {}
+    return task
+
+
+def test_task_fraction_by_status():
+    assert progress.task_fraction("submitted") == progress.SUBMITTED_FRACTION
+    assert progress.task_fraction("succeed") == progress.task_fraction("failed") == 1.0
+    assert progress.task_fraction("processing", {"process_progress": "50%"}) == pytest.approx(0.5)
+    assert progress.task_fraction("processing", {"process_progress": "100"}) == progress.PROCESSING_MAX
+    assert progress.task_fraction("processing") == progress.PROCESSING_MIN
+
+
+def test_task_fraction_estimates_from_elapsed_time(monkeypatch):
+    monkeypatch.setenv("KLING_EXPECTED_TASK_SECONDS", "100")
+    monkeypatch.setattr(progress.metrics, "mean_task_duration", lambda task_type: None)
+    assert progress.task_fraction("processing", started_at=time.time() - 50) == pytest.approx(0.5, abs=0.01)
+    created_at_ms = (time.time() - 1000) * 1000
+    assert progress.task_fraction("processing", {"created_at": created_at_ms}) == progress.PROCESSING_MAX
+
+
+def test_updates_throttled_but_finish_forced(server):
+    reporter = progress.ProgressReporter("node", interval=60)
+    assert reporter.update(10, text="a")
+    assert not reporter.update(20, text="b")
+    assert not reporter.update(10, text="a", force=False)
+    assert reporter.update(100, text="done", force=True)
+    assert reporter.bar.updates == [(10, 100), (100, 100)]
+    assert [data["text"] for _, data, _ in server.events] == ["a", "done"]
+    event, data, sid = server.events[0]
+    assert (event, sid) == (progress.PROGRESS_EVENT, "client-1")
+    assert (data["node_id"], data["prompt_id"], data["value"], data["max"]) == ("7", "prompt-1", 10, 100)
+
+
+def test_reporting_decorator_and_report_tasks(server, monkeypatch):
+    monkeypatch.setenv("KLING_PROGRESS_INTERVAL", "0")
+
+    @progress.reporting("batch")
+    def node():
+        done = handle("succeed")
+        done.done.set()
+        progress.report_tasks([done, handle("submitted")], completed=2)
+        return ("ok",)
+
+    assert node() == ("ok",)
+    texts = [data["text"] for _, data, _ in server.events]
+    assert texts == ["3/4", "done"]
+    # 2个已处理完 + 1个完成 + 1个刚提交
+    assert server.events[0][1]["value"] == round((3 + progress.SUBMITTED_FRACTION) / 4 * 100)
+    assert server.events[-1][1]["value"] == 100
+
+
+def test_bind_reports_from_worker_thread(server, monkeypatch):
+    monkeypatch.setenv("KLING_PROGRESS_INTERVAL", "0")
+
+    @progress.reporting("download")
+    def node():
+        thread = threading.Thread(target=progress.bind(progress.report_download), args=(512 * 1024, 1024 * 1024))
+        thread.start()
+        thread.join()
+        return ()
+
+    node()
+    assert server.events[0][1]["value"] == 50
+    assert server.events[0][1]["text"] == "download 0.5 MB / 1.0 MB"
+
+
+def test_no_reporter_outside_node():
+    assert progress.current() is None
+    progress.update(1)
+    progress.fraction(0.5)
+    progress.report_download(1, 2)
@@ -0,0 +1,61 @@
+import pytest
+
+TOKEN = "test-token"
+
+
+def submit(sim, endpoint, **payload):
+    from nodes import api_client
+
+    response = api_client.post(f"{sim.base_url}{endpoint}", json=payload, timeout=10)
+    return response.json()["data"]["task_id"]
+
+
+def test_image_task_returns_all_urls(simulator):
+    sim = simulator()
+    from nodes.query_status import KLingAIQueryStatus
+
+    task_id = submit(sim, "/v1/images/generations", prompt="a dog", n=3)
+    node = KLingAIQueryStatus()
+    url, image_id, urls, ids = node.poll_status(TOKEN, task_id, "", "image-generation", 0, 0.2, max_retries=50)
+    assert urls == [f"{sim.base_url}/assets/{task_id}_{i}.png" for i in range(3)]
+    assert ids == ["0", "1", "2"]
+    assert (url, image_id) == (urls[0], "0")
+    assert node.result_kind == "image"
+
+
+def test_returns_placeholder_image_without_load_images(simulator):
+    torch = pytest.importorskip("torch")
+    sim = simulator()
+    from nodes.query_status import KLingAIQueryStatus
+
+    task_id = submit(sim, "/v1/videos/text2video", prompt="a dog")
+    url, _, _, _, images = KLingAIQueryStatus().query_task_status(
+        TOKEN, task_id, task_type="text2video", initial_delay_seconds=0, poll_interval_seconds=0.2)[:5]
+    assert url.startswith(sim.base_url)
+    assert isinstance(images, torch.Tensor)
+    assert tuple(images.shape) == (1, 64, 64, 3)
+
+
+def test_returns_placeholder_image_on_error():
+    torch = pytest.importorskip("torch")
+    from nodes.query_status import KLingAIQueryStatus
+
+    url, _, urls, _, images = KLingAIQueryStatus().query_task_status("", "task")[:5]
+    assert url.startswith("参数验证错误")
+    assert urls == []
+    assert isinstance(images, torch.Tensor)
+
+
+def test_load_images_decodes_every_result(simulator):
+    pytest.importorskip("torch")
+    pytest.importorskip("PIL")
+    sim = simulator()
+    from nodes.query_status import KLingAIQueryStatus
+
+    task_id = submit(sim, "/v1/images/generations", prompt="a dog", n=2)
+    _, _, urls, ids, images = KLingAIQueryStatus().query_task_status(
+        TOKEN, task_id, task_type="image-generation", initial_delay_seconds=0, poll_interval_seconds=0.2,
+        load_images=True)[:5]
+    assert len(urls) == 2
+    assert ids == ["0", "1"]
+    assert tuple(images.shape) == (2, 64, 64, 3)
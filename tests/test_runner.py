@@ -0,0 +1,94 @@
+import base64
+import json
+
+import pytest
+
+from nodes.runner import BatchRunner, StateFile, TokenSource, inline_files, read_manifest
+
+
+def write_manifest(path, *jobs):
+    path.write_text("\n".join(json.dumps(job) for job in jobs) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def make_runner(tmp_path, **kwargs):
+    out = tmp_path / "out"
+    return BatchRunner(TokenSource("test-token"), str(out), StateFile(str(tmp_path / "state.json")),
+                       str(tmp_path / "results.jsonl"), concurrency=2, timeout=30, base_dir=str(tmp_path), **kwargs)
+
+
+def read_results(tmp_path):
+    return [json.loads(line) for line in (tmp_path / "results.jsonl").read_text(encoding="utf-8").splitlines()]
+
+
+def test_read_manifest_fills_ids_and_validates(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text('{"type": "text2video", "prompt": "a"}\n\n# 注释\n{"id": "b", "type": "image2video"}\n',
+                    encoding="utf-8")
+    assert [job["id"] for job in read_manifest(str(path))] == ["job-1", "b"]
+
+    write_manifest(path, {"type": "unknown"})
+    with pytest.raises(ValueError, match="任务类型不支持"):
+        read_manifest(str(path))
+    write_manifest(path, {"id": "a", "type": "text2video"}, {"id": "a", "type": "text2video"})
+    with pytest.raises(ValueError, match="重复"):
+        read_manifest(str(path))
+
+
+def test_inline_files_encodes_local_paths_only(tmp_path):
+    (tmp_path / "cat.png").write_bytes(b"png-bytes")
+    payload = inline_files({"image": "cat.png", "image_tail": "https://example.com/a.png",
+                            "prompt": "cat.png", "subject_image_list": [{"subject_image": "missing.png"}]},
+                           str(tmp_path))
+    assert payload["image"] == base64.b64encode(b"png-bytes").decode("utf-8")
+    assert payload["image_tail"] == "https://example.com/a.png"
+    assert payload["prompt"] == "cat.png"
+    assert payload["subject_image_list"] == [{"subject_image": "missing.png"}]
+
+
+def test_runs_manifest_and_records_results(simulator, tmp_path):
+    sim = simulator()
+    jobs = read_manifest(write_manifest(tmp_path / "jobs.jsonl",
+                                        {"id": "a", "type": "text2video", "prompt": "a"},
+                                        {"id": "b", "type": "text2video", "prompt": "b"},
+                                        {"id": "c", "type": "text2video", "prompt": "c", "duration": "7"}))
+    summary = make_runner(tmp_path).run(jobs)
+    assert summary == {"total": 3, "skipped": 0, "succeed": 2, "failed": 1}
+
+    records = {record["id"]: record for record in read_results(tmp_path)}
+    assert records["a"]["status"] == records["b"]["status"] == "succeed"
+    assert records["a"]["urls"] == [f"{sim.base_url}/assets/{records['a']['task_id']}.mp4"]
+    assert records["a"]["outputs"] == [str(tmp_path / "out" / "a.mp4")]
+    assert (tmp_path / "out" / "a.mp4").read_bytes() == sim.mp4_bytes
+    assert "视频时长只支持5/10秒" in records["c"]["error"]
+    # 本地校验失败的任务不会提交
+    assert sim.stats["submitted"] == 2
+
+
+def test_rerun_skips_finished_and_retries_failed(simulator, tmp_path):
+    sim = simulator(failure_rate=1.0)
+    jobs = read_manifest(write_manifest(tmp_path / "jobs.jsonl", {"id": "a", "type": "text2video", "prompt": "a"}))
+    assert make_runner(tmp_path, download=False).run(jobs)["failed"] == 1
+
+    assert make_runner(tmp_path, download=False).run(jobs) == {"total": 1, "skipped": 1, "succeed": 0, "failed": 0}
+    assert sim.stats["submitted"] == 1
+
+    make_runner(tmp_path, download=False).run(jobs, retry_failed=True)
+    assert sim.stats["submitted"] == 2
+
+
+def test_resumes_submitted_task_without_resubmitting(simulator, tmp_path):
+    from nodes import api_client
+
+    sim = simulator()
+    task_id = api_client.post(f"{sim.base_url}/v1/videos/text2video", json={"prompt": "a"},
+                              timeout=10).json()["data"]["task_id"]
+    runner = make_runner(tmp_path, download=False)
+    # 模拟上次运行在提交后中断
+    runner.state.update("a", task_id=task_id, endpoint="/v1/videos/text2video", status="submitted")
+
+    summary = runner.run([{"id": "a", "type": "text2video", "prompt": "a"}])
+    assert summary["succeed"] == 1
+    assert sim.stats["submitted"] == 1
+    assert read_results(tmp_path)[0]["task_id"] == task_id
+    assert StateFile(str(tmp_path / "state.json")).get("a")["status"] == "succeed"
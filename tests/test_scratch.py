@@ -0,0 +1,128 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from nodes import scratch
+from nodes.scratch import KEEP_MARKER, LOCK_FILE, ScratchQuotaExceeded, ScratchSpace
+
+
+@pytest.fixture
+def space(tmp_path):
+    space = ScratchSpace(str(tmp_path / "scratch"), job_quota=0, max_age=3600, max_total=0, gc_interval=3600)
+    # 视为刚清理过：测试中只在显式调用时清理
+    space.gc_started_at = time.monotonic()
+    return space
+
+
+def make_dir(space, name, size=0, age=0, lock=None):
+    path = os.path.join(space.root, name)
+    os.makedirs(path)
+    with open(os.path.join(path, "data.bin"), "wb") as f:
+        f.write(b"x" * size)
+    if lock is not None:
+        with open(os.path.join(path, LOCK_FILE), "w", encoding="utf-8") as f:
+            f.write(lock)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_job_lifecycle(space):
+    job = space.job("lip_sync")
+    assert os.path.isdir(job.subdir("videos"))
+    assert open(os.path.join(job.path, LOCK_FILE)).read() == f"{os.getpid()} {socket.gethostname()}"
+    assert job.path in space.active
+    job.finish()
+    assert not os.path.exists(job.path)
+    assert job.path not in space.active
+
+    kept = space.job("lip_sync")
+    kept.finish(keep=True)
+    assert os.path.exists(os.path.join(kept.path, KEEP_MARKER))
+    assert not os.path.exists(os.path.join(kept.path, LOCK_FILE))
+
+
+def test_job_quota(space):
+    job = space.job("lip_sync")
+    job.quota = 10
+    with open(os.path.join(job.path, "big.bin"), "wb") as f:
+        f.write(b"x" * 20)
+    with pytest.raises(ScratchQuotaExceeded):
+        job.check()
+
+
+def test_gc_removes_expired_and_keeps_active(space):
+    old = make_dir(space, "old", age=7200)
+    fresh = make_dir(space, "fresh")
+    active = space.job("lip_sync")
+    os.utime(active.path, (time.time() - 7200,) * 2)
+    os.makedirs(space.cache_dir("segments"))
+    os.utime(os.path.join(space.root, scratch.CACHE_DIR_NAME), (time.time() - 7200,) * 2)
+
+    assert space.collect_garbage() == (1, 0)
+    assert not os.path.exists(old)
+    assert os.path.exists(fresh)
+    assert os.path.exists(active.path)
+    assert os.path.exists(space.cache_dir("segments"))
+
+
+def test_gc_enforces_total_size_oldest_first(space):
+    space.max_total = 250
+    oldest = make_dir(space, "a", size=100, age=300)
+    kept = make_dir(space, "b", size=100, age=200)
+    open(os.path.join(kept, KEEP_MARKER), "w").close()
+    middle = make_dir(space, "c", size=100, age=100)
+    newest = make_dir(space, "d", size=100)
+
+    removed, freed = space.collect_garbage()
+    # keep_artifacts保留的目录只按时间清理，跳过后继续删除下一个
+    assert (removed, freed) == (2, 200)
+    assert not os.path.exists(oldest) and not os.path.exists(middle)
+    assert os.path.exists(kept) and os.path.exists(newest)
+
+
+def test_gc_skips_dirs_locked_by_live_process(space):
+    host = socket.gethostname()
+    live = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        in_use = make_dir(space, "in_use", age=7200, lock=f"{live.pid} {host}")
+        crashed = make_dir(space, "crashed", age=7200, lock=f"{dead_pid()} {host}")
+        remote = make_dir(space, "remote", age=7200, lock=f"{live.pid} other-host")
+        assert space.collect_garbage()[0] == 2
+    finally:
+        live.kill()
+        live.wait()
+    assert os.path.exists(in_use)
+    assert not os.path.exists(crashed)
+    # 其他主机的目录无法检查进程，仍按时间清理
+    assert not os.path.exists(remote)
+
+
+def test_gc_never_removes_remote_dirs_for_size(space):
+    space.max_total = 50
+    remote = make_dir(space, "remote", size=100, lock="1 other-host")
+    assert space.collect_garbage() == (0, 0)
+    assert os.path.exists(remote)
+
+
+def test_new_jobs_trigger_periodic_gc(space, monkeypatch):
+    collected = threading.Event()
+    monkeypatch.setattr(space, "collect_garbage", collected.set)
+    space.gc_started_at = None
+    space.job("a")
+    assert collected.wait(5)
+    # 间隔内不再重复清理
+    assert not space.collect_in_background()
+    space.gc_interval = 0
+    assert space.collect_in_background()
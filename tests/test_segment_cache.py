@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from nodes import segment_cache
+from nodes.segment_cache import SegmentCache
+
+
+@pytest.fixture
+def audio(tmp_path):
+    path = tmp_path / "segment.mp3"
+    path.write_bytes(b"audio-1")
+    return path
+
+
+def write_video(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"v" * size)
+    return str(path)
+
+
+def test_key_depends_on_audio_content_and_params(tmp_path, audio):
+    cache = SegmentCache(str(tmp_path / "cache"))
+    key = cache.key("https://example.com/v.mp4", str(audio), mode="audio2video")
+    copy = tmp_path / "copy.mp3"
+    copy.write_bytes(b"audio-1")
+    # 同样内容的音频文件得到同一个key，与文件名无关
+    assert cache.key("https://example.com/v.mp4", str(copy), mode="audio2video") == key
+    assert cache.key("https://example.com/v2.mp4", str(audio), mode="audio2video") != key
+    assert cache.key("https://example.com/v.mp4", str(audio), mode="text2video") != key
+    audio.write_bytes(b"audio-2")
+    assert cache.key("https://example.com/v.mp4", str(audio), mode="audio2video") != key
+
+
+def test_put_then_get(tmp_path):
+    cache = SegmentCache(str(tmp_path / "cache"))
+    assert cache.get("k") == (None, None)
+
+    cached = cache.put("k", write_video(tmp_path, "seg.mp4", 10), task_id="task-1")
+    path, meta = cache.get("k")
+    assert path == cached
+    assert open(path, "rb").read() == b"v" * 10
+    assert meta["task_id"] == "task-1"
+    assert "cached_at" in meta
+    assert not [name for name in os.listdir(tmp_path / "cache") if name.endswith(".tmp")]
+
+
+def test_entry_without_metadata_is_a_miss(tmp_path):
+    cache = SegmentCache(str(tmp_path / "cache"))
+    cache.put("k", write_video(tmp_path, "seg.mp4", 10))
+    os.remove(tmp_path / "cache" / "k.json")
+    assert cache.get("k") == (None, None)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = SegmentCache(str(tmp_path / "cache"), max_bytes=250)
+    for index, key in enumerate(("a", "b")):
+        cache.put(key, write_video(tmp_path, f"{key}.mp4", 100))
+        os.utime(tmp_path / "cache" / f"{key}.mp4", (1000 + index, 1000 + index))
+    # 读取a会刷新它的使用时间，超过上限时先删除b
+    cache.get("a")
+    cache.put("c", write_video(tmp_path, "c.mp4", 100))
+
+    assert cache.get("b") == (None, None)
+    assert not (tmp_path / "cache" / "b.json").exists()
+    assert cache.get("a")[0] is not None
+    assert cache.get("c")[0] is not None
+
+
+def test_newest_entry_kept_even_if_over_limit(tmp_path):
+    cache = SegmentCache(str(tmp_path / "cache"), max_bytes=50)
+    assert cache.put("big", write_video(tmp_path, "big.mp4", 100)) is not None
+    assert cache.get("big")[0] is not None
+
+
+def test_get_segment_cache_reads_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(segment_cache, "_cache", None)
+    monkeypatch.setenv("KLING_SEGMENT_CACHE_DIR", str(tmp_path / "segments"))
+    monkeypatch.setenv("KLING_SEGMENT_CACHE_MAX_MB", "0.5")
+    cache = segment_cache.get_segment_cache()
+    assert cache.root == str(tmp_path / "segments")
+    assert cache.max_bytes == 512 * 1024
+    assert segment_cache.get_segment_cache() is cache
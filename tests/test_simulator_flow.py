@@ -0,0 +1,133 @@
+"""提交 -> 查询 -> 下载 的完整流程，对本地模拟服务（nodes/simulator.py）运行"""
+import os
+import time
+
+TOKEN = "test-token"
+
+
+def submit(base_url, endpoint, **payload):
+    from nodes import api_client
+
+    response = api_client.post(f"{base_url}{endpoint}", json=payload, timeout=10)
+    assert response.status_code == 200
+    return response.json()["data"]["task_id"]
+
+
+def test_text2video_submit_track_and_download(simulator, tmp_path):
+    sim = simulator()
+    from nodes.admission import get_admission
+    from nodes.text2video import KLingAIText2Video
+    from nodes.video_downloader import KLingAIVideoDownloader
+
+    result = KLingAIText2Video().create_video_task(TOKEN, "a cat on a skateboard")
+    task_id, handle = result[0], result[5]
+    assert task_id in sim.tasks
+    assert result[1] == "submitted"
+
+    assert handle.wait(10)
+    assert handle.status == "succeed"
+    (url, video_id), = handle.result_urls()
+    assert url == f"{sim.base_url}/assets/{task_id}.mp4"
+    # 任务结束后并发额度自动归还
+    assert get_admission().in_flight == 0
+
+    downloader = KLingAIVideoDownloader.__new__(KLingAIVideoDownloader)
+    downloader.default_output_dir = str(tmp_path)
+    downloader.type = "video"
+    path = downloader.download_video(url, "test", str(tmp_path))[0]
+    assert os.path.isfile(path)
+    assert os.path.getsize(path) == len(sim.mp4_bytes)
+    assert sim.stats["submitted"] == 1
+    assert sim.stats["downloads"] == 1
+
+
+def test_query_status_polls_until_succeed(simulator):
+    sim = simulator()
+    from nodes.query_status import KLingAIQueryStatus
+
+    task_id = submit(sim.base_url, "/v1/videos/text2video", prompt="a dog")
+    url, video_id, urls, ids = KLingAIQueryStatus().poll_status(
+        TOKEN, task_id, "", "text2video", initial_delay_seconds=0, poll_interval_seconds=0.2, max_retries=50)
+    assert url == f"{sim.base_url}/assets/{task_id}.mp4"
+    assert video_id == f"{task_id}-video"
+    assert urls == [url]
+    assert sim.stats["queries"] >= 2
+
+
+def test_query_status_reports_failed_task(simulator):
+    sim = simulator(failure_rate=1.0)
+    from nodes.query_status import KLingAIQueryStatus
+
+    task_id = submit(sim.base_url, "/v1/videos/text2video", prompt="a dog")
+    result = KLingAIQueryStatus().poll_status(
+        TOKEN, task_id, "", "text2video", initial_delay_seconds=0, poll_interval_seconds=0.2, max_retries=50)
+    assert "Simulated failure" in result[0]
+    assert result[1] == ""
+
+
+def test_simulator_checks_jwt(simulator):
+    from nodes import api_client
+    from nodes.simulator import make_token
+
+    sim = simulator(require_auth=True, access_key="ak", secret_key="sk")
+    url = f"{sim.base_url}/v1/videos/text2video"
+    good = {"Authorization": f"Bearer {make_token('ak', 'sk')}"}
+    bad = {"Authorization": f"Bearer {make_token('ak', 'wrong')}"}
+    assert api_client.post(url, headers=good, json={"prompt": "a"}, timeout=10).status_code == 200
+    response = api_client.post(url, headers=bad, json={"prompt": "a"}, timeout=10)
+    assert response.status_code == 401
+    assert response.json()["code"] == 1002
+    assert sim.stats["unauthorized"] == 1
+
+
+def test_simulator_concurrency_limit(simulator):
+    from nodes import api_client
+
+    sim = simulator(max_concurrent_tasks=1, completion_seconds=30)
+    url = f"{sim.base_url}/v1/videos/text2video"
+    assert api_client.post(url, json={"prompt": "a"}, timeout=10).status_code == 200
+    response = api_client.post(url, json={"prompt": "b"}, timeout=10)
+    assert response.status_code == 429
+    assert response.json()["code"] == 1303
+
+
+def test_simulator_lists_newest_first(simulator):
+    from nodes import api_client
+
+    sim = simulator()
+    task_ids = [submit(sim.base_url, "/v1/videos/text2video", prompt=str(i)) for i in range(3)]
+    response = api_client.get(f"{sim.base_url}/v1/videos/text2video?pageNum=1&pageSize=2", timeout=10)
+    assert [task["task_id"] for task in response.json()["data"]] == task_ids[:0:-1]
+    response = api_client.get(f"{sim.base_url}/v1/videos/text2video?pageNum=2&pageSize=2", timeout=10)
+    assert [task["task_id"] for task in response.json()["data"]] == task_ids[:1]
+
+
+def test_status_reuse_keeps_poll_rate(simulator):
+    """同一调用方按间隔轮询时每次都要真正查询，复用的只是半个间隔内其他调用方的结果"""
+    sim = simulator(completion_seconds=30)
+    from nodes import api_client
+
+    task_id = submit(sim.base_url, "/v1/videos/text2video", prompt="a dog")
+    url = f"{sim.base_url}/v1/videos/text2video/{task_id}"
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+
+    api_client.get_status(url, headers=headers, poll_interval=1.0)
+    api_client.get_status(url, headers=headers, poll_interval=1.0)
+    assert sim.stats["queries"] == 1
+
+    time.sleep(0.6)
+    api_client.get_status(url, headers=headers, poll_interval=1.0)
+    assert sim.stats["queries"] == 2
+
+
+def test_tracker_polls_once_per_interval(simulator, monkeypatch):
+    monkeypatch.setenv("KLING_POLL_INTERVAL", "0.5")
+    sim = simulator(completion_seconds=30)
+    from nodes.task_tracker import track_task
+
+    task_id = submit(sim.base_url, "/v1/videos/text2video", prompt="a dog")
+    handle = track_task(task_id, "/v1/videos/text2video", TOKEN, "text2video")
+    time.sleep(2.6)
+    # 0, 0.5, 1.0 ... 2.5秒各查询一次
+    assert 5 <= sim.stats["queries"] <= 7
+    handle.finish("failed", error="test done")
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from nodes import cancellation
+from nodes.single_flight import SingleFlight
+
+
+class Counter:
+    def __init__(self, result="ok", delay=0.0, error=None):
+        self.calls = 0
+        self.result = result
+        self.delay = delay
+        self.error = error
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_result_reused_within_max_age():
+    flight = SingleFlight()
+    func = Counter()
+    assert flight.do("k", func, max_age=0.3) == "ok"
+    assert flight.do("k", func, max_age=0.3) == "ok"
+    assert func.calls == 1
+
+
+def test_stale_result_requested_again():
+    flight = SingleFlight()
+    func = Counter()
+    flight.do("k", func, max_age=0.1)
+    time.sleep(0.15)
+    flight.do("k", func, max_age=0.1)
+    assert func.calls == 2
+
+
+def test_max_age_is_per_caller():
+    flight = SingleFlight()
+    func = Counter()
+    flight.do("k", func, max_age=1.0)
+    time.sleep(0.1)
+    # 只接受0.05秒内结果的调用方重新请求
+    flight.do("k", func, max_age=0.05)
+    flight.do("k", func, max_age=1.0)
+    assert func.calls == 2
+
+
+def test_zero_max_age_never_cached():
+    flight = SingleFlight()
+    func = Counter()
+    flight.do("k", func)
+    flight.do("k", func)
+    assert func.calls == 2
+
+
+def test_concurrent_calls_share_one_request():
+    flight = SingleFlight()
+    func = Counter(delay=0.2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", func))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["ok"] * 5
+    assert func.calls == 1
+
+
+def test_keys_are_independent():
+    flight = SingleFlight()
+    func = Counter()
+    flight.do("a", func, max_age=1.0)
+    flight.do("b", func, max_age=1.0)
+    assert func.calls == 2
+
+
+def test_errors_not_cached():
+    flight = SingleFlight()
+    failing = Counter(error=RuntimeError("boom"))
+    with pytest.raises(RuntimeError):
+        flight.do("k", failing, max_age=1.0)
+    func = Counter()
+    assert flight.do("k", func, max_age=1.0) == "ok"
+    assert func.calls == 1
+
+
+def test_uncacheable_result_not_reused():
+    flight = SingleFlight()
+    func = Counter(result=429)
+    flight.do("k", func, max_age=1.0, cacheable=lambda result: result == 200)
+    flight.do("k", func, max_age=1.0, cacheable=lambda result: result == 200)
+    assert func.calls == 2
+
+
+def test_follower_retries_when_leader_cancelled():
+    flight = SingleFlight()
+    leader_started = threading.Event()
+
+    def leader_func():
+        leader_started.set()
+        time.sleep(0.2)
+        raise cancellation.Cancelled()
+
+    def lead():
+        with pytest.raises(cancellation.Cancelled):
+            flight.do("k", leader_func)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    leader_started.wait(1)
+    func = Counter()
+    # 等待中的调用方不应继承发起方的取消，而是自己重新请求
+    assert flight.do("k", func) == "ok"
+    assert func.calls == 1
+    leader.join()
@@ -0,0 +1,172 @@
+import base64
+import io
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from nodes import lip_sync_async, stream_merge
+from nodes.lip_sync_async import KLingAILipSyncAsync
+from nodes.scratch import ScratchSpace
+from nodes.segment_cache import SegmentCache
+from nodes.stream_merge import StreamingMerger
+
+
+class Input(io.BytesIO):
+    """合并进程的stdin，关闭后仍可读取写入的内容"""
+
+    def close(self):
+        pass
+
+
+class FakeProcess:
+    """ffmpeg替身：合并进程记录stdin，转换进程输出 "<输入>;"，传入另存路径时写出该文件"""
+
+    commands = []
+
+    def __init__(self, cmd, stdin=None, stdout=None, stderr=None):
+        FakeProcess.commands.append(cmd)
+        self.returncode = None
+        self.stdin = Input() if stdin is not None else None
+        source = cmd[cmd.index("-i") + 1]
+        self.stdout = io.BytesIO(f"{source};".encode("utf-8"))
+        self.stderr = io.BytesIO(b"")
+        if cmd[-2] == "mp4":
+            with open(cmd[-1], "wb") as f:
+                f.write(b"copy of " + source.encode("utf-8"))
+
+    def wait(self, timeout=None):
+        self.returncode = 0
+        return 0
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    FakeProcess.commands = []
+    monkeypatch.setattr(stream_merge.subprocess, "Popen", FakeProcess)
+    return FakeProcess.commands
+
+
+def test_segments_written_in_add_order(tmp_path, fake_ffmpeg):
+    merger = StreamingMerger(str(tmp_path / "out.mp4"), "audio.mp3")
+    merger.start()
+    assert merger.add("https://example.com/0.mp4", 0)
+    merger.skip(10, 10)
+    assert merger.add(str(tmp_path / "2.mp4"), 20)
+    assert merger.finish()
+    assert merger.process.stdin.getvalue() == f"https://example.com/0.mp4;{tmp_path / '2.mp4'};".encode("utf-8")
+    assert merger.gaps == [(10, 20)]
+    assert merger.segments == 2
+
+
+def test_commands(tmp_path, fake_ffmpeg, monkeypatch):
+    merger = StreamingMerger(str(tmp_path / "out.mp4"), "audio.mp3", sync_adjust_ms=200)
+    merger.start()
+    merger.add("https://example.com/0.mp4", 0, copy_to=str(tmp_path / "copy.mp4"))
+    merger.add(str(tmp_path / "1.mp4"), 10)
+    merge_cmd, url_cmd, file_cmd = fake_ffmpeg
+
+    # 默认不加faststart，避免写完后重写整个文件
+    assert "-movflags" not in merge_cmd
+    assert merge_cmd[merge_cmd.index("-itsoffset") + 1] == "0.2"
+    # 只有URL输入设置读超时（微秒）
+    assert url_cmd[url_cmd.index("-rw_timeout") + 1] == "60000000"
+    assert "-rw_timeout" not in file_cmd
+    assert url_cmd[-7:] == ["-map", "0", "-c", "copy", "-f", "mp4", str(tmp_path / "copy.mp4")]
+    assert (tmp_path / "copy.mp4").read_bytes() == b"copy of https://example.com/0.mp4"
+    assert file_cmd[-1] == "pipe:1"
+
+    monkeypatch.setenv("KLING_STREAM_FASTSTART", "1")
+    monkeypatch.setenv("KLING_STREAM_READ_TIMEOUT", "5")
+    merger = StreamingMerger(str(tmp_path / "out2.mp4"), "audio.mp3")
+    merger.start()
+    merger.add("https://example.com/0.mp4", 0)
+    assert fake_ffmpeg[-2][fake_ffmpeg[-2].index("-movflags") + 1] == "+faststart"
+    assert fake_ffmpeg[-1][fake_ffmpeg[-1].index("-rw_timeout") + 1] == "5000000"
+
+
+@pytest.fixture
+def node(tmp_path, monkeypatch):
+    """流式合并的口型同步节点：音频按片段切分由替身完成，临时目录和片段缓存放在tmp_path下"""
+    scratch = ScratchSpace(str(tmp_path / "scratch"), job_quota=0, gc_interval=3600)
+    scratch.gc_started_at = 0
+    monkeypatch.setattr(lip_sync_async, "get_scratch", lambda: scratch)
+    cache = SegmentCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(lip_sync_async, "get_segment_cache", lambda: cache)
+
+    def split_audio(self, audio_file_path, segment_duration, output_dir, *args):
+        paths = []
+        for index in range(4):
+            path = os.path.join(output_dir, f"segment_{index:03d}.mp3")
+            with open(path, "wb") as f:
+                f.write(f"audio {index}".encode("utf-8"))
+            paths.append(path)
+        return paths
+
+    monkeypatch.setattr(KLingAILipSyncAsync, "split_audio", split_audio)
+    (tmp_path / "speech.mp3").write_bytes(b"speech")
+    node = KLingAILipSyncAsync()
+    node.output_dir = str(tmp_path / "out")
+    os.makedirs(node.output_dir)
+    return node
+
+
+def run_stream(node, tmp_path):
+    return node.process_lip_sync_async("token", video_id="video-1", audio_type="file",
+                                       audio_file=str(tmp_path / "speech.mp3"), poll_interval_seconds=0.2,
+                                       merge_mode="stream")[0]
+
+
+def fed_sources(commands):
+    return [cmd[cmd.index("-i") + 1] for cmd in commands if "pipe:1" in cmd]
+
+
+def test_node_feeds_segments_in_order_and_caches_them(simulator, node, tmp_path, fake_ffmpeg):
+    # 任务耗时随机，完成顺序与片段顺序不同
+    sim = simulator(completion_seconds=0.5, completion_sigma=1.0, seed=3)
+    assert run_stream(node, tmp_path) == str(tmp_path / "out" / "lip_sync_combined.mp4")
+
+    sources = fed_sources(fake_ffmpeg)
+    completion = {task_id: task.completion_seconds for task_id, task in sim.tasks.items()}
+    task_order = sorted(sim.tasks, key=lambda task_id: base64.b64decode(
+        sim.tasks[task_id].payload["input"]["audio_file"]))
+    assert sorted(task_order, key=completion.get) != task_order
+    assert sources == [f"{sim.base_url}/assets/{task_id}.mp4" for task_id in task_order]
+    offsets = [cmd[cmd.index("-output_ts_offset") + 1] for cmd in fake_ffmpeg if "pipe:1" in cmd]
+    assert offsets == ["0", "10", "20", "30"]
+    cache = lip_sync_async.get_segment_cache()
+    assert len([name for name in os.listdir(cache.root) if name.endswith(".json")]) == 4
+
+    # 重新运行时全部片段来自缓存，不再提交
+    submitted = sim.stats["submitted"]
+    del fake_ffmpeg[:]
+    run_stream(node, tmp_path)
+    assert sim.stats["submitted"] == submitted
+    assert all(source.startswith(cache.root) for source in fed_sources(fake_ffmpeg))
+
+
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="需要ffmpeg")
+def test_real_ffmpeg_merge(tmp_path):
+    segments = []
+    for index in range(2):
+        path = str(tmp_path / f"{index}.mp4")
+        subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=64x64:rate=10:duration=1",
+                        "-pix_fmt", "yuv420p", path], check=True)
+        segments.append(path)
+    audio = str(tmp_path / "audio.m4a")
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=duration=2", audio], check=True)
+
+    merger = StreamingMerger(str(tmp_path / "out.mp4"), audio)
+    merger.start()
+    assert merger.add(segments[0], 0, copy_to=str(tmp_path / "copy.mp4"))
+    assert merger.add(segments[1], 1)
+    assert merger.finish()
+    assert os.path.getsize(tmp_path / "out.mp4") > 0
+    assert os.path.getsize(tmp_path / "copy.mp4") > 0
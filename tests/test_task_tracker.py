@@ -0,0 +1,108 @@
+from nodes import metrics
+from nodes.task_tracker import TaskHandle, get_tracker, track_task
+
+TOKEN = "test-token"
+ENDPOINT = "/v1/videos/text2video"
+
+
+def submit(sim, **payload):
+    from nodes import api_client
+
+    response = api_client.post(f"{sim.base_url}{ENDPOINT}", json=dict({"prompt": "a"}, **payload), timeout=10)
+    return response.json()["data"]["task_id"]
+
+
+def in_flight(task_type):
+    for sample in metrics.TASKS_IN_FLIGHT.snapshot():
+        if sample["labels"] == {"task_type": task_type}:
+            return sample["value"]
+    return 0
+
+
+def test_failed_handle_is_done_and_runs_callbacks():
+    handle = TaskHandle.failed("bad prompt", "text2video", ENDPOINT)
+    seen = []
+    handle.add_done_callback(seen.append)
+    assert handle.wait(0)
+    assert handle.status == "failed"
+    assert handle.error == "bad prompt"
+    assert seen == [handle]
+
+
+def test_tracked_task_succeeds_and_await_node_collects(simulator):
+    sim = simulator()
+    from nodes.await_task import KLingAIAwaitTask
+
+    task_id = submit(sim)
+    metrics.task_submitted(task_id, "tracker-test")
+    handle = track_task(task_id, ENDPOINT, TOKEN, "text2video")
+    url, video_id, returned_id, status = KLingAIAwaitTask().await_task_sync(handle, timeout_seconds=10)[:4]
+    assert url == f"{sim.base_url}/assets/{task_id}.mp4"
+    assert (returned_id, status) == (task_id, "succeed")
+    assert in_flight("tracker-test") == 0
+    assert get_tracker().pending() == []
+
+
+def test_unknown_task_fails_and_releases_in_flight(simulator):
+    simulator()
+    metrics.task_submitted("missing-task", "tracker-test-404")
+    assert in_flight("tracker-test-404") == 1
+
+    handle = track_task("missing-task", ENDPOINT, TOKEN, "text2video")
+    assert handle.wait(5)
+    assert handle.status == "failed"
+    assert "task not found" in handle.error
+    # 404/401的失败同样结束任务指标
+    assert in_flight("tracker-test-404") == 0
+
+
+def test_failed_task_reports_message(simulator):
+    sim = simulator(failure_rate=1.0)
+    handle = track_task(submit(sim), ENDPOINT, TOKEN, "text2video")
+    assert handle.wait(5)
+    assert handle.error == "任务失败: Simulated failure"
+
+
+def track_all(sim, count, monkeypatch, **env):
+    # 首次查询延后，所有任务登记后一起到期
+    for name, value in dict({"KLING_BULK_POLL_MIN": "3", "KLING_POLL_INITIAL_DELAY": "0.3"}, **env).items():
+        monkeypatch.setenv(name, value)
+    return [track_task(submit(sim), ENDPOINT, TOKEN, "text2video") for _ in range(count)]
+
+
+def test_many_tasks_polled_through_task_list(simulator, monkeypatch):
+    sim = simulator(completion_seconds=0)
+    handles = track_all(sim, 5, monkeypatch)
+    assert all(handle.wait(10) for handle in handles)
+    assert [handle.status for handle in handles] == ["succeed"] * 5
+    assert sim.stats["list_queries"] == 1
+    assert sim.stats["queries"] == 0
+
+
+def test_task_list_paginates(simulator, monkeypatch):
+    sim = simulator(completion_seconds=0)
+    handles = track_all(sim, 5, monkeypatch, KLING_LIST_PAGE_SIZE="2")
+    assert all(handle.wait(10) for handle in handles)
+    # 一轮批量查询翻3页（每页2个）即可找到全部5个任务
+    assert sim.stats["list_queries"] == 3
+    assert sim.stats["queries"] == 0
+
+
+def test_tasks_missing_from_list_polled_individually(simulator, monkeypatch):
+    sim = simulator()
+    handles = track_all(sim, 3, monkeypatch)
+    missing = track_task("missing-task", ENDPOINT, TOKEN, "text2video")
+    assert all(handle.wait(10) for handle in handles + [missing])
+    assert [handle.status for handle in handles] == ["succeed"] * 3
+    assert missing.status == "failed"
+    assert sim.stats["queries"] >= 1
+
+
+def test_falls_back_when_list_unsupported(simulator, monkeypatch):
+    sim = simulator()
+    # 超出列表接口允许的pageSize，模拟服务返回400
+    handles = track_all(sim, 3, monkeypatch, KLING_LIST_PAGE_SIZE="1000")
+    assert all(handle.wait(10) for handle in handles)
+    assert get_tracker().bulk_unsupported == {ENDPOINT}
+    assert sim.stats["list_queries"] == 1
+    assert sim.stats["queries"] >= 3
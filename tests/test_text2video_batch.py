@@ -0,0 +1,50 @@
+import json
+
+from nodes.text2video_batch import KLingAIText2VideoBatch, parse_prompt_rows
+
+
+def test_parse_prompt_rows():
+    rows = parse_prompt_rows('a cat\n\n  {"prompt": "a dog", "duration": "10"}\n{bad json\n')
+    assert rows[0] == {"prompt": "a cat"}
+    assert rows[1] == {"prompt": "a dog", "duration": "10"}
+    assert rows[2]["prompt"] == ""
+    assert rows[2]["parse_error"].startswith("JSON解析失败")
+
+
+def test_rows_take_node_defaults_unless_overridden():
+    defaults = {"model_name": "kling-v1", "negative_prompt": "", "cfg_scale": 0.5, "mode": "std",
+                "aspect_ratio": "16:9", "duration": "5"}
+    rows = KLingAIText2VideoBatch().build_rows('{"prompt": "a", "mode": "pro"}', ["b", " "], defaults)
+    assert [(row["prompt"], row["mode"], row["duration"]) for row in rows] == [("a", "pro", "5"), ("b", "std", "5")]
+
+
+def test_batch_submits_in_order_and_reports_row_errors(simulator):
+    sim = simulator()
+    prompts = 'first\n{"prompt": "bad duration", "duration": "7"}\n{broken\nlast'
+    task_ids, urls, _, statuses, handles, errors_json = KLingAIText2VideoBatch().create_video_tasks(
+        ["token"], [prompts], max_concurrency=[3], timeout_seconds=[60])[:6]
+
+    assert statuses == ["succeed", "failed", "failed", "succeed"]
+    assert urls[0] == f"{sim.base_url}/assets/{task_ids[0]}.mp4"
+    assert urls[3] == f"{sim.base_url}/assets/{task_ids[3]}.mp4"
+    assert task_ids[1] == task_ids[2] == ""
+    errors = json.loads(errors_json)
+    assert [error["index"] for error in errors] == [1, 2]
+    assert "视频时长只支持5/10秒" in errors[0]["message"]
+    # 本地校验失败的行不会发出请求
+    assert sim.stats["submitted"] == 2
+
+
+def test_batch_without_waiting_returns_handles(simulator):
+    simulator(completion_seconds=30)
+    task_ids, _, _, statuses, handles = KLingAIText2VideoBatch().create_video_tasks(
+        ["token"], ["a\nb"], wait_for_results=[False])[:5]
+    assert all(task_ids)
+    assert statuses == ["submitted", "submitted"]
+    for handle in handles:
+        handle.finish("failed", error="test done")
+
+
+def test_batch_needs_token_and_prompts():
+    result = KLingAIText2VideoBatch().create_video_tasks([""], ["a"])
+    assert json.loads(result[5]) == [{"index": None, "message": "API令牌不能为空"}]
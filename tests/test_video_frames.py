@@ -0,0 +1,67 @@
+import os
+import shutil
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from nodes import video_frames
+from nodes.stream_merge import StderrDrain
+from nodes.video_frames import KLingAIVideoFrames, output_size
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(video_frames, "folder_paths", SimpleNamespace(
+        get_output_directory=lambda: str(tmp_path / "output"), get_temp_directory=lambda: str(tmp_path / "temp")))
+    return tmp_path / "output"
+
+
+def test_output_size_keeps_aspect_and_even_sides():
+    assert output_size(1280, 720, 0, 0) == (1280, 720)
+    assert output_size(1280, 720, 640, 0) == (640, 360)
+    assert output_size(1280, 720, 0, 101) == (180, 101)
+    assert output_size(1280, 720, 300, 300) == (300, 300)
+
+
+def test_stderr_drain_prevents_pipe_deadlock():
+    # 先写满stderr管道（远超64KB）再写stdout；不在后台读取stderr时子进程会一直阻塞
+    script = ("import sys\n"
+              "for _ in range(500): sys.stderr.write('x' * 1000 + '\\n')\n"
+              "sys.stderr.write('last line\\n'); sys.stdout.write('done')")
+    process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    drain = StderrDrain(process.stderr)
+    try:
+        assert process.stdout.read() == b"done"
+    finally:
+        process.kill()
+        process.wait(5)
+    assert drain.text().splitlines()[-1] == "last line"
+
+
+def test_download_goes_straight_to_output_dir(simulator, output_dir):
+    from nodes import api_client
+
+    sim = simulator(completion_seconds=0)
+    task_id = api_client.post(f"{sim.base_url}/v1/videos/text2video", json={"prompt": "a"},
+                              timeout=10).json()["data"]["task_id"]
+    path = KLingAIVideoFrames().download(f"{sim.base_url}/assets/{task_id}.mp4")
+    assert os.path.dirname(path) == str(output_dir)
+    assert os.path.getsize(path) == len(sim.mp4_bytes)
+
+
+@pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")), reason="需要ffmpeg和ffprobe")
+def test_decode_with_stride_and_scale(tmp_path, output_dir):
+    pytest.importorskip("numpy")
+    pytest.importorskip("torch")
+    video = str(tmp_path / "test.mp4")
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=320x240:rate=10:duration=2",
+                    "-pix_fmt", "yuv420p", video], check=True)
+
+    frames, count, fps, path = KLingAIVideoFrames().decode_frames(video, frame_stride=2, width=160)[:4]
+    assert count == 10
+    assert tuple(frames.shape) == (10, 120, 160, 3)
+    assert fps == pytest.approx(5.0)
+    assert 0.0 <= float(frames.min()) and float(frames.max()) <= 1.0
+    assert path == video